@@ -1,4 +1,4 @@
-# Combined CLI (ingest + discover) always registered; async-aware dispatcher
+# Combined CLI (ingest + discover + batch + viario) always registered; async-aware dispatcher
 import argparse, sys, inspect, asyncio
 
 try:
@@ -20,16 +20,35 @@ try:
 except Exception as e:
     DISCOVER_AVAILABLE = False
     run_discover_and_download = None
+try:
+    from pipelines.batch_ingest import load_city_configs, parse_cities, run_batch
+except Exception as e:
+    run_batch = None
+try:
+    from pipelines.osm_viario_pipeline import run_viario
+except Exception as e:
+    run_viario = None
+
+try:
+    from services.download_profiles import profile_names
+    PROFILE_CHOICES = profile_names()
+except Exception:
+    PROFILE_CHOICES = None
+
+try:
+    from services.transport import run as _run_async
+except Exception:
+    _run_async = asyncio.run
 
 def _call(func, *args, **kwargs):
     if func is None:
         print("Comando indisponível neste build.", file=sys.stderr)
         sys.exit(2)
     if inspect.iscoroutinefunction(func):
-        return asyncio.run(func(*args, **kwargs))
+        return _run_async(func(*args, **kwargs))
     res = func(*args, **kwargs)
     if inspect.iscoroutine(res):
-        return asyncio.run(res)
+        return _run_async(res)
     return res
 
 def main():
@@ -46,6 +65,10 @@ def main():
     f.add_argument("--outdir", default="out")
     f.add_argument("--interactive", action="store_true",
                    help="(opcional) listar fontes e excluir por índices antes de baixar")
+    f.add_argument("--sync", action="store_true",
+                   help="sincronização incremental: só baixa camadas/feições editadas desde a última execução")
+    f.add_argument("--profile", choices=PROFILE_CHOICES, default=None,
+                   help="perfil de download (campos/precisão/generalização); padrão: por tema")
 
     d = sub.add_parser("discover", help="Crawler interativo: lista todas as camadas ArcGIS e permite excluir")
     d.add_argument("--city", required=True)
@@ -54,6 +77,49 @@ def main():
     d.add_argument("--outputs", default="geojson")
     d.add_argument("--outdir", default="out")
     d.add_argument("--roots", default="")
+    d.add_argument("--concurrency", type=int, default=16,
+                   help="máximo de requisições simultâneas no crawler")
+    d.add_argument("--per-host", type=int, default=4,
+                   help="máximo de requisições simultâneas por servidor")
+    d.add_argument("--no-cache", action="store_true",
+                   help="ignora o cache local de metadados (FLOWS_CACHE_DIR)")
+    d.add_argument("--sync", action="store_true",
+                   help="sincronização incremental: só baixa camadas/feições editadas desde a última execução")
+    d.add_argument("--profile", choices=PROFILE_CHOICES, default=None,
+                   help="perfil de download: full (padrão), analysis ou display")
+    d.add_argument("--no-clip", action="store_true",
+                   help="não recorta as consultas pelo limite do município")
+
+    b = sub.add_parser("batch", help="Ingestão de várias cidades num único processo (limites de conexão compartilhados)")
+    b.add_argument("--cities", default="",
+                   help="lista 'Cidade/UF' separada por vírgula; vazio = todos os YAML de --config-dir")
+    b.add_argument("--config-dir", default="config/cities")
+    b.add_argument("--max-cities", type=int, default=4,
+                   help="máximo de cidades ingeridas ao mesmo tempo")
+    b.add_argument("--concurrency", type=int, default=32,
+                   help="máximo de requisições simultâneas somando todas as cidades")
+    b.add_argument("--per-host", type=int, default=4,
+                   help="máximo de requisições simultâneas por servidor, somando todas as cidades")
+    b.add_argument("--outputs", default="geojson,kmz")
+    b.add_argument("--mode", default="catalog,ai")
+    b.add_argument("--what", default="core")
+    b.add_argument("--outdir", default="out")
+    b.add_argument("--sync", action="store_true",
+                   help="sincronização incremental: só baixa camadas/feições editadas desde a última execução")
+    b.add_argument("--profile", choices=PROFILE_CHOICES, default=None,
+                   help="perfil de download (campos/precisão/generalização); padrão: por tema")
+
+    v = sub.add_parser("viario", help="Malha viária a partir de um extrato .osm.pbf local (sem Overpass)")
+    v.add_argument("--pbf", required=True, help="extrato .osm.pbf (ex.: parana-latest.osm.pbf)")
+    v.add_argument("--city", default=None)
+    v.add_argument("--state", default=None)
+    v.add_argument("--bbox", default="",
+                   help="xmin,ymin,xmax,ymax em graus; sobrepõe --city/--state")
+    v.add_argument("--classes", default="",
+                   help="classes de highway separadas por vírgula; vazio = vias trafegáveis por carro")
+    v.add_argument("--workers", type=int, default=None,
+                   help="processos para decodificar os blocos do extrato")
+    v.add_argument("--outdir", default="out")
 
     args = p.parse_args()
     if args.cmd == "ingest":
@@ -66,6 +132,34 @@ def main():
             modes=[x.strip() for x in args.mode.split(",") if x.strip()],
             what=args.what, outdir=args.outdir,
             interactive=getattr(args, "interactive", False),
+            sync=args.sync, profile=args.profile,
+        )
+    elif args.cmd == "batch":
+        if run_batch is None:
+            print("Batch indisponível: falha ao importar pipelines.batch_ingest.run_batch.", file=sys.stderr)
+            sys.exit(2)
+        cities = parse_cities(args.cities) if args.cities.strip() else load_city_configs(args.config_dir)
+        if not cities:
+            print("Nenhuma cidade informada (--cities) ou configurada em --config-dir.", file=sys.stderr)
+            sys.exit(2)
+        return _call(run_batch,
+            cities=cities,
+            outputs=[x.strip() for x in args.outputs.split(",") if x.strip()],
+            modes=[x.strip() for x in args.mode.split(",") if x.strip()],
+            what=args.what, outdir=args.outdir,
+            max_cities=args.max_cities, concurrency=args.concurrency, per_host=args.per_host,
+            sync=args.sync, profile=args.profile,
+        )
+    elif args.cmd == "viario":
+        bbox = tuple(float(x) for x in args.bbox.split(",")) if args.bbox.strip() else None
+        if bbox is not None and len(bbox) != 4:
+            print("--bbox espera xmin,ymin,xmax,ymax.", file=sys.stderr)
+            sys.exit(2)
+        return _call(run_viario,
+            pbf=args.pbf, outdir=args.outdir,
+            city=args.city, state=args.state, bbox=bbox,
+            classes=[x.strip() for x in args.classes.split(",") if x.strip()] or None,
+            workers=args.workers,
         )
     else:
         if not DISCOVER_AVAILABLE:
@@ -77,6 +171,9 @@ def main():
             outputs=[x.strip() for x in args.outputs.split(",") if x.strip()],
             outdir=args.outdir,
             roots=[x.strip() for x in args.roots.split(",") if x.strip()],
+            concurrency=args.concurrency, per_host=args.per_host,
+            use_cache=not args.no_cache, sync=args.sync, profile=args.profile,
+            clip=not args.no_clip,
         )
 
 if __name__ == "__main__":
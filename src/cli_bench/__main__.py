@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable, Dict, List, Tuple
+
+import httpx
+
+from devtools.fake_arcgis import SERVICES_PATH, FakeArcGIS
+from services.transport import metrics, run
+
+
+def _serve(port: int, options: Dict[str, Any]) -> None:
+    FakeArcGIS(**options).serve_forever(port=port)
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_ready(base: str, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base}/__stats", timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise RuntimeError("fake ArcGIS nao respondeu")
+
+
+def _items(result: Any) -> int:
+    # feicoes de uma FeatureCollection ou camadas de um crawl
+    if isinstance(result, dict):
+        return len(result.get("features") or [])
+    if isinstance(result, list):
+        return len(result)
+    return 0
+
+
+def _run(base: str, call: Callable[[], Any], trace: bool) -> Tuple[Any, float, int, str | None]:
+    httpx.post(f"{base}/__reset")
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result, error = None, None
+    try:
+        result = call()
+    except Exception as exc:  # noqa: BLE001 - o relatorio registra a falha e segue
+        error = f"{type(exc).__name__}: {exc}"
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace:
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, elapsed, peak, error
+
+
+def _measure(base: str, name: str, setup: Callable[[], Callable[[], Any]]) -> Dict[str, Any]:
+    """Time one scenario, then run it again under tracemalloc for the memory peak.
+
+    ``setup`` prepares fresh state (caches, warm-up) outside the measurement and returns the
+    call to measure. The timed run is separate because tracemalloc slows allocations down a lot.
+    """
+    call = setup()
+    metrics.snapshot(reset=True)
+    result, elapsed, _peak, error = _run(base, call, trace=False)
+    stats = httpx.get(f"{base}/__stats").json()
+    client = metrics.snapshot(reset=True)
+    # o servidor roda em outro processo: o tracemalloc so enxerga o cliente
+    _result, _elapsed, peak, _error = _run(base, setup(), trace=True)
+    items = _items(result)
+    report = {
+        "scenario": name,
+        "seconds": round(elapsed, 3),
+        "requests": stats["requests"],
+        "requests_per_s": round(stats["requests"] / elapsed, 1) if elapsed else None,
+        "items": items,
+        "items_per_s": round(items / elapsed, 1) if elapsed else None,
+        "mb_received": round(stats["bytes"] / 1e6, 2),
+        "server_failures": stats["failures"],
+        "client_retries": sum(host["retries"] for host in client.values()),
+        "not_modified": stats["not_modified"],
+        "peak_memory_mb": round(peak / 1e6, 2),
+    }
+    if error:
+        report["error"] = error
+    return report
+
+
+def _scenarios(root: str, profile: str | None) -> Dict[str, List[Tuple[str, Callable]]]:
+    from services.arcgis_discovery import crawl_all_layers, crawl_all_layers_async
+    from services.arcgis_download import fetch_geojson_paged_async
+    from services.http_cache import HttpMetadataCache
+    from services.sources_arcgis import try_arcgis_geojson
+    from utils.cache import DiskCache
+
+    layer = f"{root}/Pasta0/Servico0/MapServer/0/query"
+
+    def crawl():
+        return lambda: crawl_all_layers([root])
+
+    def crawl_cold():
+        # ttl=0: toda entrada esta vencida e e revalidada com If-None-Match
+        cache = HttpMetadataCache(ttl=0, store=DiskCache(f"bench_http_{uuid.uuid4().hex}"))
+        return lambda: run(crawl_all_layers_async([root], cache=cache))
+
+    def crawl_warm():
+        call = crawl_cold()
+        call()
+        return call
+
+    def paged():
+        return lambda: run(fetch_geojson_paged_async(layer, profile=profile))
+
+    def single():
+        # uma unica consulta: o servidor corta em maxRecordCount
+        return lambda: run(try_arcgis_geojson(layer, {"where": "1=1"}, profile=profile))
+
+    return {
+        "crawl": [
+            ("crawl_all_layers", crawl),
+            ("crawl_all_layers_cache_frio", crawl_cold),
+            ("crawl_all_layers_cache_revalidado", crawl_warm),
+        ],
+        "paged": [("fetch_geojson_paged", paged)],
+        "try": [("try_arcgis_geojson", single)],
+    }
+
+
+def run_benchmarks(options: Dict[str, Any], scenarios: List[str], profile: str | None) -> Dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=_serve, args=(port, options), daemon=True)
+    server.start()
+    try:
+        _wait_ready(base)
+        available = _scenarios(f"{base}{SERVICES_PATH}", profile)
+        reports = [
+            _measure(base, name, setup)
+            for group in scenarios
+            for name, setup in available.get(group, [])
+        ]
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        "server": options,
+        "layers_in_catalog": options["folders"] * options["services"] * options["layers"],
+        "results": reports,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser("flows-ia benchmark (fake ArcGIS local)")
+    p.add_argument(
+        "--scenarios",
+        default="crawl,paged,try",
+        help="lista separada por virgula: crawl, paged, try",
+    )
+    p.add_argument("--folders", type=int, default=4)
+    p.add_argument("--services", type=int, default=8)
+    p.add_argument("--layers", type=int, default=5)
+    p.add_argument("--features", type=int, default=20000, help="feicoes por camada")
+    p.add_argument("--geometry", choices=["point", "polygon"], default="polygon")
+    p.add_argument("--vertices", type=int, default=32)
+    p.add_argument("--max-record-count", type=int, default=1000)
+    p.add_argument("--no-pagination", action="store_true")
+    p.add_argument("--no-pbf", action="store_true")
+    p.add_argument("--latency", type=float, default=0.02, help="segundos por resposta")
+    p.add_argument("--latency-per-feature", type=float, default=0.0)
+    p.add_argument("--failure-rate", type=float, default=0.0, help="fracao de 503 nas consultas")
+    p.add_argument("--overload-above", type=int, help="503 para paginas maiores que isso")
+    p.add_argument("--profile", help="perfil de download (full, analysis, display)")
+    a = p.parse_args()
+
+    options = {
+        "folders": a.folders,
+        "services": a.services,
+        "layers": a.layers,
+        "features": a.features,
+        "geometry": a.geometry,
+        "vertices": a.vertices,
+        "max_record_count": a.max_record_count,
+        "supports_pagination": not a.no_pagination,
+        "pbf": not a.no_pbf,
+        "latency": a.latency,
+        "latency_per_feature": a.latency_per_feature,
+        "failure_rate": a.failure_rate,
+        "overload_above": a.overload_above,
+    }
+    scenarios = [s.strip() for s in a.scenarios.split(",") if s.strip()]
+    # cache e ajustes por host num diretorio temporario: nao mistura com out/.cache
+    with tempfile.TemporaryDirectory(prefix="flows_bench_") as scratch:
+        os.environ["FLOWS_CACHE_DIR"] = scratch
+        out = run_benchmarks(options, scenarios, a.profile)
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
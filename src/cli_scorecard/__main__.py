@@ -3,7 +3,8 @@ import json
 import os
 from pathlib import Path
 
-from ..pipelines.traffic_scorecard import run_scorecard
+from ..pipelines.traffic_metrics import TRAFFIC_BUCKET, check_bucket
+from ..pipelines.traffic_scorecard import DEFAULT_CONCURRENCY, DEFAULT_QPS, run_scorecard
 
 
 def parse_ll(value: str):
@@ -11,6 +12,13 @@ def parse_ll(value: str):
     return {"latitude": lat, "longitude": lon}
 
 
+def parse_bucket(value: str) -> str:
+    try:
+        return check_bucket(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc)) from exc
+
+
 def build_quick_examples():
     return [
         {
@@ -43,6 +51,29 @@ def main():
         default=os.getenv("GOOGLE_MAPS_API_KEY"),
         help="Google Maps API key (ou defina GOOGLE_MAPS_API_KEY no .env)",
     )
+    parser.add_argument(
+        "--qps",
+        type=float,
+        default=DEFAULT_QPS,
+        help="Maximo de consultas por segundo ao Directions API (ou GOOGLE_MAPS_QPS)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximo de consultas simultaneas",
+    )
+    parser.add_argument(
+        "--bucket",
+        type=parse_bucket,
+        default=TRAFFIC_BUCKET,
+        help="Janela do cache: minutos (ex. 15) ou weekday-hour (ou FLOWS_TRAFFIC_BUCKET)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Consulta o Google para todas as vias, sem reaproveitar respostas",
+    )
     args = parser.parse_args()
 
     if not args.api_key:
@@ -53,8 +84,21 @@ def main():
     else:
         candidates = json.loads(args.candidates_json)
 
-    out = run_scorecard(api_key=args.api_key, candidates=candidates, outdir=Path(args.outdir))
+    out = run_scorecard(
+        api_key=args.api_key,
+        candidates=candidates,
+        outdir=Path(args.outdir),
+        qps=args.qps,
+        concurrency=args.concurrency,
+        bucket=args.bucket,
+        use_cache=not args.no_cache,
+    )
     print(f"\nScorecard gerado:\n- {out['markdown']}\n- {out['csv']}\n")
+    if out["cache"]:
+        stats = out["cache"]
+        print(f"[info] cache de trafego: {stats['hits']} hits, {stats['misses']} misses")
+    if out["errors"]:
+        print(f"[warn] {len(out['errors'])} de {len(candidates)} vias sem medicao (ERRO)")
 
 
 if __name__ == "__main__":
@@ -1,16 +1,42 @@
 ﻿from __future__ import annotations
 
+import asyncio
 from typing import Any, Dict, List
 
+from ..services.transport import async_client
+from ..utils.blobstore import BlobStore
 from .utils import log
 
+# estagios que marcam um hash como ja processado no blob store (ver postprocess.finish_layer)
+STAGES = ("export", "export+kmz")
+
+
+def detect_type(head: bytes, content_type: str | None, url: str) -> str:
+    """Best-effort payload type from the first bytes, the Content-Type and the URL."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    start = head.lstrip()[:256]
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "kmz" if url.lower().endswith(".kmz") else "zip"
+    if start.startswith((b"{", b"[")):
+        return "geojson" if b'"FeatureCollection"' in start or b'"features"' in start else "json"
+    if start.startswith(b"<"):
+        lowered = start.lower()
+        if b"<kml" in lowered:
+            return "kml"
+        return "html" if b"<html" in lowered or b"<!doctype html" in lowered else "xml"
+    if "csv" in content_type or url.lower().endswith(".csv"):
+        return "csv"
+    return content_type or "binary"
+
 
 class Tools:
     """Facade with the async operations used by the orchestrator."""
 
-    def __init__(self):
+    def __init__(self, store: BlobStore | None = None):
         # In production inject http, geocoder or arcgis clients through the constructor.
-        pass
+        self.store = store or BlobStore()
 
     # === Search ===
     async def search_agent(self, municipio: str, uf: str) -> List[Dict[str, Any]]:
@@ -25,9 +51,65 @@ class Tools:
 
     # === Ingest ===
     async def ingest(self, catalog: Dict[str, Any]) -> Dict[str, Any]:
-        # TODO: downloads + checksum + type detection
+        """Download every ``{theme: [{name, url, params}]}`` source into the blob store.
+
+        Payloads are hashed while they stream to disk and kept once per hash. Each entry says
+        whether the content changed since the last run and which stages already processed its
+        ``key`` (see :meth:`BlobStore.content_key`), so later stages can skip unchanged inputs.
+        """
         log("[ingest] starting...")
-        return {}
+        jobs = [
+            (theme, source)
+            for theme, sources in (catalog or {}).items()
+            if isinstance(sources, list)
+            for source in sources
+            if isinstance(source, dict) and source.get("url")
+        ]
+        results = await asyncio.gather(
+            *(self._ingest_source(theme, source) for theme, source in jobs)
+        )
+        raw = [entry for entry in results if entry]
+        log(
+            f"[ingest] {len(raw)}/{len(jobs)} fontes, "
+            f"{sum(1 for entry in raw if entry['changed'])} alteradas"
+        )
+        return {"store": str(self.store.path), "sources": raw}
+
+    async def _ingest_source(self, theme: str, source: Dict[str, Any]) -> Dict[str, Any] | None:
+        url, params = source["url"], source.get("params") or {}
+        previous = self.store.lookup(url, params)
+        writer = self.store.writer()
+        head = b""
+        try:
+            async with async_client("download").stream("GET", url, params=params) as response:
+                response.raise_for_status()
+                content_type = response.headers.get("content-type")
+                async for chunk in response.aiter_bytes():
+                    if len(head) < 512:
+                        head += chunk[: 512 - len(head)]
+                    writer.write(chunk)
+            digest, _new = writer.commit()
+        except Exception as exc:
+            writer.abort()
+            log(f"[ingest] falhou {url}: {exc}")
+            return None
+        kind = detect_type(head, content_type, url)
+        name = source.get("name") or url
+        # JSON e marcado pelo hash canonico (o mesmo de put_json em postprocess.finish_layer)
+        key = await asyncio.to_thread(self.store.content_key, digest, kind)
+        self.store.record(url, params, digest, name=name, type=kind, bytes=writer.size, key=key)
+        return {
+            "theme": theme,
+            "name": name,
+            "url": url,
+            "sha256": digest,
+            "type": kind,
+            "bytes": writer.size,
+            "path": str(self.store.blob_path(digest)),
+            "key": key,
+            "changed": previous is None or (previous.get("key") or previous.get("sha256")) != key,
+            "processed": [stage for stage in STAGES if self.store.processed(stage, key)],
+        }
 
     # === Normalisation ===
     async def normalize(self, raw: Dict[str, Any]) -> Dict[str, Any]:
@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from utils.protobuf import encode_varint
+
+SERVICES_PATH = "/arcgis/rest/services"
+_OID_RANGE = re.compile(r"(\w+)\s*>=\s*(\d+)\s+AND\s+\1\s*<=\s*(\d+)")
+# centro das feicoes sinteticas (Londrina) e passo entre elas, em graus
+CENTER = (-51.16, -23.31)
+SPACING = 0.0005
+PBF_SCALE = 1e-7
+
+
+class FakeArcGIS:
+    """Local stand-in for an ArcGIS REST server with a synthetic catalog.
+
+    Serves ``folders`` x ``services`` MapServers with ``layers`` layers each, every layer with
+    ``features`` features (points or ``vertices``-sided polygons). ``latency`` (plus
+    ``latency_per_feature``) is added to each response, ``failure_rate`` of the queries answer
+    503, and queries asking for more than ``overload_above`` records answer 503 as an overloaded
+    server would. ``transfer_limit`` caps every answer below the advertised ``maxRecordCount``,
+    like a server whose real limit differs from its metadata. Metadata responses carry ETags and honor ``If-None-Match``.
+
+    ``GET /__stats`` returns request/byte counters and ``POST /__reset`` zeroes them.
+    """
+
+    def __init__(
+        self,
+        folders: int = 2,
+        services: int = 4,
+        layers: int = 3,
+        features: int = 5000,
+        geometry: str = "polygon",
+        vertices: int = 32,
+        max_record_count: int = 1000,
+        supports_pagination: bool = True,
+        pbf: bool = True,
+        latency: float = 0.0,
+        latency_per_feature: float = 0.0,
+        failure_rate: float = 0.0,
+        overload_above: int | None = None,
+        transfer_limit: int | None = None,
+        seed: int = 0,
+    ):
+        self.folders = folders
+        self.services = services
+        self.layers = layers
+        self.features = features
+        self.geometry = geometry
+        self.vertices = max(3, vertices)
+        self.max_record_count = max_record_count
+        self.supports_pagination = supports_pagination
+        self.pbf = pbf
+        self.latency = latency
+        self.latency_per_feature = latency_per_feature
+        self.failure_rate = failure_rate
+        self.overload_above = overload_above
+        self.transfer_limit = transfer_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self.reset_stats()
+
+    # ------------------------------------------------------------------ ciclo de vida
+
+    def _bind(self, host: str, port: int) -> ThreadingHTTPServer:
+        handler = type("FakeArcGISHandler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+        self._server.daemon_threads = True
+        return self._server
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self._bind(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self.root_url
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._bind(host, port).serve_forever()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeArcGIS":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def root_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{SERVICES_PATH}"
+
+    def layer_query_urls(self) -> List[str]:
+        return [
+            f"{self.root_url}/{folder}/{service}/MapServer/{layer}/query"
+            for folder in self._folder_names()
+            for service in self._service_names()
+            for layer in range(self.layers)
+        ]
+
+    # ------------------------------------------------------------------ contadores
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats: Dict[str, Any] = {
+                "requests": 0,
+                "bytes": 0,
+                "not_modified": 0,
+                "failures": 0,
+                "features": 0,
+                "by_kind": {},
+            }
+
+    def _count(self, kind: str, size: int, failed: bool = False) -> None:
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += size
+            self.stats["failures"] += int(failed)
+            self.stats["not_modified"] += int(kind == "304")
+            self.stats["by_kind"][kind] = self.stats["by_kind"].get(kind, 0) + 1
+
+    def _should_fail(self) -> bool:
+        if self.failure_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    # ------------------------------------------------------------------ catalogo
+
+    def _folder_names(self) -> List[str]:
+        return [f"Pasta{i}" for i in range(self.folders)]
+
+    def _service_names(self) -> List[str]:
+        return [f"Servico{i}" for i in range(self.services)]
+
+    def _geometry_type(self) -> str:
+        return "esriGeometryPoint" if self.geometry == "point" else "esriGeometryPolygon"
+
+    def _fields(self) -> List[Dict[str, str]]:
+        return [
+            {"name": "OBJECTID", "type": "esriFieldTypeOID", "alias": "OBJECTID"},
+            {"name": "nome", "type": "esriFieldTypeString", "alias": "Nome"},
+            {"name": "valor", "type": "esriFieldTypeDouble", "alias": "Valor"},
+        ]
+
+    def root_payload(self) -> Dict:
+        return {"currentVersion": 10.91, "folders": self._folder_names(), "services": []}
+
+    def folder_payload(self, folder: str) -> Dict | None:
+        if folder not in self._folder_names():
+            return None
+        return {
+            "folders": [],
+            "services": [
+                {"name": f"{folder}/{service}", "type": "MapServer"}
+                for service in self._service_names()
+            ],
+        }
+
+    def service_payload(self, folder: str, service: str) -> Dict | None:
+        if folder not in self._folder_names() or service not in self._service_names():
+            return None
+        return {
+            "layers": [
+                {
+                    "id": layer,
+                    "name": f"{folder} {service} camada {layer}",
+                    "geometryType": self._geometry_type(),
+                    "fields": self._fields(),
+                }
+                for layer in range(self.layers)
+            ],
+            "tables": [],
+        }
+
+    def layer_payload(self, folder: str, service: str, layer: int) -> Dict:
+        formats = "JSON, geoJSON, PBF" if self.pbf else "JSON, geoJSON"
+        return {
+            "id": layer,
+            "name": f"{folder} {service} camada {layer}",
+            "type": "Feature Layer",
+            "geometryType": self._geometry_type(),
+            "objectIdField": "OBJECTID",
+            "displayField": "nome",
+            "fields": self._fields(),
+            "maxRecordCount": self.max_record_count,
+            "supportedQueryFormats": formats,
+            "advancedQueryCapabilities": {
+                "supportsPagination": self.supports_pagination,
+                "supportsCoordinatesQuantization": self.pbf,
+            },
+        }
+
+    # ------------------------------------------------------------------ feicoes
+
+    def _oids(self) -> range:
+        return range(1, self.features + 1)
+
+    def _feature(self, oid: int) -> Tuple[Dict[str, Any], List[List[float]]]:
+        columns = max(1, int(math.sqrt(self.features)))
+        x = CENTER[0] + ((oid - 1) % columns) * SPACING
+        y = CENTER[1] + ((oid - 1) // columns) * SPACING
+        properties = {"OBJECTID": oid, "nome": f"feicao {oid}", "valor": oid * 0.5}
+        if self.geometry == "point":
+            return properties, [[round(x, 7), round(y, 7)]]
+        radius = SPACING * 0.4
+        ring = [
+            [
+                round(x + radius * math.cos(2 * math.pi * k / self.vertices), 7),
+                round(y + radius * math.sin(2 * math.pi * k / self.vertices), 7),
+            ]
+            for k in range(self.vertices)
+        ]
+        return properties, ring + [ring[0]]
+
+    def matching(self, query: Dict[str, str]) -> range:
+        match = _OID_RANGE.search(query.get("where") or "")
+        if not match:
+            return self._oids()
+        lo, hi = int(match.group(2)), int(match.group(3))
+        return range(max(lo, 1), min(hi, self.features) + 1)
+
+    def select(self, query: Dict[str, str]) -> List[int]:
+        oids = self.matching(query)
+        offset = int(query.get("resultOffset") or 0)
+        count = int(query.get("resultRecordCount") or self.max_record_count)
+        count = min(count, self.max_record_count, self.transfer_limit or count)
+        return list(oids[offset : offset + count])
+
+    def geojson(self, oids: List[int]) -> Dict:
+        features = []
+        for oid in oids:
+            properties, coords = self._feature(oid)
+            if self.geometry == "point":
+                geometry = {"type": "Point", "coordinates": coords[0]}
+            else:
+                geometry = {"type": "Polygon", "coordinates": [coords]}
+            features.append(
+                {"type": "Feature", "id": oid, "properties": properties, "geometry": geometry}
+            )
+        return {"type": "FeatureCollection", "features": features}
+
+    def pbf_payload(self, oids: List[int]) -> bytes:
+        return _encode_feature_collection(
+            [self._feature(oid) for oid in oids], self.geometry == "point"
+        )
+
+
+def _field(number: int, wire: int) -> bytes:
+    return encode_varint((number << 3) | wire)
+
+
+def _message(number: int, payload: bytes) -> bytes:
+    return _field(number, 2) + encode_varint(len(payload)) + payload
+
+
+def _double(number: int, value: float) -> bytes:
+    return _field(number, 1) + struct.pack("<d", value)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _encode_value(value: Any) -> bytes:
+    if isinstance(value, str):
+        return _message(1, value.encode("utf-8"))
+    if isinstance(value, float):
+        return _double(3, value)
+    return _field(8, 0) + encode_varint(_zigzag(int(value)))
+
+
+def _encode_feature_collection(
+    features: List[Tuple[Dict[str, Any], List[List[float]]]], points: bool
+) -> bytes:
+    # FeatureCollectionPBuffer com origem no canto superior esquerdo, como o ArcGIS Server
+    xs = [x for _props, coords in features for x, _y in coords] or [0.0]
+    ys = [y for _props, coords in features for _x, y in coords] or [0.0]
+    left, top = min(xs), max(ys)
+    result = _message(1, b"OBJECTID") + _field(7, 0) + encode_varint(0 if points else 3)
+    transform = (
+        _field(1, 0)
+        + encode_varint(0)
+        + _message(2, _double(1, PBF_SCALE) + _double(2, PBF_SCALE))
+        + _message(3, _double(1, left) + _double(2, top))
+    )
+    result += _message(12, transform)
+    for name in ("OBJECTID", "nome", "valor"):
+        result += _message(13, _message(1, name.encode("utf-8")))
+    for properties, coords in features:
+        body = b"".join(_message(1, _encode_value(value)) for value in properties.values())
+        ring = coords if points else coords[::-1]  # Esri: anel externo horario
+        deltas = bytearray()
+        previous = (0, 0)
+        for x, y in ring:
+            qx, qy = round((x - left) / PBF_SCALE), round((top - y) / PBF_SCALE)
+            deltas += encode_varint(_zigzag(qx - previous[0]))
+            deltas += encode_varint(_zigzag(qy - previous[1]))
+            previous = (qx, qy)
+        geometry = _message(2, encode_varint(len(ring))) + _message(3, bytes(deltas))
+        result += _message(15, body + _message(2, geometry))
+    return _message(1, b"1.0.0") + _message(2, _message(1, result))
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address) -> None:
+        # cliente que desiste da conexao (timeout, retentativa) nao e erro do servidor
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeArcGIS
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, kind: str, content_type: str, **extra) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in extra.items():
+            self.send_header(header.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.fake._count(kind, len(body), failed=status >= 500)
+
+    def _control(self, body: bytes) -> None:
+        # respostas de controle ficam fora dos contadores
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload: Dict, kind: str, status: int = 200, etag: bool = False) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        if etag:
+            tag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == tag:
+                self.send_response(304)
+                self.send_header("ETag", tag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                self.fake._count("304", 0)
+                return
+            self._send(status, body, kind, "application/json", ETag=tag)
+            return
+        self._send(status, body, kind, "application/json")
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path == "/__reset":
+            self.fake.reset_stats()
+            self._control(b"{}")
+            return
+        self._send(404, b"", "404", "text/plain")
+
+    def do_GET(self) -> None:
+        fake = self.fake
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        path = parts.path.rstrip("/")
+        if path == "/__stats":
+            with fake._lock:
+                body = json.dumps(fake.stats).encode("utf-8")
+            self._control(body)
+            return
+        if fake.latency:
+            time.sleep(fake.latency)
+        if not path.startswith(SERVICES_PATH):
+            self._send(404, b"", "404", "text/plain")
+            return
+        segments = [s for s in path[len(SERVICES_PATH) :].split("/") if s]
+        if not segments:
+            self._json(fake.root_payload(), "catalog", etag=True)
+        elif len(segments) == 1:
+            payload = fake.folder_payload(segments[0])
+            if payload is None:
+                self._json({"error": {"code": 404, "message": "Folder not found"}}, "404")
+            else:
+                self._json(payload, "catalog", etag=True)
+        elif len(segments) == 3 and segments[2] == "MapServer":
+            payload = fake.service_payload(segments[0], segments[1])
+            if payload is None:
+                self._json({"error": {"code": 404, "message": "Service not found"}}, "404")
+            else:
+                self._json(payload, "service", etag=True)
+        elif len(segments) == 4 and segments[2] == "MapServer" and segments[3].isdigit():
+            self._json(fake.layer_payload(*segments[:2], int(segments[3])), "layer", etag=True)
+        elif len(segments) == 5 and segments[4] == "query" and segments[3].isdigit():
+            self._query(query)
+        else:
+            self._send(404, b"", "404", "text/plain")
+
+    def _query(self, query: Dict[str, str]) -> None:
+        fake = self.fake
+        if query.get("returnCountOnly") == "true":
+            self._json({"count": len(fake.matching(query))}, "count")
+            return
+        if query.get("returnIdsOnly") == "true":
+            ids = list(fake.matching(query))
+            self._json({"objectIdFieldName": "OBJECTID", "objectIds": ids}, "ids")
+            return
+        if "resultOffset" in query and not fake.supports_pagination:
+            self._json({"error": {"code": 400, "message": "Pagination is not supported."}}, "400")
+            return
+        oids = fake.select(query)
+        if fake._should_fail() or (fake.overload_above and len(oids) > fake.overload_above):
+            self._send(503, b"Service Unavailable", "503", "text/plain")
+            return
+        if fake.latency_per_feature:
+            time.sleep(fake.latency_per_feature * len(oids))
+        fmt = query.get("f", "json")
+        if fmt == "pbf" and fake.pbf:
+            body = fake.pbf_payload(oids)
+            self._send(200, body, "query", "application/x-protobuf")
+        elif fmt == "pbf":
+            self._json({"error": {"code": 400, "message": "Invalid format"}}, "400")
+            return
+        else:
+            body = json.dumps(fake.geojson(oids)).encode("utf-8")
+            self._send(200, body, "query", "application/geo+json")
+        with fake._lock:
+            fake.stats["features"] += len(oids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("flows-ia fake arcgis")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--folders", type=int, default=2)
+    parser.add_argument("--services", type=int, default=4)
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--features", type=int, default=5000)
+    parser.add_argument("--geometry", choices=["point", "polygon"], default="polygon")
+    parser.add_argument("--max-record-count", type=int, default=1000)
+    parser.add_argument("--no-pagination", action="store_true")
+    parser.add_argument("--no-pbf", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por resposta")
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="fracao de 503 nas consultas"
+    )
+    parser.add_argument("--overload-above", type=int, help="503 para paginas maiores que isso")
+    args = parser.parse_args()
+    fake = FakeArcGIS(
+        folders=args.folders,
+        services=args.services,
+        layers=args.layers,
+        features=args.features,
+        geometry=args.geometry,
+        max_record_count=args.max_record_count,
+        supports_pagination=not args.no_pagination,
+        pbf=not args.no_pbf,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        overload_above=args.overload_above,
+    )
+    print(f"[ok] fake ArcGIS em http://127.0.0.1:{args.port}{SERVICES_PATH}")
+    fake.serve_forever(port=args.port)
+
+
+if __name__ == "__main__":
+    main()
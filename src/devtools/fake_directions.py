@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import math
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict
+from urllib.parse import parse_qs, urlsplit
+
+from devtools.fake_arcgis import _Server
+
+DIRECTIONS_PATH = "/maps/api/directions/json"
+# velocidade livre e fator de transito das rotas sinteticas
+FREE_FLOW_MS = 12.0
+EARTH_RADIUS_M = 6371000.0
+
+
+def _distance_m(origin: str, destination: str) -> float:
+    (lat1, lon1), (lat2, lon2) = (map(float, p.split(",", 1)) for p in (origin, destination))
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlon = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlon / 2) ** 2
+    # fator de sinuosidade da malha urbana
+    return 1.3 * 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class FakeDirections:
+    """Local stand-in for the Google Directions API (``/maps/api/directions/json``).
+
+    Routes are synthetic: distance from the straight line, free-flow duration at
+    :data:`FREE_FLOW_MS` and a traffic factor derived from the coordinates, so answers are
+    deterministic. More than ``qps`` requests within one second answer ``OVER_QUERY_LIMIT``
+    (HTTP 200, as Google does); a request without ``key`` answers ``REQUEST_DENIED`` and one
+    whose origin equals its destination ``ZERO_RESULTS``.
+
+    ``GET /__stats`` returns counters (including the peak concurrency and the peak requests in
+    any one-second window) and ``POST /__reset`` zeroes them.
+    """
+
+    def __init__(self, latency: float = 0.0, qps: float | None = None):
+        self.latency = latency
+        self.qps = qps
+        self._lock = threading.Lock()
+        self._active = 0
+        self._recent: Deque[float] = collections.deque()
+        self._server: ThreadingHTTPServer | None = None
+        self.reset_stats()
+
+    # ------------------------------------------------------------------ ciclo de vida
+
+    def _bind(self, host: str, port: int) -> ThreadingHTTPServer:
+        handler = type("FakeDirectionsHandler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+        self._server.daemon_threads = True
+        return self._server
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self._bind(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self.url
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._bind(host, port).serve_forever()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeDirections":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """Endpoint URL, as ``GOOGLE_DIRECTIONS_URL`` expects it."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{DIRECTIONS_PATH}"
+
+    # ------------------------------------------------------------------ contadores
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._recent.clear()
+            self.stats: Dict[str, Any] = {
+                "requests": 0,
+                "over_query_limit": 0,
+                "peak_concurrency": 0,
+                "peak_qps": 0,
+            }
+
+    def _enter(self) -> bool:
+        """Count a request; False when it exceeds ``qps`` in the last second."""
+        now = time.monotonic()
+        with self._lock:
+            self._active += 1
+            self.stats["requests"] += 1
+            self.stats["peak_concurrency"] = max(self.stats["peak_concurrency"], self._active)
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            self._recent.append(now)
+            self.stats["peak_qps"] = max(self.stats["peak_qps"], len(self._recent))
+            if self.qps is not None and len(self._recent) > self.qps:
+                self.stats["over_query_limit"] += 1
+                return False
+            return True
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._active -= 1
+
+    # ------------------------------------------------------------------ respostas
+
+    def route(self, origin: str, destination: str) -> Dict[str, Any]:
+        if origin.replace(" ", "") == destination.replace(" ", ""):
+            return {"status": "ZERO_RESULTS", "routes": []}
+        distance = _distance_m(origin, destination)
+        static = distance / FREE_FLOW_MS
+        # transito entre 1.0x e 2.5x, estavel para o mesmo par de pontos
+        factor = 1.0 + zlib.crc32(f"{origin}|{destination}".encode()) % 150 / 100.0
+        leg = {
+            "distance": {"value": round(distance)},
+            "duration": {"value": round(static)},
+            "duration_in_traffic": {"value": round(static * factor)},
+            "start_address": origin,
+            "end_address": destination,
+        }
+        return {"status": "OK", "routes": [{"summary": "sintetica", "legs": [leg]}]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeDirections
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path == "/__reset":
+            self.fake.reset_stats()
+            self._send(200, {})
+            return
+        self._send(404, {"status": "NOT_FOUND"})
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        fake = self.fake
+        if parts.path == "/__stats":
+            with fake._lock:
+                self._send(200, dict(fake.stats))
+            return
+        if parts.path != DIRECTIONS_PATH:
+            self._send(404, {"status": "NOT_FOUND"})
+            return
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        allowed = fake._enter()
+        try:
+            if not allowed:
+                self._send(200, {"status": "OVER_QUERY_LIMIT", "routes": []})
+                return
+            if fake.latency:
+                time.sleep(fake.latency)
+            if not query.get("key"):
+                self._send(200, {"status": "REQUEST_DENIED", "routes": []})
+                return
+            try:
+                payload = fake.route(query["origin"], query["destination"])
+            except (KeyError, ValueError):
+                payload = {"status": "INVALID_REQUEST", "routes": []}
+            self._send(200, payload)
+        finally:
+            fake._leave()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("flows-ia fake directions")
+    parser.add_argument("--port", type=int, default=8903)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por resposta")
+    parser.add_argument("--qps", type=float, help="requisicoes/s antes do OVER_QUERY_LIMIT")
+    args = parser.parse_args()
+    fake = FakeDirections(latency=args.latency, qps=args.qps)
+    print(f"[ok] fake Directions em http://127.0.0.1:{args.port}{DIRECTIONS_PATH}")
+    fake.serve_forever(port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from devtools.fake_arcgis import _Server
+
+COMPLETIONS_PATH = "/v1/chat/completions"
+_CITY = re.compile(r"Município:\s*(.+?)\s*-\s*(\S+?)[.\s]")
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "", text.casefold()) or "cidade"
+
+
+class FakeOpenAI:
+    """Local stand-in for the OpenAI chat completions endpoint used by ``services.sources_ai``.
+
+    Answers the roots prompt with ``{"roots": [...]}`` and the sources prompt with
+    ``{"sources": [...]}``, built from the city in the prompt (or ``roots`` when given). Cities
+    listed in ``empty_for`` get an empty list, and ``invalid=True`` answers prose instead of
+    JSON. Requests without a bearer token answer 401, like the real API.
+
+    ``GET /__stats`` returns request counters and ``POST /__reset`` zeroes them.
+    """
+
+    def __init__(
+        self,
+        roots: List[str] | None = None,
+        latency: float = 0.0,
+        empty_for: List[str] | None = None,
+        invalid: bool = False,
+    ):
+        self.roots = roots
+        self.latency = latency
+        self.empty_for = {_slug(city) for city in empty_for or []}
+        self.invalid = invalid
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self.reset_stats()
+
+    # ------------------------------------------------------------------ ciclo de vida
+
+    def _bind(self, host: str, port: int) -> ThreadingHTTPServer:
+        handler = type("FakeOpenAIHandler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+        self._server.daemon_threads = True
+        return self._server
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self._bind(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self.url
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._bind(host, port).serve_forever()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOpenAI":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """Base URL, as ``OPENAI_BASE_URL`` expects it."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    # ------------------------------------------------------------------ contadores
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats: Dict[str, Any] = {"requests": 0, "unauthorized": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    # ------------------------------------------------------------------ respostas
+
+    def answer(self, prompt: str) -> str:
+        """Assistant message content for ``prompt``."""
+        if self.invalid:
+            return "Desculpe, não encontrei endpoints para este município."
+        match = _CITY.search(prompt)
+        city = _slug(match.group(1)) if match else "cidade"
+        if "URLs raiz" in prompt:
+            roots = [] if city in self.empty_for else self.roots
+            if roots is None:
+                roots = [
+                    f"https://geo.{city}.example.gov.br/server/rest/services",
+                    f"https://sig.{city}.example.gov.br/arcgis/rest/services",
+                ]
+            return json.dumps({"roots": roots})
+        sources = []
+        if city not in self.empty_for:
+            sources = [
+                {
+                    "name": f"{city}_escolas",
+                    "type": "arcgis_query",
+                    "url": f"https://geo.{city}.example.gov.br/server/rest/services/Educacao/MapServer/0/query",
+                    "params": {"where": "1=1", "outFields": "*", "f": "geojson"},
+                }
+            ]
+        # como o modelo costuma fazer: JSON dentro de um bloco de codigo
+        return "```json\n" + json.dumps({"sources": sources}) + "\n```"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeOpenAI
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/__stats":
+            with self.fake._lock:
+                self._send(200, dict(self.fake.stats))
+            return
+        self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        fake = self.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path == "/__reset":
+            fake.reset_stats()
+            self._send(200, {})
+            return
+        if self.path.rstrip("/") != COMPLETIONS_PATH:
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+            fake._count("requests")
+            fake._count("unauthorized")
+            self._send(401, {"error": {"message": "missing API key"}})
+            return
+        payload = json.loads(raw or b"{}")
+        messages = payload.get("messages") or [{}]
+        prompt = str(messages[-1].get("content") or "")
+        fake._count("requests")
+        if fake.latency:
+            time.sleep(fake.latency)
+        message = {"role": "assistant", "content": fake.answer(prompt)}
+        self._send(
+            200,
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            },
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("flows-ia fake openai")
+    parser.add_argument("--port", type=int, default=8902)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por resposta")
+    parser.add_argument("--roots", default="", help="URLs raiz fixas, separadas por virgula")
+    args = parser.parse_args()
+    roots = [x.strip() for x in args.roots.split(",") if x.strip()] or None
+    fake = FakeOpenAI(roots=roots, latency=args.latency)
+    print(f"[ok] fake OpenAI em http://127.0.0.1:{args.port}/v1 (use OPENAI_BASE_URL)")
+    fake.serve_forever(port=args.port)
+
+
+if __name__ == "__main__":
+    main()
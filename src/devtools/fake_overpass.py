@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from devtools.fake_arcgis import _Server
+
+INTERPRETER_PATH = "/api/interpreter"
+# area de Londrina
+BBOX = (-51.30, -23.45, -50.95, -23.15)
+KINDS = [
+    ("amenity", "hospital"),
+    ("amenity", "clinic"),
+    ("amenity", "school"),
+    ("amenity", "kindergarten"),
+    ("highway", "bus_stop"),
+]
+# meia largura das vias/areas sinteticas em graus: atravessam a borda de tiles vizinhos
+WAY_HALF_SIZE = 0.002
+_STATEMENT = re.compile(
+    r"(node|way|relation|nwr|nw|nr|wr)((?:\[[^\]]*\])*)"
+    r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)"
+)
+_TAG = re.compile(r'\["?([^"=\]]+)"?\s*=\s*"?([^"\]]*)"?\]')
+_TYPES = {"n": "node", "w": "way", "r": "relation"}
+
+
+class FakeOverpass:
+    """Local stand-in for an Overpass API interpreter with synthetic POIs.
+
+    ``pois`` elements are spread over ``bbox``: nodes, plus ``way_fraction`` ways and
+    ``relation_fraction`` relations whose extent (``WAY_HALF_SIZE`` around the center) can cross
+    tile borders, as buildings do. Queries of the form ``nwr[k=v](s,w,n,e);`` are answered with
+    ``out center`` semantics. More than ``slots`` concurrent queries answer 429, and a query
+    whose bbox area exceeds ``max_area`` (square degrees) answers with a ``runtime error``
+    remark and no elements, like a server timeout.
+
+    ``GET /__stats`` returns request counters and ``POST /__reset`` zeroes them.
+    """
+
+    def __init__(
+        self,
+        pois: int = 2000,
+        bbox: Tuple[float, float, float, float] = BBOX,
+        way_fraction: float = 0.3,
+        relation_fraction: float = 0.05,
+        latency: float = 0.0,
+        slots: int = 2,
+        max_area: float | None = None,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.slots = slots
+        self.max_area = max_area
+        self._lock = threading.Lock()
+        self._active = 0
+        self._server: ThreadingHTTPServer | None = None
+        self.elements = self._generate(pois, bbox, way_fraction, relation_fraction, seed)
+        self.reset_stats()
+
+    @staticmethod
+    def _generate(
+        count: int,
+        bbox: Tuple[float, float, float, float],
+        way_fraction: float,
+        relation_fraction: float,
+        seed: int,
+    ) -> List[Dict[str, Any]]:
+        rnd = random.Random(seed)
+        xmin, ymin, xmax, ymax = bbox
+        elements = []
+        for index in range(count):
+            key, value = KINDS[index % len(KINDS)]
+            roll = rnd.random()
+            kind = "relation" if roll < relation_fraction else "node"
+            if relation_fraction <= roll < relation_fraction + way_fraction:
+                kind = "way"
+            lon, lat = rnd.uniform(xmin, xmax), rnd.uniform(ymin, ymax)
+            element = {
+                "type": kind,
+                "id": index + 1,
+                "tags": {key: value, "name": f"{value} {index + 1}"},
+                "lon": round(lon, 7),
+                "lat": round(lat, 7),
+            }
+            elements.append(element)
+        return elements
+
+    # ------------------------------------------------------------------ ciclo de vida
+
+    def _bind(self, host: str, port: int) -> ThreadingHTTPServer:
+        handler = type("FakeOverpassHandler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+        self._server.daemon_threads = True
+        return self._server
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = self._bind(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self.url
+
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._bind(host, port).serve_forever()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOverpass":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{INTERPRETER_PATH}"
+
+    # ------------------------------------------------------------------ contadores
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats: Dict[str, Any] = {
+                "requests": 0,
+                "bytes": 0,
+                "elements": 0,
+                "rate_limited": 0,
+                "timeouts": 0,
+            }
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    # ------------------------------------------------------------------ consultas
+
+    def matching(self, query: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Elements selected by ``query`` and whether the query "timed out"."""
+        center = "out center" in query
+        selected: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for types, tags, south, west, north, east in _STATEMENT.findall(query):
+            south, west, north, east = map(float, (south, west, north, east))
+            if self.max_area is not None and (north - south) * (east - west) > self.max_area:
+                return [], True
+            wanted = {types} if types in _TYPES.values() else {_TYPES[t] for t in types}
+            filters = _TAG.findall(tags)
+            for element in self.elements:
+                if element["type"] not in wanted:
+                    continue
+                if any(element["tags"].get(key) != value for key, value in filters):
+                    continue
+                half = 0.0 if element["type"] == "node" else WAY_HALF_SIZE
+                lon, lat = element["lon"], element["lat"]
+                if (
+                    lon + half < west
+                    or lon - half > east
+                    or lat + half < south
+                    or lat - half > north
+                ):
+                    continue
+                selected[(element["type"], element["id"])] = self._output(element, center)
+        return list(selected.values()), False
+
+    @staticmethod
+    def _output(element: Dict[str, Any], center: bool) -> Dict[str, Any]:
+        if element["type"] == "node":
+            return dict(element)
+        result = {"type": element["type"], "id": element["id"], "tags": element["tags"]}
+        if center:
+            result["center"] = {"lat": element["lat"], "lon": element["lon"]}
+        return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeOverpass
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, **extra) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in extra.items():
+            self.send_header(header.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _control(self, payload: Dict) -> None:
+        # respostas de controle ficam fora dos contadores
+        self._send(200, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def do_POST(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == "/__reset":
+            self.fake.reset_stats()
+            self._control({})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        self._interpret(parts.path, (form.get("data") or [""])[0])
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == "/__stats":
+            with self.fake._lock:
+                self._control(dict(self.fake.stats))
+            return
+        self._interpret(parts.path, (parse_qs(parts.query).get("data") or [""])[0])
+
+    def _interpret(self, path: str, query: str) -> None:
+        fake = self.fake
+        if path.rstrip("/") != INTERPRETER_PATH:
+            self._send(404, b"", "text/plain")
+            return
+        with fake._lock:
+            fake._active += 1
+            busy = fake._active > fake.slots
+        try:
+            fake._count("requests")
+            if busy:
+                fake._count("rate_limited")
+                self._send(429, b"Too Many Requests", "text/plain", Retry_After="1")
+                return
+            if fake.latency:
+                time.sleep(fake.latency)
+            elements, timed_out = fake.matching(query)
+            payload: Dict[str, Any] = {"version": 0.6, "generator": "fake-overpass"}
+            payload["elements"] = elements
+            if timed_out:
+                fake._count("timeouts")
+                payload["remark"] = 'runtime error: Query timed out in "query" at line 1'
+            body = json.dumps(payload).encode("utf-8")
+            fake._count("elements", len(elements))
+            fake._count("bytes", len(body))
+            self._send(200, body, "application/json")
+        finally:
+            with fake._lock:
+                fake._active -= 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("flows-ia fake overpass")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--pois", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos por resposta")
+    parser.add_argument("--slots", type=int, default=2, help="consultas simultaneas antes do 429")
+    parser.add_argument("--max-area", type=float, help="graus^2 acima dos quais a consulta expira")
+    args = parser.parse_args()
+    fake = FakeOverpass(
+        pois=args.pois,
+        latency=args.latency,
+        slots=args.slots,
+        max_area=args.max_area,
+    )
+    print(f"[ok] fake Overpass em http://127.0.0.1:{args.port}{INTERPRETER_PATH}")
+    fake.serve_forever(port=args.port)
+
+
+if __name__ == "__main__":
+    main()
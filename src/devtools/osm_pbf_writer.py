@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import argparse
+import random
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from devtools.fake_overpass import BBOX, KINDS
+from utils.protobuf import encode_varint
+
+GRANULARITY = 100
+# elementos por bloco, como o osmium (8000)
+BLOCK_SIZE = 8000
+# passo da malha viaria sintetica em graus (~1 km)
+ROAD_STEP = 0.01
+ROAD_CLASSES = ["residential", "residential", "tertiary", "secondary", "primary"]
+# meia largura dos lotes (caminhos fechados) das POIs
+LOT_HALF_SIZE = 0.0003
+
+
+def _key(number: int, wire: int) -> bytes:
+    return encode_varint(number << 3 | wire)
+
+
+def _bytes(number: int, payload: bytes) -> bytes:
+    return _key(number, 2) + encode_varint(len(payload)) + payload
+
+
+def _varint(number: int, value: int) -> bytes:
+    return _key(number, 0) + encode_varint(value)
+
+
+def _zz(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _packed(number: int, values: Iterable[int]) -> bytes:
+    return _bytes(number, b"".join(encode_varint(v) for v in values))
+
+
+def _delta(values: List[int]) -> List[int]:
+    previous, out = 0, []
+    for value in values:
+        out.append(_zz(value - previous))
+        previous = value
+    return out
+
+
+class _Strings:
+    def __init__(self):
+        self.index: Dict[str, int] = {"": 0}
+
+    def __call__(self, text: str) -> int:
+        return self.index.setdefault(text, len(self.index))
+
+    def table(self) -> bytes:
+        return b"".join(_bytes(1, text.encode("utf-8")) for text in self.index)
+
+
+def _raw(degrees: float) -> int:
+    return round(degrees * 1e9 / GRANULARITY)
+
+
+def _dense(nodes: List[Tuple[int, float, float, Dict[str, str]]], strings: _Strings) -> bytes:
+    keys_vals: List[int] = []
+    for _id, _lon, _lat, tags in nodes:
+        for key, value in tags.items():
+            keys_vals += [strings(key), strings(value)]
+        keys_vals.append(0)
+    body = _packed(1, _delta([n[0] for n in nodes]))
+    body += _packed(8, _delta([_raw(n[2]) for n in nodes]))
+    body += _packed(9, _delta([_raw(n[1]) for n in nodes]))
+    if any(n[3] for n in nodes):
+        body += _packed(10, keys_vals)
+    return _bytes(2, body)
+
+
+def _way(way: Tuple[int, List[int], Dict[str, str]], strings: _Strings) -> bytes:
+    way_id, refs, tags = way
+    body = _varint(1, way_id)
+    body += _packed(2, [strings(k) for k in tags]) + _packed(3, [strings(v) for v in tags.values()])
+    return _bytes(3, body + _packed(8, _delta(refs)))
+
+
+def _relation(relation: Tuple[int, List[Tuple[int, int, str]], Dict], strings: _Strings) -> bytes:
+    relation_id, members, tags = relation
+    body = _varint(1, relation_id)
+    body += _packed(2, [strings(k) for k in tags]) + _packed(3, [strings(v) for v in tags.values()])
+    body += _packed(8, [strings(role) for _t, _m, role in members])
+    body += _packed(9, _delta([m for _t, m, _r in members]))
+    return _bytes(4, body + _packed(10, [t for t, _m, _r in members]))
+
+
+def _blob(kind: str, payload: bytes, compress: bool = True) -> bytes:
+    if compress:
+        data = _varint(2, len(payload)) + _bytes(3, zlib.compress(payload))
+    else:
+        data = _bytes(1, payload)
+    header = _bytes(1, kind.encode("utf-8")) + _varint(3, len(data))
+    return struct.pack(">I", len(header)) + header + data
+
+
+def _block(encode, items: List, compress: bool) -> bytes:
+    strings = _Strings()
+    group = b"".join(encode(item, strings) for item in items)
+    payload = _bytes(1, strings.table()) + _bytes(2, group)
+    return _blob("OSMData", payload, compress)
+
+
+def synthetic_city(
+    bbox: Tuple[float, float, float, float] = BBOX, pois: int = 2000, seed: int = 0
+) -> Dict[str, List]:
+    """Road grid over ``bbox`` plus POIs of :data:`devtools.fake_overpass.KINDS`.
+
+    POIs are mostly tagged nodes; some are closed ways (lots) and some multipolygon relations
+    whose outer way carries no tags, so a reader has to resolve way -> nodes through them.
+    """
+    rnd = random.Random(seed)
+    xmin, ymin, xmax, ymax = bbox
+    nodes: List[Tuple[int, float, float, Dict[str, str]]] = []
+    ways: List[Tuple[int, List[int], Dict[str, str]]] = []
+    relations: List[Tuple[int, List[Tuple[int, int, str]], Dict[str, str]]] = []
+
+    def node(lon: float, lat: float, tags: Dict[str, str] | None = None) -> int:
+        nodes.append((len(nodes) + 1, round(lon, 7), round(lat, 7), tags or {}))
+        return len(nodes)
+
+    def way(refs: List[int], tags: Dict[str, str]) -> int:
+        ways.append((len(ways) + 1, refs, tags))
+        return len(ways)
+
+    columns = int((xmax - xmin) / ROAD_STEP) + 1
+    rows = int((ymax - ymin) / ROAD_STEP) + 1
+    grid = [
+        [node(xmin + c * ROAD_STEP, ymin + r * ROAD_STEP) for c in range(columns)]
+        for r in range(rows)
+    ]
+    for r, row in enumerate(grid):
+        tags = {"highway": ROAD_CLASSES[r % len(ROAD_CLASSES)], "name": f"Rua {r + 1}"}
+        way(row, tags)
+    for c in range(columns):
+        tags = {"highway": ROAD_CLASSES[c % len(ROAD_CLASSES)], "name": f"Avenida {c + 1}"}
+        way([row[c] for row in grid], {**tags, "oneway": "yes", "maxspeed": "50"})
+
+    for index in range(pois):
+        key, value = KINDS[index % len(KINDS)]
+        tags = {key: value, "name": f"{value} {index + 1}"}
+        lon, lat = rnd.uniform(xmin, xmax), rnd.uniform(ymin, ymax)
+        roll = rnd.random()
+        if roll < 0.7 or key == "highway":
+            node(lon, lat, tags)
+            continue
+        h = LOT_HALF_SIZE
+        corners = [(lon - h, lat - h), (lon + h, lat - h), (lon + h, lat + h), (lon - h, lat + h)]
+        refs = [node(x, y) for x, y in corners]
+        refs.append(refs[0])
+        if roll < 0.9:
+            way(refs, {**tags, "building": "yes"})
+        else:
+            outer = way(refs, {})
+            relations.append(
+                (len(relations) + 1, [(1, outer, "outer")], {"type": "multipolygon", **tags})
+            )
+    return {"nodes": nodes, "ways": ways, "relations": relations}
+
+
+def write_extract(path: str | Path, data: Dict[str, List], compress: bool = True) -> Path:
+    """Write ``data`` (as :func:`synthetic_city` returns it) as an ``.osm.pbf`` file."""
+    path = Path(path)
+    header = b"".join(_bytes(4, f.encode()) for f in ("OsmSchema-V0.6", "DenseNodes"))
+    header += _bytes(16, b"flows-ia osm_pbf_writer")
+    chunks = [_blob("OSMHeader", header, compress)]
+    encoders: List[Tuple[str, Any]] = [
+        ("nodes", _dense),
+        ("ways", _way),
+        ("relations", _relation),
+    ]
+    for kind, encode in encoders:
+        items = data[kind]
+        for start in range(0, len(items), BLOCK_SIZE):
+            part = items[start : start + BLOCK_SIZE]
+            # nos vao todos num unico DenseNodes por bloco
+            chunks.append(_block(encode, [part] if kind == "nodes" else part, compress))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"".join(chunks))
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser("flows-ia synthetic osm.pbf")
+    parser.add_argument("path", help="arquivo .osm.pbf de saida")
+    parser.add_argument("--pois", type=int, default=2000)
+    parser.add_argument("--raw", action="store_true", help="blocos sem compressao")
+    args = parser.parse_args()
+    data = synthetic_city(pois=args.pois)
+    write_extract(args.path, data, compress=not args.raw)
+    counts = ", ".join(f"{len(items)} {kind}" for kind, items in data.items())
+    print(f"[ok] extrato sintetico em {args.path}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
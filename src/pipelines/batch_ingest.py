@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+try:
+    import yaml  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    yaml = None  # type: ignore
+
+from pipelines.ingest_city import run_ingest
+from pipelines.postprocess import default_workers
+from services.http_cache import HttpMetadataCache
+from services.transport import configure_limits, metrics
+from utils.io import ensure_dir
+
+CITY_CONFIG_DIR = "config/cities"
+MAX_PARALLEL_CITIES = 4
+BATCH_CONCURRENCY = 32
+BATCH_PER_HOST = 4
+REPORT_NAME = "batch_report.json"
+
+
+def parse_cities(value: str) -> List[Tuple[str, str]]:
+    """``"Londrina/PR, Maringá/PR"`` -> ``[("Londrina", "PR"), ("Maringá", "PR")]``."""
+    cities = []
+    for item in value.split(","):
+        city, _sep, state = item.strip().rpartition("/")
+        if city.strip() and state.strip():
+            cities.append((city.strip(), state.strip().upper()))
+        elif item.strip():
+            print(f"[warn] cidade ignorada (use Cidade/UF): {item.strip()}")
+    return cities
+
+
+def load_city_configs(config_dir: str | Path = CITY_CONFIG_DIR) -> List[Tuple[str, str]]:
+    """Cities (``municipio``/``uf``) of every ``*.yaml`` in ``config_dir``; ``_*.yaml`` are templates."""
+    if yaml is None:
+        raise RuntimeError("PyYAML nao instalado; use --cities Cidade/UF")
+    cities = []
+    for path in sorted(Path(config_dir).glob("*.yaml")):
+        if path.name.startswith("_"):
+            continue
+        data = yaml.safe_load(path.read_text(encoding="utf-8-sig")) or {}
+        city, state = data.get("municipio"), data.get("uf")
+        if not city or not state or "<<<" in f"{city}{state}":
+            print(f"[warn] {path} sem municipio/uf preenchidos; ignorado")
+            continue
+        cities.append((str(city), str(state).upper()))
+    return cities
+
+
+def _city_dir(city: str, state: str) -> str:
+    ascii_name = unicodedata.normalize("NFKD", city).encode("ascii", "ignore").decode()
+    return f"{'_'.join(ascii_name.lower().split())}_{state.lower()}"
+
+
+async def run_batch(
+    cities: List[Tuple[str, str]],
+    outputs: List[str],
+    modes: List[str],
+    what: str,
+    outdir: str,
+    max_cities: int = MAX_PARALLEL_CITIES,
+    concurrency: int = BATCH_CONCURRENCY,
+    per_host: int = BATCH_PER_HOST,
+    sync: bool = False,
+    profile: str | None = None,
+) -> Dict[str, Any]:
+    """Ingest several cities on one event loop and write a combined report.
+
+    Up to ``max_cities`` ingests run at once. Every request of every city goes through the same
+    pooled clients, capped at ``concurrency`` in flight and ``per_host`` per server, so cities
+    served by the same state server share its budget. The metadata cache and the worker
+    processes are shared too; each city writes to its own ``outdir/<cidade>_<uf>`` folder.
+    """
+    out = Path(outdir)
+    ensure_dir(out)
+    configure_limits(total=concurrency, per_host=per_host)
+    metrics.snapshot(reset=True)
+    cache = HttpMetadataCache()
+    window = asyncio.Semaphore(max(1, max_cities))
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    batch_started = time.perf_counter()
+
+    async def ingest(city: str, state: str, pool: ProcessPoolExecutor) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {"city": city, "state": state}
+        async with window:
+            started = time.perf_counter()
+            entry["waited_s"] = round(started - batch_started, 2)
+            try:
+                manifest = await run_ingest(
+                    city,
+                    state,
+                    outputs,
+                    modes,
+                    what,
+                    str(out / _city_dir(city, state)),
+                    sync=sync,
+                    profile=profile,
+                    cache=cache,
+                    pool=pool,
+                )
+            except Exception as exc:  # pragma: no cover - uma cidade nao derruba o lote
+                print(f"[warn] {city}/{state} falhou: {exc}")
+                entry.update(status="error", error=f"{type(exc).__name__}: {exc}")
+            else:
+                entry.update(
+                    status="ok",
+                    layers=len(manifest or []),
+                    features=sum(layer.get("features") or 0 for layer in manifest or []),
+                )
+            entry["seconds"] = round(time.perf_counter() - started, 2)
+        print(f"[info] {city}/{state}: {entry['status']} em {entry['seconds']}s")
+        return entry
+
+    with ProcessPoolExecutor(max_workers=default_workers()) as pool:
+        results = await asyncio.gather(*(ingest(city, state, pool) for city, state in cities))
+
+    report = {
+        "started_at": started_at,
+        "seconds": round(time.perf_counter() - batch_started, 2),
+        "limits": {"cities": max_cities, "concurrency": concurrency, "per_host": per_host},
+        "cities": results,
+        "ok": sum(1 for entry in results if entry["status"] == "ok"),
+        "failed": sum(1 for entry in results if entry["status"] != "ok"),
+        "metadata_cache": {
+            "hits": cache.hits,
+            "revalidated": cache.revalidated,
+            "misses": cache.misses,
+        },
+        "hosts": metrics.snapshot(),
+    }
+    (out / REPORT_NAME).write_text(
+        json.dumps(report, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    print(
+        f"[ok] lote: {report['ok']} cidades ok, {report['failed']} com falha -> {out / REPORT_NAME}"
+    )
+    return report
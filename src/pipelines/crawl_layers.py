@@ -5,13 +5,21 @@ from pathlib import Path
 from typing import Dict, List
 
 from services.arcgis_discovery import (
+    DEFAULT_CONCURRENCY,
+    PER_HOST_CONCURRENCY,
     candidate_roots_for_city,
-    crawl_all_layers,
-    fetch_geojson_paged,
+    dedupe_layers,
+    iter_all_layers,
 )
+from services.arcgis_download import download_layer
+from services.arcgis_probe import probe_roots
+from services.arcgis_sync import SyncState, sync_layer
+from services.http_cache import HttpMetadataCache
 from services.sources_ai import ai_discover_arcgis_roots
-from ui.interactive import interactive_filter_and_download
-from utils.io import ensure_dir, save_geojson
+from services.sources_osm import get_city_boundary
+from services.spatial_filter import BoundaryFilter
+from ui.interactive import interactive_filter_and_download, print_found_layer
+from utils.io import ensure_dir
 
 CATALOG_ROOTS: Dict[str, List[str]] = {
     "londrina|pr": [
@@ -31,6 +39,12 @@ async def run_discover_and_download(
     outputs: List[str],
     outdir: str,
     roots: List[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_host: int = PER_HOST_CONCURRENCY,
+    use_cache: bool = True,
+    sync: bool = False,
+    profile: str | None = None,
+    clip: bool = True,
 ) -> None:
     key = f"{city.lower()}|{state.lower()}"
     output_dir = Path(outdir)
@@ -52,11 +66,27 @@ async def run_discover_and_download(
 
     normalized_roots = sorted({_normalize_root(root) for root in roots_all if root})
 
+    # hosts adivinhados que nao existem caem aqui em segundos, antes do crawl
+    normalized_roots = await probe_roots(normalized_roots, use_cache=use_cache)
+
     if not normalized_roots:
         print("[warn] nenhuma raiz encontrada")
         return
 
-    found = crawl_all_layers(normalized_roots)
+    cache = HttpMetadataCache() if use_cache else None
+    raw: List = []
+    shown: set[str] = set()
+    async for position, item in iter_all_layers(
+        normalized_roots, concurrency=concurrency, per_host=per_host, cache=cache
+    ):
+        raw.append((position, item))
+        # a listagem acompanha a chegada, sem numeros: os indices valem so na tabela final
+        if item["dedupe_key"] not in shown:
+            shown.add(item["dedupe_key"])
+            print_found_layer(item)
+    found = dedupe_layers(raw)
+    if cache is not None:
+        print(f"[info] {cache.summary()}")
     if not found:
         print("[warn] nenhum servico encontrado")
         return
@@ -66,25 +96,31 @@ async def run_discover_and_download(
         print("[warn] nenhuma camada selecionada")
         return
 
+    area = await _city_area(city, state) if clip else None
     manifest = []
+    sync_state = SyncState(output_dir) if sync else None
     for item in selection:
         layer = item.get("layer", {})
         query_url = (layer.get("url") or "").rstrip("/") + "/query"
         name = item.get("display_name") or layer.get("name") or "layer"
-        geojson = fetch_geojson_paged(query_url)
-        if not geojson:
+        safe_name = name.lower().replace(" ", "_").replace("/", "_").replace("|", "_")
+        geojson_path = output_dir / f"{safe_name}.geojson"
+        options = {
+            "spool_root": output_dir / ".spool",
+            "kmz_path": output_dir / f"{safe_name}.kmz" if "kmz" in outputs else None,
+            "cache": cache,
+            "profile": profile,
+            "boundary": area,
+        }
+        if sync_state is not None:
+            stats = await sync_layer(query_url, geojson_path, sync_state, **options)
+        else:
+            stats = await download_layer(query_url, geojson_path, **options)
+        if not stats:
             print(f"[warn] falha ao baixar {name}")
             continue
-        safe_name = (
-            name.lower()
-            .replace(" ", "_")
-            .replace("/", "_")
-            .replace("|", "_")
-        )
-        geojson_path = output_dir / f"{safe_name}.geojson"
-        save_geojson(geojson, geojson_path)
-        manifest.append({"name": name, "geojson": str(geojson_path)})
-        print(f"[ok] salvo: {geojson_path}")
+        manifest.append({"name": name, **stats})
+        print(f"[ok] salvo: {geojson_path} ({stats['features']} feicoes)")
 
     manifest_path = output_dir / "manifest_crawler.json"
     manifest_path.write_text(
@@ -93,3 +129,14 @@ async def run_discover_and_download(
     )
     print(f"[ok] {len(manifest)} camadas baixadas -> {output_dir.resolve()}")
 
+
+async def _city_area(city: str, state: str) -> BoundaryFilter | None:
+    # servicos estaduais/federais achados pelo crawler cobrem o estado todo
+    try:
+        area = BoundaryFilter.from_geojson(await get_city_boundary(city, state))
+    except Exception as exc:  # pragma: no cover - defensive logging
+        print(f"[warn] limite municipal indisponivel ({exc}); baixando sem recorte")
+        return None
+    if area is None:
+        print("[warn] limite municipal nao encontrado; baixando sem recorte")
+    return area
@@ -2,13 +2,31 @@ from __future__ import annotations
 
 import asyncio
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple
 
+from pipelines.postprocess import LayerExporter
+from services.arcgis_download import download_layer
+from services.arcgis_sync import SyncState, sync_layer
+from services.http_cache import HttpMetadataCache
+from services.osm_pbf import OSM_PBF_PATH, pbf_pois
+from services.overpass import overpass_pois
 from services.sources_ai import ai_discover_sources
 from services.sources_arcgis import try_arcgis_geojson
-from services.sources_osm import get_city_boundary, overpass_pois
-from utils.io import ensure_dir, reproj_to_4326, save_geojson, to_kml_kmz
+from services.sources_osm import get_city_boundary
+from services.spatial_filter import BoundaryFilter
+from utils.blobstore import BlobStore
+from utils.io import ensure_dir
+
+# perfil de download padrao por tema (services/download_profiles.py); uma fonte pode
+# trazer "profile" proprio e --profile na CLI sobrepoe os dois
+THEME_PROFILES: Dict[str, str] = {
+    "educacao": "analysis",
+    "saude": "analysis",
+    "assistencia": "analysis",
+    "core": "display",
+}
 
 CATALOG: Dict[str, Dict] = {
     "londrina|pr": {
@@ -132,12 +150,50 @@ CATALOG: Dict[str, Dict] = {
 }
 
 
-async def _collect_source(source: Dict) -> Dict | None:
+async def _collect_source(
+    source: Dict,
+    out: Path,
+    prefix: str,
+    want_kmz: bool,
+    state: SyncState | None = None,
+    profile: str | None = None,
+    boundary: BoundaryFilter | None = None,
+    cache: HttpMetadataCache | None = None,
+    store: BlobStore | None = None,
+) -> Dict | None:
+    name = source["name"]
+    profile = profile or source.get("profile")
     try:
         if source.get("type") == "arcgis_query":
-            geojson = await try_arcgis_geojson(source["url"], source.get("params", {}))
+            # paginado, com checkpoint em disco e gravado direto no arquivo final (memoria ~1 pagina)
+            dest = out / f"{prefix}_{name}.geojson"
+            options = {
+                "params": source.get("params", {}),
+                "spool_root": out / ".spool",
+                "kmz_path": out / f"{prefix}_{name}.kmz" if want_kmz else None,
+                "profile": profile,
+                "boundary": boundary,
+                "cache": cache,
+            }
+            if state is not None:
+                stats = await sync_layer(source["url"], dest, state, **options)
+            else:
+                stats = await download_layer(source["url"], dest, **options)
+            if stats and store is not None:
+                # mesma camada ja baixada antes (ou por outra cidade): o arquivo vira link do blob
+                stats["sha256"], _new = await asyncio.to_thread(store.put_file, dest)
+                store.record(source["url"], options["params"], stats["sha256"], name=name)
+                if options["kmz_path"] is not None:
+                    await asyncio.to_thread(store.put_file, options["kmz_path"])
+            return {"name": name, "stats": stats} if stats else None
         elif source.get("type") == "arcgis_try":
-            geojson = await try_arcgis_geojson(source["url"], source.get("params", {}), soft=True)
+            geojson = await try_arcgis_geojson(
+                source["url"],
+                source.get("params", {}),
+                soft=True,
+                profile=profile,
+                boundary=boundary,
+            )
         else:
             return None
     except Exception as exc:  # pragma: no cover - defensive logging
@@ -145,76 +201,178 @@ async def _collect_source(source: Dict) -> Dict | None:
         return None
     if not geojson:
         return None
-    return {"name": source["name"], "geojson": geojson}
+    origin = {"url": source["url"], "params": source.get("params", {}), "name": name}
+    return {"name": name, "geojson": geojson, "origin": origin}
+
+
+POI_KINDS = ["hospital", "clinic", "school", "kindergarten", "bus_stop"]
+POI_LAYER = "osm_pois_saude_educacao_onibus"
+# ordem das camadas no manifest: catalogo, fontes da IA, POIs do OSM
+CATALOG_GROUP, AI_GROUP, OSM_GROUP = 0, 1, 2
+
+
+async def _city_boundary(city: str, state: str) -> Dict | None:
+    try:
+        return await get_city_boundary(city, state)
+    except Exception as exc:  # pragma: no cover - defensive logging
+        print(f"[warn] limite municipal indisponivel ({exc}); seguindo sem recorte")
+        return None
+
+
+async def _boundary_area(boundary_task: asyncio.Task) -> BoundaryFilter | None:
+    # servicos estaduais/federais devolvem o estado todo; so baixamos o que toca o municipio
+    return BoundaryFilter.from_geojson(await boundary_task)
+
+
+async def _osm_pois(boundary: Dict) -> Dict | None:
+    bbox = boundary_bbox(boundary)
+    if OSM_PBF_PATH:
+        # extrato local: sem Overpass, decodificado fora do loop
+        pois = await asyncio.to_thread(pbf_pois, OSM_PBF_PATH, bbox, POI_KINDS)
+    else:
+        pois = await overpass_pois(bbox, kinds=POI_KINDS)
+    return {"name": POI_LAYER, "geojson": pois} if pois else None
+
+
+async def _boundary_layer(boundary: Dict) -> Dict:
+    return {"name": "boundary", "geojson": boundary}
+
+
+async def _in_memory(
+    exporter: LayerExporter, fetch, tag: Any, out: Path, prefix: str, want_kmz: bool
+) -> None:
+    # reserva a vaga antes de baixar: com os workers ocupados, o download espera
+    await exporter.reserve()
+    try:
+        result = await fetch
+    except BaseException:
+        exporter.release()
+        raise
+    if not result:
+        exporter.release()
+        return
+    name = result["name"]
+    kmz_path = out / f"{prefix}_{name}.kmz" if want_kmz else None
+    await exporter.submit(
+        tag,
+        name,
+        result["geojson"],
+        out / f"{prefix}_{name}.geojson",
+        kmz_path,
+        result.get("origin"),
+    )
+
 
+async def run_ingest(city: str, state: str, outputs: List[str], modes: List[str], what: str, outdir: str, interactive: bool = False, sync: bool = False, profile: str | None = None, cache: HttpMetadataCache | None = None, pool: ProcessPoolExecutor | None = None):
+    """Ingest every source of a city as a small task graph.
 
-async def run_ingest(city: str, state: str, outputs: List[str], modes: List[str], what: str, outdir: str, interactive: bool = False):
+    The boundary lookup, AI discovery and catalog downloads start together; catalog and AI
+    downloads wait only for the boundary (its envelope goes into the queries), and Overpass
+    starts as soon as the boundary resolves. Paged ArcGIS layers stream to disk; layers fetched
+    into memory go through a bounded :class:`LayerExporter` that reprojects and writes them in
+    a process pool as they arrive. ``cache`` and ``pool`` let a batch share the metadata cache
+    and the worker processes across cities. Every layer is filed in the content-addressed
+    :class:`BlobStore`, so unchanged layers are linked from it instead of written again.
+    """
     key = f"{city.lower()}|{state.lower()}"
+    safe_key = key.replace("|", "_")
+    want_kmz = "kmz" in outputs
     out = Path(outdir)
     ensure_dir(out)
 
-    boundary = await get_city_boundary(city, state)
-    if boundary:
-        save_geojson(boundary, out / f"{city}_{state}_boundary.geojson")
-        if "kmz" in outputs:
-            to_kml_kmz(boundary, out / f"{city}_{state}_boundary.kmz")
-
     sources: List[Dict] = []
     if "catalog" in modes and key in CATALOG:
-        if what == "all":
-            for items in CATALOG[key].values():
-                sources.extend(items)
-        else:
-            sources.extend(CATALOG[key].get(what, []))
+        themes = CATALOG[key] if what == "all" else {what: CATALOG[key].get(what, [])}
+        for theme, items in themes.items():
+            sources.extend({"profile": THEME_PROFILES.get(theme), **item} for item in items)
 
-    if "ai" in modes:
-        ai_sources = await ai_discover_sources(city, state, what=what)
-        if ai_sources:
-            sources.extend(ai_sources)
-
-    collected: List[Dict] = []
-    if sources:
-        results = await asyncio.gather(
-            *(_collect_source(source) for source in sources),
-            return_exceptions=True,
-        )
-        for result in results:
-            if isinstance(result, Exception):
-                print("[warn] arcgis task failed:", result)
-                continue
-            if result:
-                collected.append(result)
-
-    if boundary:
-        bbox = boundary_bbox(boundary)
-        pois = await overpass_pois(
-            bbox,
-            kinds=["hospital", "clinic", "school", "kindergarten", "bus_stop"],
+    sync_state = SyncState(out) if sync else None
+    store = BlobStore()
+    exporter = LayerExporter(pool=pool, store=store)
+    # cada tarefa carrega (etapa, posicao no manifest); o laco abaixo agenda as dependentes
+    tasks: Dict[asyncio.Task, Tuple[str, Any]] = {}
+
+    def spawn(stage: str, coro, tag: Any = None) -> None:
+        tasks[asyncio.create_task(coro)] = (stage, tag)
+
+    boundary_task = asyncio.create_task(_city_boundary(city, state))
+    tasks[boundary_task] = ("boundary", None)
+    area_task = asyncio.create_task(_boundary_area(boundary_task))
+
+    async def collect(source: Dict, tag: Tuple[int, int]) -> Dict | None:
+        area = await area_task
+        fetch = _collect_source(
+            source, out, safe_key, want_kmz, sync_state, profile, area, cache, store
         )
-        if pois:
-            collected.append({"name": "osm_pois_saude_educacao_onibus", "geojson": pois})
-
-    manifest = []
-    for item in collected:
-        name = item["name"]
-        geojson = reproj_to_4326(item["geojson"])
-        safe_key = key.replace("|", "_")
-        geo_path = out / f"{safe_key}_{name}.geojson"
-        save_geojson(geojson, geo_path)
-        if "kmz" in outputs:
-            to_kml_kmz(geojson, out / f"{safe_key}_{name}.kmz")
-        manifest.append({"name": name, "geojson": str(geo_path)})
+        if source.get("type") == "arcgis_query":
+            # paginado: vai direto para o disco, nao ocupa vaga do exporter
+            return await fetch
+        await _in_memory(exporter, fetch, tag, out, safe_key, want_kmz)
+        return None
+
+    for index, source in enumerate(sources):
+        spawn("layer", collect(source, (CATALOG_GROUP, index)), (CATALOG_GROUP, index))
+    if "ai" in modes:
+        spawn("ai", ai_discover_sources(city, state, what=what))
 
+    manifest: List[Tuple[Tuple[int, int], Dict]] = []
+    try:
+        while tasks:
+            done, _pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                stage, tag = tasks.pop(task)
+                try:
+                    result = task.result()
+                except Exception as exc:  # pragma: no cover - defensive logging
+                    print(f"[warn] etapa {stage} falhou:", exc)
+                    continue
+                if stage == "boundary" and result:
+                    spawn(
+                        "export",
+                        _in_memory(
+                            exporter,
+                            _boundary_layer(result),
+                            None,
+                            out,
+                            f"{city}_{state}",
+                            want_kmz,
+                        ),
+                    )
+                    spawn(
+                        "layer",
+                        _in_memory(
+                            exporter, _osm_pois(result), (OSM_GROUP, 0), out, safe_key, want_kmz
+                        ),
+                    )
+                elif stage == "ai":
+                    for index, source in enumerate(result or []):
+                        spawn("layer", collect(source, (AI_GROUP, index)), (AI_GROUP, index))
+                elif stage == "layer" and result:
+                    # ja gravado em disco pelo download paginado
+                    manifest.append((tag, {"name": result["name"], **result["stats"]}))
+    finally:
+        for task in [*tasks, area_task]:
+            task.cancel()
+        await asyncio.gather(*tasks, area_task, return_exceptions=True)
+        # espera os workers: o manifest vem do que eles gravaram
+        manifest.extend(await exporter.close())
+
+    manifest.sort(key=lambda entry: entry[0])
     (out / f"{key}_manifest.json").write_text(
-        json.dumps(manifest, ensure_ascii=False, indent=2),
+        json.dumps([entry for _order, entry in manifest], ensure_ascii=False, indent=2),
         encoding="utf-8",
     )
     print("[ok]", len(manifest), "layers saved in", out.resolve())
+    return [entry for _order, entry in manifest]
 
 
 def boundary_bbox(geojson: dict):
     import math
 
+    if geojson.get("bbox"):
+        # ja calculado pelo cache de limites (services/geocoding.py)
+        return tuple(geojson["bbox"][:4])
+
     xmin, ymin, xmax, ymax = math.inf, math.inf, -math.inf, -math.inf
 
     def iterator(geom):
@@ -238,4 +396,3 @@ def boundary_bbox(geojson: dict):
             xmax = max(xmax, x)
             ymax = max(ymax, y)
     return (xmin, ymin, xmax, ymax)
-
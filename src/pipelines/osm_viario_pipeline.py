@@ -4,3 +4,77 @@ Objective: implement collection/normalisation/export steps for the theme.
 Notes: keep CRS EPSG:4326, record source/url/date/licence/hash.
 """
 from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from services.geocoding import lookup_boundary
+from services.osm_pbf import OsmPbfReader
+from utils.io import write_feature_collection
+
+LAYER_NAME = "osm_viario"
+# classes de via trafegaveis por carro (os *_link entram junto)
+DEFAULT_CLASSES = [
+    "motorway",
+    "trunk",
+    "primary",
+    "secondary",
+    "tertiary",
+    "unclassified",
+    "residential",
+    "living_street",
+    "service",
+]
+KEEP_TAGS = ("highway", "name", "ref", "surface", "maxspeed", "oneway", "lanes")
+
+
+def _road(feature: Dict[str, Any]) -> Dict[str, Any]:
+    props = feature["properties"]
+    properties = {key: props[key] for key in KEEP_TAGS if key in props}
+    properties["osm_id"] = props["id"]
+    return {"type": "Feature", "properties": properties, "geometry": feature["geometry"]}
+
+
+def road_features(
+    pbf: str | Path,
+    bbox: Tuple[float, float, float, float] | None = None,
+    classes: Iterable[str] | None = None,
+    workers: int | None = None,
+):
+    """Road ways of ``classes`` (and their ``_link`` ramps) touching ``bbox``, as LineStrings."""
+    values = set()
+    for name in classes or DEFAULT_CLASSES:
+        values.update((name, f"{name}_link"))
+    reader = OsmPbfReader(pbf, workers=workers)
+    for feature in reader.features({"highway": values}, bbox):
+        if feature["properties"]["osm_type"] == "way":
+            yield _road(feature)
+
+
+async def run_viario(
+    pbf: str,
+    outdir: str,
+    city: str | None = None,
+    state: str | None = None,
+    bbox: Tuple[float, float, float, float] | None = None,
+    classes: List[str] | None = None,
+    workers: int | None = None,
+) -> Path | None:
+    """Extract the road network of a city (or ``bbox``) from a local ``.osm.pbf``."""
+    if bbox is None and city and state:
+        record = await lookup_boundary(city, state)
+        if record is None:
+            print(f"[warn] limite de {city}/{state} nao encontrado; extraindo o extrato inteiro")
+        else:
+            bbox = record.bbox
+    dest = Path(outdir) / f"{LAYER_NAME}.geojson"
+    count = await asyncio.to_thread(
+        write_feature_collection, road_features(pbf, bbox, classes, workers), dest
+    )
+    if not count:
+        dest.unlink(missing_ok=True)
+        print(f"[warn] nenhuma via encontrada em {pbf}")
+        return None
+    print(f"[ok] {count} vias -> {dest}")
+    return dest
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from utils.blobstore import BlobStore
+from utils.io import export_layer, reproj_to_4326
+
+MAX_WORKERS = 4
+# camadas baixadas e ainda nao gravadas que podem ficar em memoria, alem das que estao nos workers
+QUEUE_SIZE = 4
+
+
+def default_workers() -> int:
+    return min(MAX_WORKERS, os.cpu_count() or 1)
+
+
+def finish_layer(
+    geojson: Dict,
+    geojson_path: Path,
+    kmz_path: Path | None,
+    store: BlobStore | None = None,
+    origin: Dict[str, Any] | None = None,
+) -> Dict[str, Any]:
+    """Reproject and write one layer; runs inside a worker process.
+
+    With a ``store`` the raw layer is filed by hash (and indexed under ``origin``'s URL and
+    parameters). A hash that was already exported to the same formats is not reprojected or
+    rewritten again: its outputs are linked from the store.
+    """
+    if store is None:
+        result = export_layer(reproj_to_4326(geojson), geojson_path, kmz_path)
+        result["features"] = len(geojson.get("features") or [])
+        result["bytes"] = geojson_path.stat().st_size
+        return result
+    raw, _new = store.put_json(geojson)
+    if origin and origin.get("url"):
+        store.record(origin["url"], origin.get("params"), raw, name=origin.get("name"))
+    stage = "export+kmz" if kmz_path is not None else "export"
+    done = store.processed(stage, raw)
+    if done and store.has(done.get("geojson")) and (kmz_path is None or store.has(done.get("kmz"))):
+        result = {"geojson": str(store.materialize(done["geojson"], geojson_path))}
+        if kmz_path is not None:
+            result["kmz"] = str(store.materialize(done["kmz"], kmz_path))
+        return result | {"features": done["features"], "bytes": done["bytes"], "sha256": raw}
+    result = export_layer(reproj_to_4326(geojson), geojson_path, kmz_path)
+    result["features"] = len(geojson.get("features") or [])
+    result["bytes"] = geojson_path.stat().st_size
+    outputs = {"geojson": store.put_file(geojson_path)[0]}
+    if kmz_path is not None:
+        outputs["kmz"] = store.put_file(kmz_path)[0]
+    store.mark(stage, raw, outputs | {"features": result["features"], "bytes": result["bytes"]})
+    return result | {"sha256": raw}
+
+
+class LayerExporter:
+    """Bounded producer/consumer stage that writes in-memory layers from a process pool.
+
+    Producers :meth:`reserve` a slot *before* fetching a layer into memory and :meth:`submit` it
+    once it arrives; a slot is only given back after a worker wrote the layer. At most
+    ``queue_size + workers`` layers are held in memory, so fast downloads wait for the writers
+    instead of piling up. Worker results are collected for the manifest. A shared ``pool`` (e.g.
+    one per batch of cities) is used as is and left open. With a ``store``, layers whose raw
+    content was already exported are linked from it instead of being written again.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        queue_size: int = QUEUE_SIZE,
+        pool: ProcessPoolExecutor | None = None,
+        store: BlobStore | None = None,
+    ):
+        self.store = store
+        self.workers = max(1, workers or default_workers())
+        self._owns_pool = pool is None
+        self._pool = pool or ProcessPoolExecutor(max_workers=self.workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._slots = asyncio.Semaphore(max(1, queue_size) + self.workers)
+        self._results: List[Tuple[Any, Dict[str, Any]]] = []
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    async def reserve(self) -> None:
+        await self._slots.acquire()
+
+    def release(self) -> None:
+        """Give back a reserved slot whose layer never arrived."""
+        self._slots.release()
+
+    async def submit(
+        self,
+        tag: Any,
+        name: str,
+        geojson: Dict,
+        geojson_path: Path,
+        kmz_path: Path | None,
+        origin: Dict[str, Any] | None = None,
+    ) -> None:
+        """Queue a layer (holding a reserved slot); ``tag=None`` keeps it out of the results.
+
+        ``origin`` (``url``/``params``) is where the layer came from, for the store's index.
+        """
+        await self._queue.put((tag, name, geojson, geojson_path, kmz_path, origin))
+
+    async def _consume(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            tag, name, geojson, geojson_path, kmz_path, origin = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(
+                    self._pool, finish_layer, geojson, geojson_path, kmz_path, self.store, origin
+                )
+                if tag is not None:
+                    self._results.append((tag, {"name": name, **result}))
+            except Exception as exc:  # pragma: no cover - defensive logging
+                print(f"[warn] falha ao gravar {name}:", exc)
+            finally:
+                # solta a camada antes de esperar a proxima
+                del geojson
+                self._queue.task_done()
+                self._slots.release()
+
+    async def close(self) -> List[Tuple[Any, Dict[str, Any]]]:
+        """Wait for every queued layer, stop the workers and return ``(tag, entry)`` pairs."""
+        try:
+            await self._queue.join()
+        finally:
+            for consumer in self._consumers:
+                consumer.cancel()
+            await asyncio.gather(*self._consumers, return_exceptions=True)
+            if self._owns_pool:
+                await asyncio.to_thread(self._pool.shutdown, wait=True, cancel_futures=True)
+        return self._results
@@ -1,13 +1,31 @@
 ﻿from __future__ import annotations
 
+import asyncio
+import gzip
+import hashlib
 import json
+import os
 import time
 from pathlib import Path
-from typing import Dict, Mapping
+from typing import Dict, Mapping, Tuple
 
 import httpx
 
-GOOGLE_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+from ..services.transport import async_client, sync_client
+from ..utils.cache import DiskCache, is_fresh
+from ..utils.ratelimit import TokenBucket
+
+GOOGLE_DIRECTIONS_URL = os.getenv(
+    "GOOGLE_DIRECTIONS_URL", "https://maps.googleapis.com/maps/api/directions/json"
+)
+# OVER_QUERY_LIMIT vem com HTTP 200: o transporte nao repete, entao repetimos aqui
+QUOTA_RETRIES = 2
+QUOTA_BACKOFF_SECONDS = 2.0
+# janela do cache: minutos (ex. "15") ou "weekday-hour" (dia da semana + hora, para historico)
+TRAFFIC_BUCKET = os.getenv("FLOWS_TRAFFIC_BUCKET", "15")
+TRAFFIC_TTL_SECONDS = float(os.getenv("FLOWS_TRAFFIC_TTL", 30 * 86400))
+# ~11 m: pontos do mesmo trecho de via caem na mesma chave
+COORD_DECIMALS = 4
 
 
 class TrafficMetricsError(RuntimeError):
@@ -33,16 +51,89 @@ def _extract_leg(data: Dict) -> Dict:
     return legs[0]
 
 
-def run_segment(
-    api_key: str,
+def check_bucket(spec: str | int) -> str:
+    """Normalized ``spec`` for :func:`time_bucket`; ``ValueError`` if it is not one."""
+    spec = str(spec).strip()
+    if spec == "weekday-hour" or (spec.isdigit() and int(spec) > 0):
+        return spec
+    raise ValueError(f"janela de cache invalida: {spec!r} (use minutos, ex. 15, ou weekday-hour)")
+
+
+def time_bucket(spec: str | int = TRAFFIC_BUCKET, now: float | None = None) -> str:
+    """Label of the cache window holding ``now`` (local time).
+
+    ``"15"`` -> start of the 15-minute window (``"2026-10-19T08:15"``); ``"weekday-hour"`` ->
+    ``"wd0-08h"`` (Monday 8h), so historical runs reuse the same hour of past weeks.
+    """
+    now = time.time() if now is None else now
+    if str(spec) == "weekday-hour":
+        moment = time.localtime(now)
+        return f"wd{moment.tm_wday}-{moment.tm_hour:02d}h"
+    window = max(1, int(spec)) * 60
+    return time.strftime("%Y-%m-%dT%H:%M", time.localtime(now // window * window))
+
+
+def segment_key(
     origin: Mapping[str, float],
     destination: Mapping[str, float],
-    outdir: Path | None = None,
-) -> Dict:
+    mode: str = "driving",
+    bucket: str = "",
+    endpoint: str | None = None,
+) -> str:
+    def rounded(point: Mapping[str, float]) -> str:
+        lat, lon = (float(v) for v in _format_latlon(point).split(","))
+        return f"{lat:.{COORD_DECIMALS}f},{lon:.{COORD_DECIMALS}f}"
+
+    # endpoint na chave: respostas do fake_directions nao passam por respostas do Google
+    endpoint = endpoint or GOOGLE_DIRECTIONS_URL
+    return f"{endpoint}|{mode}|{rounded(origin)}|{rounded(destination)}|{bucket}"
+
+
+class TrafficCache:
+    """Directions responses on disk (``<cache>/traffic``, gzip), one per segment and time window.
+
+    The key is the endpoint, the rounded origin/destination, the travel mode and
+    :func:`time_bucket`, so a scorecard repeated within the same window (or, with
+    ``"weekday-hour"``, the same hour of another week) costs no API call. Only ``OK`` answers
+    are stored.
+    """
+
+    def __init__(
+        self,
+        bucket: str | int = TRAFFIC_BUCKET,
+        cache: DiskCache | None = None,
+        ttl: float = TRAFFIC_TTL_SECONDS,
+    ):
+        self.bucket = check_bucket(bucket)
+        self.cache = cache if cache is not None else DiskCache("traffic", compress=True)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, origin: Mapping[str, float], destination: Mapping[str, float]) -> str:
+        return segment_key(origin, destination, "driving", time_bucket(self.bucket))
+
+    def get(self, key: str) -> Tuple[Dict, float] | None:
+        """``(payload, stored_at)`` of a fresh entry."""
+        entry = self.cache.load(key)
+        if entry is None or not is_fresh(entry, self.ttl) or not entry.get("value"):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["value"], float(entry["stored_at"])
+
+    def put(self, key: str, payload: Dict) -> None:
+        if payload.get("status") == "OK":
+            self.cache.set(key, payload)
+
+    def summary(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "bucket": self.bucket}
+
+
+def _params(api_key: str, origin: Mapping[str, float], destination: Mapping[str, float]) -> Dict:
     if not api_key:
         raise TrafficMetricsError("Google Maps API key is missing")
-
-    params = {
+    return {
         "origin": _format_latlon(origin),
         "destination": _format_latlon(destination),
         "departure_time": "now",
@@ -51,15 +142,8 @@ def run_segment(
         "key": api_key,
     }
 
-    try:
-        with httpx.Client(timeout=httpx.Timeout(30.0)) as client:
-            response = client.get(GOOGLE_DIRECTIONS_URL, params=params)
-            response.raise_for_status()
-    except httpx.HTTPError as exc:  # pragma: no cover - network dependent
-        raise TrafficMetricsError(f"Google Maps request failed: {exc}") from exc
-
-    payload = response.json()
 
+def _metrics(payload: Dict) -> Dict:
     status = payload.get("status", "UNKNOWN")
     if status != "OK":
         raise TrafficMetricsError(f"Google Maps returned status {status}")
@@ -76,7 +160,7 @@ def run_segment(
         raise TrafficMetricsError("Google Maps response did not include duration/distance")
 
     tti = max(0.0, float(duration_in_traffic) / max(1.0, float(duration)))
-    result = {
+    return {
         "duration_s": float(duration_in_traffic),
         "static_s": float(duration),
         "distance_m": float(distance),
@@ -86,9 +170,93 @@ def run_segment(
         "fetched_at": int(time.time()),
     }
 
-    if outdir:
-        outdir.mkdir(parents=True, exist_ok=True)
-        raw_path = outdir / "last_segment_raw.json"
-        raw_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
 
+def _save_raw(payload: Dict, outdir: Path | None, key: str) -> str | None:
+    """Write the raw response to ``<outdir>/raw/<segment>.json.gz``; returns its path."""
+    if not outdir:
+        return None
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    raw_path = outdir / "raw" / f"{digest}.json.gz"
+    raw_path.parent.mkdir(parents=True, exist_ok=True)
+    # segmentos em paralelo: cada um grava num temporario proprio e troca de uma vez
+    tmp = raw_path.with_name(f"{raw_path.name}.{os.getpid()}.{id(payload)}.tmp")
+    tmp.write_bytes(gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+    os.replace(tmp, raw_path)
+    return str(raw_path)
+
+
+def _result(payload: Dict, outdir: Path | None, key: str, **extra) -> Dict:
+    result = _metrics(payload)
+    result.update(extra)
+    result["raw_path"] = _save_raw(payload, outdir, key)
+    return result
+
+
+def _cached(cache: TrafficCache | None, key: str, outdir: Path | None) -> Dict | None:
+    found = cache.get(key) if cache is not None else None
+    if found is None:
+        return None
+    payload, stored_at = found
+    return _result(payload, outdir, key, fetched_at=int(stored_at), cache="hit")
+
+
+def run_segment(
+    api_key: str,
+    origin: Mapping[str, float],
+    destination: Mapping[str, float],
+    outdir: Path | None = None,
+    cache: TrafficCache | None = None,
+) -> Dict:
+    params = _params(api_key, origin, destination)
+    key = cache.key(origin, destination) if cache is not None else segment_key(origin, destination)
+    cached = _cached(cache, key, outdir)
+    if cached is not None:
+        return cached
+
+    try:
+        response = sync_client("api").get(GOOGLE_DIRECTIONS_URL, params=params)
+        response.raise_for_status()
+    except httpx.HTTPError as exc:  # pragma: no cover - network dependent
+        raise TrafficMetricsError(f"Google Maps request failed: {exc}") from exc
+
+    payload = response.json()
+    result = _result(payload, outdir, key, cache="miss" if cache is not None else "off")
+    if cache is not None:
+        cache.put(key, payload)
+    return result
+
+
+async def run_segment_async(
+    api_key: str,
+    origin: Mapping[str, float],
+    destination: Mapping[str, float],
+    outdir: Path | None = None,
+    limiter: TokenBucket | None = None,
+    client: httpx.AsyncClient | None = None,
+    cache: TrafficCache | None = None,
+) -> Dict:
+    """:func:`run_segment` over the pooled async client, paced by ``limiter`` (QPS)."""
+    params = _params(api_key, origin, destination)
+    key = cache.key(origin, destination) if cache is not None else segment_key(origin, destination)
+    cached = _cached(cache, key, outdir)
+    if cached is not None:
+        return cached
+    client = client or async_client("api")
+
+    for attempt in range(QUOTA_RETRIES + 1):
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            response = await client.get(GOOGLE_DIRECTIONS_URL, params=params)
+            response.raise_for_status()
+            payload = response.json()
+        except (httpx.HTTPError, ValueError) as exc:
+            raise TrafficMetricsError(f"Google Maps request failed: {exc}") from exc
+        if payload.get("status") != "OVER_QUERY_LIMIT" or attempt == QUOTA_RETRIES:
+            break
+        await asyncio.sleep(QUOTA_BACKOFF_SECONDS * 2**attempt)
+
+    result = _result(payload, outdir, key, cache="miss" if cache is not None else "off")
+    if cache is not None:
+        cache.put(key, payload)
     return result
@@ -1,10 +1,18 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import csv
+import os
 from pathlib import Path
 from typing import Dict, List, Tuple
 
-from .traffic_metrics import run_segment
+from ..services.transport import async_client, run
+from ..utils.ratelimit import TokenBucket
+from .traffic_metrics import TRAFFIC_BUCKET, TrafficCache, run_segment_async
+
+# cota padrao do Directions API: 50 QPS por projeto; ficamos bem abaixo por seguranca
+DEFAULT_QPS = float(os.getenv("GOOGLE_MAPS_QPS", 10))
+DEFAULT_CONCURRENCY = 8
 
 
 def fmt_pct(value: float | None) -> str:
@@ -49,6 +57,19 @@ def row_from_segment(name: str, relevance_txt: str, seg: Dict) -> Dict:
     }
 
 
+def error_row(name: str, relevance_txt: str) -> Dict:
+    """Row of a candidate whose segment could not be measured."""
+    return {
+        "Via": name,
+        "Relevancia": relevance_txt or "n/d",
+        "TTI Medio (agora)": "n/d",
+        "Atraso por km": "n/d",
+        "% do Trecho Congestionado": "n/d",
+        "Potencial de Reducao de Tempo": "n/d",
+        "Score de Prioridade": "ERRO",
+    }
+
+
 def to_markdown_table(rows: List[Dict]) -> str:
     vias = [r["Via"] for r in rows]
     fields = [
@@ -75,26 +96,87 @@ def save_csv(rows: List[Dict], out_csv: Path):
             writer.writerow({k: row.get(k, "") for k in keys})
 
 
-def run_scorecard(api_key: str, candidates: List[Dict], outdir: Path) -> Dict:
+async def run_scorecard_async(
+    api_key: str,
+    candidates: List[Dict],
+    outdir: Path,
+    qps: float = DEFAULT_QPS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    bucket: str = TRAFFIC_BUCKET,
+    use_cache: bool = True,
+) -> Dict:
+    """Measure every candidate concurrently over one pooled client, at most ``qps`` requests/s.
+
+    A candidate that fails gets an ``ERRO`` row and its message in ``errors``; the others go on.
+    Segments already fetched in the same ``bucket`` window come from the :class:`TrafficCache`.
+    """
     outdir.mkdir(parents=True, exist_ok=True)
-    result_rows = []
-    for candidate in candidates:
-        segment = run_segment(
-            api_key=api_key,
-            origin=candidate["origin"],
-            destination=candidate["destination"],
-            outdir=outdir,
-        )
-        result_rows.append(
-            row_from_segment(
-                name=candidate["name"],
-                relevance_txt=candidate.get("relevance", "n/d"),
-                seg=segment,
-            )
-        )
+    # sem rajada: a cota do Google e por segundo, nao por media
+    limiter = TokenBucket(qps, burst=1)
+    slots = asyncio.Semaphore(max(1, concurrency))
+    client = async_client("api")
+    cache = TrafficCache(bucket) if use_cache else None
+
+    async def measure(candidate: Dict) -> Tuple[Dict, Dict | None]:
+        name = candidate.get("name") or "n/d"
+        relevance = candidate.get("relevance", "n/d")
+        try:
+            async with slots:
+                segment = await run_segment_async(
+                    api_key=api_key,
+                    origin=candidate["origin"],
+                    destination=candidate["destination"],
+                    outdir=outdir,
+                    limiter=limiter,
+                    client=client,
+                    cache=cache,
+                )
+        except Exception as exc:
+            print(f"[warn] scorecard: {name}: {exc}")
+            return error_row(name, relevance), {"name": name, "error": str(exc)}
+        return row_from_segment(name=name, relevance_txt=relevance, seg=segment), None
+
+    measured = await asyncio.gather(*(measure(c) for c in candidates))
+    result_rows = [row for row, _error in measured]
+    errors = [error for _row, error in measured if error is not None]
     markdown = to_markdown_table(result_rows)
+    stats = cache.summary() if cache is not None else None
+    if stats is not None:
+        markdown += (
+            f"\n\nCache de trafego (janela {stats['bucket']}): "
+            f"{stats['hits']} consultas reaproveitadas, {stats['misses']} ao Google\n"
+        )
     out_md = outdir / "scorecard.md"
     out_md.write_text(markdown, encoding="utf-8")
     out_csv = outdir / "scorecard.csv"
-    save_csv(result_rows, out_csv)
-    return {"markdown": str(out_md), "csv": str(out_csv), "rows": result_rows}
+    if result_rows:
+        save_csv(result_rows, out_csv)
+    return {
+        "markdown": str(out_md),
+        "csv": str(out_csv),
+        "rows": result_rows,
+        "errors": errors,
+        "cache": stats,
+    }
+
+
+def run_scorecard(
+    api_key: str,
+    candidates: List[Dict],
+    outdir: Path,
+    qps: float = DEFAULT_QPS,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    bucket: str = TRAFFIC_BUCKET,
+    use_cache: bool = True,
+) -> Dict:
+    return run(
+        run_scorecard_async(
+            api_key,
+            candidates,
+            outdir,
+            qps=qps,
+            concurrency=concurrency,
+            bucket=bucket,
+            use_cache=use_cache,
+        )
+    )
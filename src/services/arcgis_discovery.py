@@ -1,16 +1,21 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import hashlib
-import time
 import unicodedata
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Tuple
 
-import requests
+import httpx
 
-DEFAULT_TIMEOUT_SECONDS = 40
-PAGED_TIMEOUT_SECONDS = 120
-PAGE_SIZE = 2000
-MAX_PAGES = 1000
+from services.arcgis_download import fetch_geojson_paged_async
+from services.http_cache import HttpMetadataCache
+from services.transport import (
+    DEFAULT_CONCURRENCY,
+    PER_HOST_CONCURRENCY,
+    HostLimiter,
+    async_client,
+    run,
+)
 
 
 def _slugify(value: str) -> str:
@@ -33,26 +38,32 @@ def _ensure_pjson(url: str) -> str:
     return url if "f=pjson" in url else f"{url.rstrip('/')}?f=pjson"
 
 
-def _get_json(url: str) -> Dict | None:
+async def _get_json(
+    client: httpx.AsyncClient,
+    limiter: HostLimiter,
+    url: str,
+    cache: HttpMetadataCache | None = None,
+) -> Dict | None:
+    target = _ensure_pjson(url)
     try:
-        response = requests.get(_ensure_pjson(url), timeout=DEFAULT_TIMEOUT_SECONDS)
+        async with limiter.slot(target):
+            if cache is not None:
+                return await cache.get_json(client, target)
+            response = await client.get(target)
         response.raise_for_status()
         return response.json()
-    except (requests.RequestException, ValueError):
+    except (httpx.HTTPError, ValueError):
         return None
 
 
 def _build_service_url(base: str, folder: str, name: str, service_type: str) -> str:
-    if folder:
+    # dentro de uma pasta o ArcGIS ja devolve o nome como "Pasta/Servico"
+    if folder and not name.startswith(f"{folder}/"):
         return f"{base}/{folder}/{name}/{service_type}"
     return f"{base}/{name}/{service_type}"
 
 
-def _list_services(root: str) -> List[Dict[str, str]]:
-    data = _get_json(root)
-    if not data:
-        return []
-    base = root.rstrip("/")
+def _services_from(data: Dict, base: str, folder: str) -> List[Dict[str, str]]:
     items: List[Dict[str, str]] = []
     for service in data.get("services", []):
         name = service.get("name")
@@ -61,34 +72,43 @@ def _list_services(root: str) -> List[Dict[str, str]]:
             continue
         items.append(
             {
-                "folder": "",
+                "folder": folder,
                 "name": name,
                 "type": service_type,
-                "url": _build_service_url(base, "", name, service_type),
+                "url": _build_service_url(base, folder, name, service_type),
             }
         )
-    for folder in data.get("folders", []):
-        folder_data = _get_json(f"{base}/{folder}")
-        if not folder_data:
-            continue
-        for service in folder_data.get("services", []):
-            name = service.get("name")
-            service_type = service.get("type")
-            if not name or not service_type:
-                continue
-            items.append(
-                {
-                    "folder": folder,
-                    "name": name,
-                    "type": service_type,
-                    "url": _build_service_url(base, folder, name, service_type),
-                }
-            )
     return items
 
 
-def _list_layers(service_url: str) -> List[Dict[str, object]]:
-    data = _get_json(service_url)
+async def _list_services(
+    client: httpx.AsyncClient,
+    limiter: HostLimiter,
+    root: str,
+    cache: HttpMetadataCache | None = None,
+) -> List[Dict[str, str]]:
+    data = await _get_json(client, limiter, root, cache)
+    if not data:
+        return []
+    base = root.rstrip("/")
+    items = _services_from(data, base, "")
+    folders = [folder for folder in data.get("folders", []) if folder]
+    folder_data = await asyncio.gather(
+        *(_get_json(client, limiter, f"{base}/{folder}", cache) for folder in folders)
+    )
+    for folder, payload in zip(folders, folder_data):
+        if payload:
+            items.extend(_services_from(payload, base, folder))
+    return items
+
+
+async def _list_layers(
+    client: httpx.AsyncClient,
+    limiter: HostLimiter,
+    service_url: str,
+    cache: HttpMetadataCache | None = None,
+) -> List[Dict[str, object]]:
+    data = await _get_json(client, limiter, service_url, cache)
     if not data:
         return []
     service_base = service_url.rstrip("/")
@@ -113,64 +133,102 @@ def _list_layers(service_url: str) -> List[Dict[str, object]]:
     return layers
 
 
-def crawl_all_layers(roots: List[str]) -> List[Dict[str, object]]:
+def _dedupe_key(layer: Dict[str, object]) -> str:
+    fields = layer.get("fields", [])
+    field_signature = ",".join(sorted(fields)) if isinstance(fields, list) else ""
+    signature = f"{layer['name']}|{layer['geometryType']}|{field_signature}"
+    digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12]
+    return f"{str(layer['name']).lower()}|{layer['geometryType']}|{digest}"
+
+
+async def iter_all_layers(
+    roots: List[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_host: int = PER_HOST_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: HttpMetadataCache | None = None,
+) -> AsyncIterator[Tuple[Tuple[int, int, int], Dict[str, object]]]:
+    """Yield ``(position, item)`` for every layer as soon as its service metadata arrives.
+
+    Duplicates are included and arrival order varies between runs; ``position`` is the
+    (root, service, layer) index of the sequential crawl, so :func:`dedupe_layers` can rebuild
+    the deterministic list once the stream ends.
+    """
+    limiter = HostLimiter(concurrency, per_host)
+    if client is None:
+        client = async_client("metadata")
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def crawl_service(root: str, root_idx: int, service_idx: int, service: Dict) -> None:
+        layers = await _list_layers(client, limiter, service["url"], cache)
+        for layer_idx, layer in enumerate(layers):
+            item = {
+                "root": root,
+                "service": service,
+                "layer": layer,
+                "dedupe_key": _dedupe_key(layer),
+            }
+            await queue.put(((root_idx, service_idx, layer_idx), item))
+
+    async def crawl_root(root_idx: int, root: str) -> None:
+        services = await _list_services(client, limiter, root, cache)
+        await asyncio.gather(
+            *(
+                crawl_service(root, root_idx, service_idx, service)
+                for service_idx, service in enumerate(services)
+            )
+        )
+
+    async def produce() -> None:
+        try:
+            await asyncio.gather(*(crawl_root(idx, root) for idx, root in enumerate(roots)))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                break
+            yield entry
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+
+def dedupe_layers(
+    entries: List[Tuple[Tuple[int, int, int], Dict[str, object]]],
+) -> List[Dict[str, object]]:
+    """Layers in sequential crawl order, keeping the first occurrence of each dedupe key."""
     found: List[Dict[str, object]] = []
     seen: set[str] = set()
-    for root in roots:
-        for service in _list_services(root):
-            for layer in _list_layers(service["url"]):
-                fields = layer.get("fields", [])
-                field_signature = ",".join(sorted(fields)) if isinstance(fields, list) else ""
-                signature = f"{layer['name']}|{layer['geometryType']}|{field_signature}"
-                digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()[:12]
-                key = f"{layer['name'].lower()}|{layer['geometryType']}|{digest}"
-                if key in seen:
-                    continue
-                seen.add(key)
-                found.append(
-                    {
-                        "root": root,
-                        "service": service,
-                        "layer": layer,
-                        "dedupe_key": key,
-                    }
-                )
+    # ordena na ordem do crawl sequencial para que a primeira ocorrencia vença, como antes
+    for _, item in sorted(entries, key=lambda entry: entry[0]):
+        key = item["dedupe_key"]
+        if key in seen:
+            continue
+        seen.add(key)
+        found.append(item)
     return found
 
 
-def fetch_geojson_paged(query_url: str) -> Dict | None:
-    features: List[Dict] = []
-    offset = 0
-    tries = 0
+async def crawl_all_layers_async(
+    roots: List[str],
+    concurrency: int = DEFAULT_CONCURRENCY,
+    per_host: int = PER_HOST_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+    cache: HttpMetadataCache | None = None,
+) -> List[Dict[str, object]]:
+    raw = [entry async for entry in iter_all_layers(roots, concurrency, per_host, client, cache)]
+    return dedupe_layers(raw)
 
-    base_params = {
-        "where": "1=1",
-        "outFields": "*",
-        "returnGeometry": "true",
-        "outSR": "4326",
-        "f": "geojson",
-    }
 
-    while True:
-        params = base_params | {"resultOffset": offset, "resultRecordCount": PAGE_SIZE}
-        try:
-            response = requests.get(query_url, params=params, timeout=PAGED_TIMEOUT_SECONDS)
-            response.raise_for_status()
-            geojson = response.json()
-        except (requests.RequestException, ValueError):
-            break
-        batch = geojson.get("features", [])
-        if not isinstance(batch, list):
-            break
-        features.extend(batch)
-        if len(batch) < PAGE_SIZE:
-            break
-        offset += PAGE_SIZE
-        tries += 1
-        if tries >= MAX_PAGES:
-            break
-        time.sleep(0.2)
-
-    if not features:
-        return None
-    return {"type": "FeatureCollection", "features": features}
+def crawl_all_layers(roots: List[str]) -> List[Dict[str, object]]:
+    return run(crawl_all_layers_async(roots))
+
+
+def fetch_geojson_paged(query_url: str, profile: str | None = None) -> Dict | None:
+    return run(fetch_geojson_paged_async(query_url, profile=profile))
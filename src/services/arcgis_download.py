@@ -0,0 +1,543 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from services.arcgis_pbf import decode_features, supports_pbf
+from services.arcgis_tuning import HostTuner, is_overload, tuner_for
+from services.download_profiles import geojson_params, profile_params
+from services.http_cache import HttpMetadataCache
+from services.spatial_filter import SPATIAL_PARAMS, BoundaryFilter
+from services.transport import async_client
+from utils.spool import LayerSpool
+
+PAGE_SIZE = 2000
+MAX_PAGES = 1000
+DEFAULT_MAX_IN_FLIGHT = 4
+# acima disso offsets profundos ficam lentos/inconsistentes; preferimos faixas de OBJECTID
+OID_PAGING_THRESHOLD = 50_000
+# cada nivel reparte o bloco que estourou; 6 niveis levam 2000 registros a ~30 por pedido
+MAX_SPLIT_DEPTH = 6
+
+BASE_QUERY_PARAMS: Dict[str, Any] = {
+    "where": "1=1",
+    "outFields": "*",
+    "returnGeometry": "true",
+    "outSR": "4326",
+    "f": "geojson",
+}
+
+
+def layer_url_from_query(query_url: str) -> str:
+    base = query_url.split("?", 1)[0].rstrip("/")
+    return base[: -len("/query")] if base.endswith("/query") else base
+
+
+async def _get_json(client: httpx.AsyncClient, url: str, params: Dict[str, Any]) -> Dict:
+    response = await client.get(url, params=params)
+    response.raise_for_status()
+    payload = response.json()
+    if not isinstance(payload, dict):
+        raise ValueError(f"resposta inesperada de {url}")
+    if "error" in payload:
+        raise ValueError(f"ArcGIS error: {payload['error']}")
+    return payload
+
+
+async def fetch_layer_info(
+    client: httpx.AsyncClient, layer_url: str, cache: HttpMetadataCache | None = None
+) -> Dict:
+    try:
+        if cache is not None:
+            info = await cache.get_json(client, layer_url, {"f": "pjson"})
+            return info if isinstance(info, dict) and "error" not in info else {}
+        return await _get_json(client, layer_url, {"f": "pjson"})
+    except (httpx.HTTPError, ValueError):
+        return {}
+
+
+async def fetch_count(
+    client: httpx.AsyncClient, query_url: str, params: Dict[str, Any]
+) -> int | None:
+    query = params | {"returnCountOnly": "true", "f": "json"}
+    try:
+        payload = await _get_json(client, query_url, query)
+    except (httpx.HTTPError, ValueError):
+        return None
+    count = payload.get("count")
+    return count if isinstance(count, int) else None
+
+
+async def fetch_object_ids(
+    client: httpx.AsyncClient, query_url: str, params: Dict[str, Any]
+) -> Tuple[str | None, List[int]] | None:
+    query = {"where": params.get("where", "1=1"), "returnIdsOnly": "true", "f": "json"}
+    query.update((key, params[key]) for key in SPATIAL_PARAMS if key in params)
+    try:
+        payload = await _get_json(client, query_url, query)
+    except (httpx.HTTPError, ValueError):
+        return None
+    ids = payload.get("objectIds")
+    if not isinstance(ids, list):
+        return None
+    return payload.get("objectIdFieldName"), sorted(i for i in ids if isinstance(i, int))
+
+
+# camadas que anunciaram pbf mas nao entregaram; o resto da execucao vai de geojson
+_pbf_rejected: set[str] = set()
+
+
+def _rejects_format(exc: Exception) -> bool:
+    if isinstance(exc, ValueError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return 400 <= status < 500 and status != 429
+    return False
+
+
+async def fetch_pbf_features(
+    client: httpx.AsyncClient, query_url: str, query: Dict[str, Any]
+) -> List[Dict]:
+    response = await client.get(query_url, params=query)
+    response.raise_for_status()
+    if "json" in response.headers.get("content-type", "") or response.content[:1] == b"{":
+        # erro do ArcGIS (ou servidor ignorando f=pbf) vem em JSON
+        payload = response.json()
+        raise ValueError(f"ArcGIS error: {payload.get('error', 'resposta json')}")
+    return decode_features(response.content)
+
+
+async def _fetch_chunk(
+    client: httpx.AsyncClient, query_url: str, params: Dict[str, Any]
+) -> List[Dict]:
+    query = _request_params(params)
+    if query.get("f") == "pbf":
+        layer = layer_url_from_query(query_url)
+        if layer not in _pbf_rejected:
+            try:
+                return await fetch_pbf_features(client, query_url, query)
+            except (httpx.HTTPStatusError, ValueError) as exc:
+                if not _rejects_format(exc):
+                    raise
+                if layer not in _pbf_rejected:
+                    _pbf_rejected.add(layer)
+                    print(f"[warn] {layer}: pbf indisponivel ({exc}); usando geojson")
+        query = geojson_params(query)
+    payload = await _get_json(client, query_url, query)
+    batch = payload.get("features", [])
+    if not isinstance(batch, list):
+        raise ValueError("pagina sem 'features'")
+    return batch
+
+
+def _request_params(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    # chaves com "_" descrevem o bloco para o planejador e nao vao para o servidor
+    return {key: value for key, value in chunk.items() if not key.startswith("_")}
+
+
+def split_chunk(chunk: Dict[str, Any], size: int) -> List[Dict[str, Any]]:
+    """Split a chunk that overloaded the server into smaller ones covering the same features."""
+    if "_oid" in chunk:
+        field, lo, hi, prefix = chunk["_oid"]
+        if hi <= lo:
+            return [chunk]
+        # sem a lista de ids, reparte a faixa numerica em partes de ~size ids cada
+        parts = max(2, -(-int(chunk.get("_size") or 0) // max(size, 1)))
+        step = max(1, -(-(hi - lo + 1) // parts))
+        return [
+            chunk
+            | {
+                "where": f"{prefix}{field} >= {a} AND {field} <= {min(a + step - 1, hi)}",
+                "_oid": [field, a, min(a + step - 1, hi), prefix],
+                "_size": -(-int(chunk.get("_size") or 0) // parts),
+                # sem os ids a contagem de cada parte e so estimada
+                "_approx": True,
+            }
+            for a in range(lo, hi + 1, step)
+        ]
+    if "resultOffset" in chunk:
+        offset, count = int(chunk["resultOffset"]), int(chunk["resultRecordCount"])
+        step = size if size < count else count // 2
+        if step < 1:
+            return [chunk]
+        expected = chunk.get("_size")
+        return [
+            chunk
+            | {"resultOffset": offset + start, "resultRecordCount": min(step, count - start)}
+            | ({"_size": max(0, min(step, expected - start))} if expected is not None else {})
+            for start in range(0, count, step)
+        ]
+    return [chunk]
+
+
+def _oid_of(feature: Dict, field: str) -> int | None:
+    value = (feature.get("properties") or {}).get(field, feature.get("id"))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _expected(chunk: Dict[str, Any]) -> int | None:
+    return None if chunk.get("_approx") else chunk.get("_size")
+
+
+def remainder_chunk(chunk: Dict[str, Any], batch: List[Dict]) -> Dict[str, Any] | None:
+    """Chunk covering what a short answer to ``chunk`` left out, or ``None`` if it was complete.
+
+    A server whose real limit is below the advertised ``maxRecordCount`` answers a full window
+    with its first N features. Offset windows continue after the features received; object-id
+    ranges (requested ordered by id) continue after the highest id received.
+    """
+    expected = _expected(chunk)
+    if expected is None or not batch or len(batch) >= expected:
+        return None
+    rest = expected - len(batch)
+    if "_oid" in chunk:
+        field, lo, hi, prefix = chunk["_oid"]
+        ids = [_oid_of(feature, field) for feature in batch]
+        if None in ids or max(ids) >= hi:
+            return None
+        start = max(ids) + 1
+        return chunk | {
+            "where": f"{prefix}{field} >= {start} AND {field} <= {hi}",
+            "_oid": [field, start, hi, prefix],
+            "_size": rest,
+        }
+    if "resultOffset" in chunk:
+        return chunk | {
+            "resultOffset": int(chunk["resultOffset"]) + len(batch),
+            "resultRecordCount": int(chunk["resultRecordCount"]) - len(batch),
+            "_size": rest,
+        }
+    return None
+
+
+async def _fetch_adaptive(
+    client: httpx.AsyncClient,
+    query_url: str,
+    chunk: Dict[str, Any],
+    tuner: HostTuner,
+    max_size: int,
+    depth: int = 0,
+) -> List[Dict]:
+    await tuner.bucket.acquire()
+    started = time.monotonic()
+    size = int(chunk.get("resultRecordCount") or chunk.get("_size") or max_size)
+    try:
+        batch = await _fetch_chunk(client, query_url, chunk)
+    except (httpx.TimeoutException, httpx.HTTPStatusError) as exc:
+        if not is_overload(exc) or depth >= MAX_SPLIT_DEPTH:
+            raise
+        parts = split_chunk(chunk, tuner.on_overload(size, type(exc).__name__))
+        if len(parts) <= 1:
+            raise
+        features: List[Dict] = []
+        for part in parts:
+            features.extend(
+                await _fetch_adaptive(client, query_url, part, tuner, max_size, depth + 1)
+            )
+        return features
+    tuner.on_success(time.monotonic() - started, size, max_size)
+    rest = remainder_chunk(chunk, batch)
+    if rest is not None:
+        # teto real abaixo do maxRecordCount: pede o que faltou em vez de perder feicoes
+        batch = batch + await _fetch_adaptive(client, query_url, rest, tuner, max_size, depth)
+    elif len(batch) < (_expected(chunk) or 0):
+        missing = _expected(chunk) - len(batch)
+        print(f"[warn] {query_url}: {missing} feicoes esperadas nao vieram (camada mudou?)")
+    return batch
+
+
+def page_size_for(info: Dict) -> int:
+    advertised = info.get("maxRecordCount")
+    if isinstance(advertised, int) and advertised > 0:
+        return advertised
+    return PAGE_SIZE
+
+
+def object_id_field(info: Dict) -> str | None:
+    if info.get("objectIdField"):
+        return info["objectIdField"]
+    for field in info.get("fields") or []:
+        if field.get("type") == "esriFieldTypeOID" and field.get("name"):
+            return field["name"]
+    return None
+
+
+def supports_pagination(info: Dict) -> bool:
+    return bool((info.get("advancedQueryCapabilities") or {}).get("supportsPagination"))
+
+
+def choose_strategy(info: Dict, count: int | None) -> str:
+    """Pick how to page a layer: ``offset``, ``oid`` (object-id ranges) or ``sequential``."""
+    has_oid = object_id_field(info) is not None
+    paginates = supports_pagination(info)
+    if has_oid and (not paginates or count is None or count > OID_PAGING_THRESHOLD):
+        return "oid"
+    if count is not None and (paginates or not info):
+        return "offset"
+    return "sequential"
+
+
+def offset_chunks(
+    params: Dict[str, Any], count: int, size: int, order_by: str | None
+) -> List[Dict[str, Any]]:
+    base = params | {"orderByFields": order_by} if order_by else params
+    # _size: quantas feicoes a janela deve trazer, para detectar paginas cortadas pelo servidor
+    return [
+        base
+        | {"resultOffset": offset, "resultRecordCount": size, "_size": min(size, count - offset)}
+        for offset in range(0, count, size)
+    ]
+
+
+def oid_ranges(ids: List[int], size: int) -> List[Tuple[int, int, int]]:
+    return [
+        (ids[i], ids[min(i + size, len(ids)) - 1], min(size, len(ids) - i))
+        for i in range(0, len(ids), size)
+    ]
+
+
+def oid_chunks(
+    params: Dict[str, Any], oid_field: str, ids: List[int], size: int
+) -> List[Dict[str, Any]]:
+    # faixas contiguas de ids ordenados particionam a camada: cada feicao cai em uma so faixa
+    where = params.get("where") or "1=1"
+    prefix = "" if where.strip() == "1=1" else f"({where}) AND "
+    return [
+        params
+        | {
+            "where": f"{prefix}{oid_field} >= {lo} AND {oid_field} <= {hi}",
+            "orderByFields": oid_field,
+            "_oid": [oid_field, lo, hi, prefix],
+            "_size": count,
+        }
+        for lo, hi, count in oid_ranges(ids, size)
+    ]
+
+
+async def _fetch_sequential(
+    client: httpx.AsyncClient,
+    query_url: str,
+    params: Dict[str, Any],
+    size: int,
+    spool: LayerSpool,
+    manifest: Dict[str, Any],
+    tuner: HostTuner,
+    boundary: BoundaryFilter | None = None,
+) -> bool:
+    # sem contagem previa: pagina ate a primeira pagina incompleta, como o loop original
+    done = spool.completed()
+    for page in range(MAX_PAGES):
+        if page in done:
+            continue
+        chunk = params | {"resultOffset": page * size, "resultRecordCount": size}
+        try:
+            batch = await _fetch_adaptive(client, query_url, chunk, tuner, size)
+        except (httpx.HTTPError, ValueError) as exc:
+            print(f"[warn] pagina {page} de {query_url} falhou: {exc}")
+            return False
+        spool.write_chunk(page, boundary.clip(batch) if boundary else batch)
+        if len(batch) < size:
+            spool.save_manifest(manifest | {"total_chunks": page + 1})
+            return True
+    print(
+        f"[warn] {query_url}: parou em {MAX_PAGES} paginas de {size}; camada pode estar incompleta"
+    )
+    spool.save_manifest(manifest | {"total_chunks": MAX_PAGES})
+    return True
+
+
+async def _fetch_chunks(
+    client: httpx.AsyncClient,
+    query_url: str,
+    chunks: List[Dict[str, Any]],
+    max_in_flight: int,
+    spool: LayerSpool,
+    tuner: HostTuner,
+    max_size: int,
+    boundary: BoundaryFilter | None = None,
+) -> bool:
+    window = asyncio.Semaphore(max(1, max_in_flight))
+    pending = [index for index in range(len(chunks)) if not spool.has_chunk(index)]
+
+    async def fetch(index: int) -> bool:
+        async with window:
+            try:
+                batch = await _fetch_adaptive(client, query_url, chunks[index], tuner, max_size)
+            except (httpx.HTTPError, ValueError) as exc:
+                print(f"[warn] bloco {index} de {query_url} falhou: {exc}")
+                return False
+        spool.write_chunk(index, boundary.clip(batch) if boundary else batch)
+        return True
+
+    results = await asyncio.gather(*(fetch(index) for index in pending))
+    return all(results)
+
+
+async def _plan_chunks(
+    client: httpx.AsyncClient,
+    query_url: str,
+    query: Dict[str, Any],
+    tuner: HostTuner,
+    cache: HttpMetadataCache | None = None,
+    profile: str | None = None,
+) -> Dict[str, Any]:
+    info, count = await asyncio.gather(
+        fetch_layer_info(client, layer_url_from_query(query_url), cache),
+        fetch_count(client, query_url, query),
+    )
+    if query.get("f") == "geojson" and supports_pbf(info):
+        # geometria quantizada em protobuf: payload e parse bem menores que geojson
+        query = query | {"f": "pbf"}
+    query = query | profile_params(profile, info, query.get("f"))
+    advertised = page_size_for(info)
+    size = tuner.initial_page_size(advertised)
+    plan: Dict[str, Any] = {
+        "page_size": size,
+        "max_page_size": advertised,
+        "format": query.get("f"),
+        "params": query,
+        "chunks": [],
+    }
+    strategy = choose_strategy(info, count)
+    if strategy == "oid":
+        result = await fetch_object_ids(client, query_url, query)
+        if result is not None:
+            oid_field = result[0] or object_id_field(info)
+            return plan | {
+                "strategy": strategy,
+                "chunks": oid_chunks(query, oid_field, result[1], size),
+            }
+        strategy = "offset" if count is not None else "sequential"
+    if strategy == "offset":
+        return plan | {
+            "strategy": strategy,
+            "chunks": offset_chunks(query, count, size, object_id_field(info)),
+        }
+    return plan | {"strategy": strategy}
+
+
+async def download_layer(
+    query_url: str,
+    dest: Path,
+    params: Dict[str, Any] | None = None,
+    client: httpx.AsyncClient | None = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    spool_root: Path | None = None,
+    kmz_path: Path | None = None,
+    cache: HttpMetadataCache | None = None,
+    keep_empty: bool = False,
+    profile: str | None = None,
+    boundary: BoundaryFilter | None = None,
+) -> Dict[str, Any] | None:
+    """Download every feature of a layer straight to ``dest``, one page in memory at a time.
+
+    Offset or object-id windows are fetched concurrently and each finished chunk is written as
+    GeoJSONSeq to a per-layer spool (``spool_root``, default ``dest.parent/.spool``). A rerun
+    resumes from the chunks already on disk; ``dest`` is only written once every chunk is
+    present. ``profile`` (see :mod:`services.download_profiles`) trims fields and geometry on
+    the server. ``boundary`` restricts the query to the boundary's envelope and drops features
+    outside the boundary itself before they are spooled. Returns feature/byte counts, or
+    ``None`` if the download is incomplete (or the layer is empty, unless ``keep_empty``).
+    """
+    query = BASE_QUERY_PARAMS | (params or {})
+    if boundary is not None:
+        query = query | boundary.query_params()
+    if client is None:
+        client = async_client("download")
+    identity = {"url": query_url, "params": query}
+    if profile:
+        identity["profile"] = profile
+    spool = LayerSpool(spool_root or dest.parent / ".spool", identity)
+    tuner = tuner_for(query_url)
+    try:
+        manifest = spool.load_manifest()
+        if manifest is None:
+            spool.reset()
+            manifest = await _plan_chunks(client, query_url, query, tuner, cache, profile)
+            if manifest["strategy"] != "sequential":
+                manifest["total_chunks"] = len(manifest["chunks"])
+            spool.save_manifest(manifest)
+        elif spool.completed():
+            print(f"[info] retomando {query_url}: {len(spool.completed())} blocos ja baixados")
+
+        max_size = manifest.get("max_page_size") or manifest["page_size"]
+        if manifest["strategy"] == "sequential":
+            if "total_chunks" not in manifest:
+                await _fetch_sequential(
+                    client,
+                    query_url,
+                    manifest.get("params") or query,
+                    manifest["page_size"],
+                    spool,
+                    manifest,
+                    tuner,
+                    boundary,
+                )
+                manifest = spool.load_manifest() or manifest
+        else:
+            await _fetch_chunks(
+                client,
+                query_url,
+                manifest["chunks"],
+                max_in_flight,
+                spool,
+                tuner,
+                max_size,
+                boundary,
+            )
+    finally:
+        tuner.save()
+
+    total = manifest.get("total_chunks")
+    done = spool.completed()
+    if total is None or not set(range(total)) <= done:
+        print(
+            f"[warn] download incompleto de {query_url} ({len(done)}/{total or '?'} blocos);"
+            " rode novamente para retomar"
+        )
+        return None
+    stats = await asyncio.to_thread(spool.finalize, total, dest, kmz_path)
+    spool.discard()
+    if not stats["features"] and not keep_empty:
+        dest.unlink(missing_ok=True)
+        if kmz_path is not None:
+            kmz_path.unlink(missing_ok=True)
+        return None
+    return stats
+
+
+async def fetch_geojson_paged_async(
+    query_url: str,
+    params: Dict[str, Any] | None = None,
+    client: httpx.AsyncClient | None = None,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    spool_root: Path | None = None,
+    profile: str | None = None,
+    boundary: BoundaryFilter | None = None,
+) -> Dict | None:
+    """In-memory variant of :func:`download_layer`, for callers that need the dict."""
+    with tempfile.TemporaryDirectory(prefix="flows_layer_") as scratch:
+        dest = Path(scratch) / "layer.geojson"
+        stats = await download_layer(
+            query_url,
+            dest,
+            params=params,
+            client=client,
+            max_in_flight=max_in_flight,
+            spool_root=spool_root or Path(scratch) / ".spool",
+            profile=profile,
+            boundary=boundary,
+        )
+        if stats is None:
+            return None
+        return json.loads(dest.read_text(encoding="utf-8"))
@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from utils.protobuf import (
+    FIXED32,
+    FIXED64,
+    LENGTH_DELIMITED,
+    VARINT,
+    as_double,
+    as_float,
+    encode_varint,
+    iter_fields,
+    packed_varints,
+    read_varint,
+    signed,
+    varint_array,
+    zigzag,
+    zigzag_array,
+)
+
+# esriPBuffer.FeatureCollectionPBuffer (FeatureCollection.proto da Esri)
+POINT, MULTIPOINT, POLYLINE, POLYGON = 0, 1, 2, 3
+UPPER_LEFT = 0
+
+_VALUE_DECODERS = {
+    1: lambda raw: bytes(raw).decode("utf-8"),  # string
+    2: as_float,
+    3: as_double,
+    4: zigzag,  # sint32
+    5: lambda value: value,  # uint32
+    6: signed,  # int64
+    7: lambda value: value,  # uint64
+    8: zigzag,  # sint64
+    9: bool,
+}
+
+
+def supports_pbf(info: Dict) -> bool:
+    formats = str(info.get("supportedQueryFormats") or "").lower()
+    quantization = (info.get("advancedQueryCapabilities") or {}).get(
+        "supportsCoordinatesQuantization"
+    )
+    return "pbf" in formats or bool(quantization)
+
+
+def _repeated_ints(wire: int, value: int | bytes) -> List[int]:
+    return [value] if wire == VARINT else packed_varints(value)
+
+
+def _decode_value(buf: bytes) -> Any:
+    # Value e um oneof: um unico campo, lido direto sem passar pelo iter_fields
+    if not buf:
+        return None
+    key, pos = read_varint(buf, 0)
+    wire = key & 0x07
+    if wire == VARINT:
+        value, _pos = read_varint(buf, pos)
+    elif wire == LENGTH_DELIMITED:
+        size, pos = read_varint(buf, pos)
+        value = buf[pos : pos + size]
+    elif wire == FIXED64:
+        value = buf[pos : pos + 8]
+    else:
+        value = buf[pos : pos + 4]
+    decoder = _VALUE_DECODERS.get(key >> 3)
+    return decoder(value) if decoder is not None else None
+
+
+def _decode_transform(buf: bytes) -> Tuple[int, List[float], List[float]]:
+    origin = UPPER_LEFT
+    scale = [1.0, 1.0]
+    translate = [0.0, 0.0]
+    for number, _wire, value in iter_fields(buf):
+        if number == 1:
+            origin = value
+        elif number in (2, 3):
+            target = scale if number == 2 else translate
+            for axis, _w, raw in iter_fields(value):
+                if axis in (1, 2):
+                    target[axis - 1] = as_double(raw)
+    return origin, scale, translate
+
+
+def _split_geometry(buf: bytes) -> Tuple[List[int], bytes]:
+    lengths: List[int] = []
+    coords = b""
+    for number, wire, value in iter_fields(buf):
+        if number == 2:
+            lengths.extend(_repeated_ints(wire, value))
+        elif number == 3:
+            # coords nao empacotados (raro) viram um bloco empacotado equivalente
+            coords += value if wire == LENGTH_DELIMITED else encode_varint(value)
+    return lengths, coords
+
+
+def dequantize(
+    blobs: List[bytes], dims: int, transform: Tuple[int, List[float], List[float]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Delta-decode and de-quantize the packed ``coords`` of many geometries in one pass.
+
+    Returns the ``(n, 2)`` vertex array and the vertex offset where each geometry starts.
+    """
+    origin, scale, translate = transform
+    if not blobs:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64)
+    sizes = np.fromiter((len(blob) for blob in blobs), dtype=np.int64, count=len(blobs))
+    values, ends = varint_array(b"".join(blobs))
+    bounds = np.searchsorted(ends, np.cumsum(sizes) - 1, side="right") // dims
+    starts = np.concatenate(([0], bounds[:-1]))
+    grid = zigzag_array(values).reshape(-1, dims)[:, :2]
+    # deltas acumulam ao longo da geometria inteira (atravessando partes) e zeram na proxima
+    grid = np.cumsum(grid, axis=0)
+    base = np.zeros((len(starts), 2), dtype=np.int64)
+    nonzero = starts > 0
+    base[nonzero] = grid[starts[nonzero] - 1]
+    grid -= np.repeat(base, bounds - starts, axis=0)
+    points = np.empty(grid.shape, dtype=np.float64)
+    points[:, 0] = translate[0] + grid[:, 0] * scale[0]
+    if origin == UPPER_LEFT:
+        points[:, 1] = translate[1] - grid[:, 1] * scale[1]
+    else:
+        points[:, 1] = translate[1] + grid[:, 1] * scale[1]
+    # uma casa alem da resolucao da grade: tira o ruido de ponto flutuante da saida
+    decimals = max(0, int(np.ceil(-np.log10(min(scale))))) + 1 if min(scale) > 0 else 9
+    return np.round(points, decimals), starts
+
+
+def ring_areas(points: np.ndarray, ring_starts: np.ndarray, ring_sizes: np.ndarray) -> np.ndarray:
+    """Signed (shoelace) area of each ring; positive means counter-clockwise."""
+    if not len(ring_starts):
+        return np.empty(0)
+    xs, ys = points[:, 0], points[:, 1]
+    cross = np.zeros(len(points))
+    cross[:-1] = xs[:-1] * ys[1:] - xs[1:] * ys[:-1]
+    # o ultimo vertice de cada anel nao se liga ao primeiro do anel seguinte
+    cross[ring_starts + ring_sizes - 1] = 0.0
+    return 0.5 * np.add.reduceat(cross, ring_starts)
+
+
+def _ring_contains(ring: List[List[float]], point: List[float]) -> bool:
+    x, y = point
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        if (y0 > y) != (y1 > y) and x < (x1 - x0) * (y - y0) / (y1 - y0) + x0:
+            inside = not inside
+    return inside
+
+
+def _polygon(rings: List[List[List[float]]], areas: List[float]) -> Dict | None:
+    # Esri: aneis externos horarios, buracos anti-horarios; GeoJSON (RFC 7946) e o contrario
+    polygons: List[List[List[List[float]]]] = []
+    holes = []
+    # os aneis chegam aqui ja invertidos (ver _geometries); area e a do sentido original
+    for ring, area in zip(rings, areas):
+        if len(ring) < 4:
+            continue
+        if area <= 0:
+            polygons.append([ring])
+        else:
+            holes.append(ring)
+    for hole in holes:
+        owner = next((p for p in polygons if _ring_contains(p[0], hole[0])), None)
+        if owner is None:
+            polygons.append([hole[::-1]])
+        else:
+            owner.append(hole)
+    if not polygons:
+        return None
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def to_geojson_geometry(
+    geometry_type: int, parts: List[List[List[float]]], areas: List[float]
+) -> Dict | None:
+    if not parts or not parts[0]:
+        return None
+    if geometry_type == POINT:
+        return {"type": "Point", "coordinates": parts[0][0]}
+    if geometry_type == MULTIPOINT:
+        return {"type": "MultiPoint", "coordinates": [p for part in parts for p in part]}
+    if geometry_type == POLYLINE:
+        if len(parts) == 1:
+            return {"type": "LineString", "coordinates": parts[0]}
+        return {"type": "MultiLineString", "coordinates": parts}
+    if geometry_type == POLYGON:
+        return _polygon(parts, areas)
+    return None
+
+
+def _decode_attributes(buf: bytes) -> Tuple[List[Any], bytes | None]:
+    values: List[Any] = []
+    geometry = None
+    for number, wire, value in iter_fields(buf):
+        if number == 1:
+            values.append(_decode_value(value))
+        elif number == 2 and wire == LENGTH_DELIMITED:
+            geometry = value
+    return values, geometry
+
+
+def _geometries(
+    raw_geometries: List[bytes | None],
+    geometry_type: int,
+    dims: int,
+    transform: Tuple[int, List[float], List[float]],
+) -> List[Dict | None]:
+    split = [_split_geometry(raw) if raw is not None else ([], b"") for raw in raw_geometries]
+    points, starts = dequantize([coords for _lengths, coords in split], dims, transform)
+    bounds = starts.tolist()[1:] + [len(points)]
+
+    # fatia cada geometria nas partes anunciadas em "lengths"
+    part_starts: List[int] = []
+    part_sizes: List[int] = []
+    owners: List[int] = []
+    for index, ((lengths, _coords), start, end) in enumerate(zip(split, starts.tolist(), bounds)):
+        offset = start
+        for length in lengths or ([end - start] if end > start else []):
+            length = min(length, end - offset)
+            if length <= 0:
+                break
+            part_starts.append(offset)
+            part_sizes.append(length)
+            owners.append(index)
+            offset += length
+
+    areas = [0.0] * len(part_starts)
+    if geometry_type == POLYGON and part_starts:
+        ring_starts, ring_sizes = np.asarray(part_starts), np.asarray(part_sizes)
+        areas = ring_areas(points, ring_starts, ring_sizes).tolist()
+        # GeoJSON usa o sentido oposto ao da Esri: inverte todos os aneis de uma vez
+        first = np.repeat(ring_starts, ring_sizes)
+        size = np.repeat(ring_sizes, ring_sizes)
+        inside = (
+            first
+            + np.arange(len(first))
+            - np.repeat(np.cumsum(ring_sizes) - ring_sizes, ring_sizes)
+        )
+        order = np.arange(len(points))
+        order[inside] = 2 * first + size - 1 - inside
+        points = points[order]
+    vertices = points.tolist()
+
+    parts: List[List[List[List[float]]]] = [[] for _ in split]
+    part_areas: List[List[float]] = [[] for _ in split]
+    for owner, start, size, area in zip(owners, part_starts, part_sizes, areas):
+        parts[owner].append(vertices[start : start + size])
+        part_areas[owner].append(area)
+    return [
+        to_geojson_geometry(geometry_type, rings, ring_area)
+        for rings, ring_area in zip(parts, part_areas)
+    ]
+
+
+def _decode_feature_result(buf: bytes) -> List[Dict]:
+    names: List[str] = []
+    raw_features: List[bytes] = []
+    oid_field = None
+    geometry_type = POINT
+    has_z = has_m = False
+    transform: Tuple[int, List[float], List[float]] = (UPPER_LEFT, [1.0, 1.0], [0.0, 0.0])
+    for number, _wire, value in iter_fields(buf):
+        if number == 1:
+            oid_field = bytes(value).decode("utf-8")
+        elif number == 7:
+            geometry_type = value
+        elif number == 10:
+            has_z = bool(value)
+        elif number == 11:
+            has_m = bool(value)
+        elif number == 12:
+            transform = _decode_transform(value)
+        elif number == 13:
+            name = next((v for n, _w, v in iter_fields(value) if n == 1), b"")
+            names.append(bytes(name).decode("utf-8"))
+        elif number == 15:
+            raw_features.append(value)
+
+    decoded = [_decode_attributes(raw) for raw in raw_features]
+    geometries = _geometries(
+        [geometry for _values, geometry in decoded], geometry_type, 2 + has_z + has_m, transform
+    )
+    features = []
+    for (values, _geometry), geometry in zip(decoded, geometries):
+        properties = dict(zip(names, values))
+        feature: Dict[str, Any] = {"type": "Feature", "properties": properties}
+        if oid_field and properties.get(oid_field) is not None:
+            feature["id"] = properties[oid_field]
+        feature["geometry"] = geometry
+        features.append(feature)
+    return features
+
+
+def decode_features(payload: bytes) -> List[Dict]:
+    """Decode an ``f=pbf`` query response into GeoJSON features (coordinates de-quantized).
+
+    Raises ``ValueError`` when the payload is not a feature result (e.g. a JSON error page).
+    """
+    for number, wire, value in iter_fields(payload):
+        if number == 2 and wire == LENGTH_DELIMITED:
+            for kind, _w, result in iter_fields(value):
+                if kind == 1:
+                    return _decode_feature_result(result)
+            raise ValueError("resposta pbf sem featureResult")
+        if wire in (FIXED32, FIXED64) or number not in (1, 2):
+            break
+    raise ValueError("resposta nao e um FeatureCollectionPBuffer")
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import httpx
+
+from services.transport import async_client
+from utils.cache import DiskCache, is_fresh
+
+DNS_TIMEOUT = 3.0
+# host que nao existe ou nao e ArcGIS dificilmente muda; falha de rede e revista antes
+DEAD_TTL_SECONDS = float(os.getenv("FLOWS_PROBE_TTL", 7 * 86400))
+TRANSIENT_TTL_SECONDS = 3600.0
+# motivos de descarte que valem DEAD_TTL_SECONDS (o resto vale TRANSIENT_TTL_SECONDS)
+PERMANENT_REASONS = frozenset({"dns", "http_404", "not_arcgis"})
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    root: str
+    alive: bool
+    reason: str = "ok"
+    cached: bool = False
+
+
+def _looks_like_arcgis(data: object) -> bool:
+    # catalogo REST: {"currentVersion": ..., "folders": [...], "services": [...]}
+    return isinstance(data, dict) and (
+        "currentVersion" in data or "services" in data or "folders" in data
+    )
+
+
+async def _resolve(host: str, port: int) -> str | None:
+    """``None`` when ``host`` resolves, else the failure reason."""
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(loop.getaddrinfo(host, port, type=socket.SOCK_STREAM), DNS_TIMEOUT)
+    except socket.gaierror as exc:
+        # so "nome nao existe" e definitivo; EAI_AGAIN e afins sao falhas passageiras
+        return "dns" if exc.errno == socket.EAI_NONAME else "dns_error"
+    except (asyncio.TimeoutError, OSError):
+        return "dns_timeout"
+    return None
+
+
+async def _fetch_pjson(client: httpx.AsyncClient, root: str) -> str | None:
+    try:
+        response = await client.get(f"{root}?f=pjson")
+    except httpx.TimeoutException:
+        return "timeout"
+    except httpx.HTTPError:
+        return "connect"
+    if response.status_code >= 400:
+        return f"http_{response.status_code}"
+    try:
+        data = response.json()
+    except ValueError:
+        return "not_arcgis"
+    if isinstance(data, dict) and data.get("error"):
+        # token exigido/servidor sem catalogo publico
+        return f"arcgis_{(data['error'] or {}).get('code', 'error')}"
+    return None if _looks_like_arcgis(data) else "not_arcgis"
+
+
+class RootProber:
+    """Concurrent fast-fail check of candidate ArcGIS REST roots before crawling.
+
+    Every root gets a DNS lookup (once per host) and a ``?f=pjson`` request with a short
+    connect timeout, all at the same time. Roots that do not resolve, refuse, time out or do
+    not answer an ArcGIS catalog are dropped, and remembered in ``<cache>/arcgis_probe`` so the
+    next run skips them without touching the network.
+    """
+
+    def __init__(self, cache: DiskCache | None = None, client: httpx.AsyncClient | None = None):
+        self.cache = cache
+        self.client = client
+
+    def _cached(self, root: str) -> ProbeResult | None:
+        if self.cache is None:
+            return None
+        entry = self.cache.load(root)
+        if entry is None:
+            return None
+        reason = str((entry.get("value") or {}).get("reason") or "")
+        ttl = DEAD_TTL_SECONDS if reason in PERMANENT_REASONS else TRANSIENT_TTL_SECONDS
+        if not reason or not is_fresh(entry, ttl):
+            return None
+        return ProbeResult(root, False, reason, cached=True)
+
+    async def probe(self, roots: List[str]) -> List[ProbeResult]:
+        client = self.client or async_client("probe")
+        dns: Dict[str, asyncio.Task] = {}
+
+        async def check(root: str) -> ProbeResult:
+            cached = self._cached(root)
+            if cached is not None:
+                return cached
+            parts = urlsplit(root)
+            host = parts.hostname or ""
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            if host not in dns:
+                dns[host] = asyncio.ensure_future(_resolve(host, port))
+            reason = await dns[host] or await _fetch_pjson(client, root)
+            if reason is None:
+                if self.cache is not None:
+                    self.cache.delete(root)
+                return ProbeResult(root, True)
+            if self.cache is not None:
+                self.cache.set(root, {"reason": reason})
+            return ProbeResult(root, False, reason)
+
+        return list(await asyncio.gather(*(check(root) for root in roots)))
+
+
+async def probe_roots(roots: List[str], use_cache: bool = True) -> List[str]:
+    """``roots`` that answer an ArcGIS catalog, in their original order."""
+    if not roots:
+        return []
+    prober = RootProber(DiskCache("arcgis_probe") if use_cache else None)
+    results = await prober.probe(roots)
+    alive = [result.root for result in results if result.alive]
+    dropped = Counter(result.reason for result in results if not result.alive)
+    cached = sum(1 for result in results if result.cached)
+    if dropped:
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(dropped.items()))
+        print(
+            f"[info] raizes: {len(alive)} ativas, {sum(dropped.values())} descartadas "
+            f"({reasons}; {cached} do cache)"
+        )
+    return alive
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict
+
+import httpx
+
+from services.arcgis_download import (
+    BASE_QUERY_PARAMS,
+    download_layer,
+    fetch_layer_info,
+    fetch_object_ids,
+    layer_url_from_query,
+    object_id_field,
+)
+from services.http_cache import HttpMetadataCache
+from services.spatial_filter import BoundaryFilter
+from services.transport import async_client
+from utils.io import ensure_dir, iter_geojson_features, write_feature_collection, write_kmz_features
+
+SYNC_STATE_NAME = "sync_state.json"
+CLOCK_SKEW_MS = 3600 * 1000
+
+
+class SyncState:
+    """Per-output-directory record of what was synced for each layer, and when."""
+
+    def __init__(self, outdir: Path):
+        self.path = Path(outdir) / SYNC_STATE_NAME
+        try:
+            self.layers: Dict[str, Dict[str, Any]] = json.loads(
+                self.path.read_text(encoding="utf-8")
+            )
+        except (OSError, ValueError):
+            self.layers = {}
+
+    def get(self, key: str) -> Dict[str, Any]:
+        return self.layers.get(key) or {}
+
+    def update(self, key: str, **entry: Any) -> None:
+        self.layers[key] = self.get(key) | entry
+        self.save()
+
+    def save(self) -> None:
+        ensure_dir(self.path.parent)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.layers, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+def last_edit_date(info: Dict) -> int | None:
+    editing = info.get("editingInfo") or {}
+    value = editing.get("dataLastEditDate") or editing.get("lastEditDate")
+    return value if isinstance(value, int) else None
+
+
+def edit_date_field(info: Dict) -> str | None:
+    return (info.get("editFieldsInfo") or {}).get("editDateField") or None
+
+
+def _timestamp_literal(epoch_ms: int) -> str:
+    moment = datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc)
+    return f"TIMESTAMP '{moment:%Y-%m-%d %H:%M:%S}'"
+
+
+def _merge_by_oid(dest: Path, delta: Path, oid_field: str, live_ids: set[int]) -> Dict[str, int]:
+    changed: Dict[Any, Dict] = {}
+    for feature in iter_geojson_features(delta):
+        oid = (feature.get("properties") or {}).get(oid_field)
+        if oid is not None:
+            changed[oid] = feature
+    counts = {"updated": 0, "added": 0, "deleted": 0}
+
+    def merged():
+        for feature in iter_geojson_features(dest):
+            oid = (feature.get("properties") or {}).get(oid_field)
+            if oid is not None and oid not in live_ids:
+                counts["deleted"] += 1
+                continue
+            if oid in changed:
+                counts["updated"] += 1
+                yield changed.pop(oid)
+            else:
+                yield feature
+        counts["added"] = len(changed)
+        yield from changed.values()
+
+    merged_path = dest.with_name(dest.name + ".merge")
+    counts["features"] = write_feature_collection(merged(), merged_path)
+    os.replace(merged_path, dest)
+    return counts
+
+
+async def sync_layer(
+    query_url: str,
+    dest: Path,
+    state: SyncState,
+    params: Dict[str, Any] | None = None,
+    client: httpx.AsyncClient | None = None,
+    spool_root: Path | None = None,
+    kmz_path: Path | None = None,
+    cache: HttpMetadataCache | None = None,
+    profile: str | None = None,
+    boundary: BoundaryFilter | None = None,
+) -> Dict[str, Any] | None:
+    """Bring ``dest`` up to date with the layer, downloading as little as possible.
+
+    Skips layers whose ``editingInfo.lastEditDate`` did not change since the last sync. Layers
+    with an editor-tracking date field only fetch features edited since then and merge them by
+    object id (features deleted on the server are dropped using a ``returnIdsOnly`` call).
+    Anything else (including a change of download ``profile`` or ``boundary``) falls back to
+    a full :func:`download_layer`.
+    """
+    return await _sync_layer(
+        query_url,
+        dest,
+        state,
+        params,
+        client or async_client("download"),
+        spool_root,
+        kmz_path,
+        cache,
+        profile,
+        boundary,
+    )
+
+
+async def _sync_layer(
+    query_url: str,
+    dest: Path,
+    state: SyncState,
+    params: Dict[str, Any] | None,
+    client: httpx.AsyncClient,
+    spool_root: Path | None,
+    kmz_path: Path | None,
+    cache: HttpMetadataCache | None,
+    profile: str | None,
+    boundary: BoundaryFilter | None,
+) -> Dict[str, Any] | None:
+    key = query_url
+    area = list(boundary.bbox) if boundary is not None else None
+    previous = state.get(key)
+    # metadados sempre frescos aqui: o cache serviria um editingInfo antigo
+    info = await fetch_layer_info(client, layer_url_from_query(query_url))
+    edited = last_edit_date(info)
+    started = int(time.time() * 1000)
+    have_output = dest.exists() and (kmz_path is None or kmz_path.exists())
+    # saida baixada com outro perfil (campos/precisao diferentes) nao serve de base
+    have_output = have_output and previous.get("profile") == profile
+    have_output = have_output and previous.get("boundary") == area
+
+    if have_output and edited is not None and previous.get("last_edit_date") == edited:
+        print(f"[info] {dest.name}: sem edicoes desde a ultima sincronizacao")
+        state.update(key, last_sync=started)
+        return {"geojson": str(dest), "sync": "unchanged", **previous.get("stats", {})}
+
+    date_field = edit_date_field(info)
+    oid_field = object_id_field(info)
+    # sem editingInfo, usa o relogio local com folga para diferencas de fuso/relogio
+    since = previous.get("last_edit_date") or (
+        previous["last_sync"] - CLOCK_SKEW_MS if previous.get("last_sync") else None
+    )
+    if have_output and date_field and oid_field and since:
+        query = BASE_QUERY_PARAMS | (params or {})
+        if boundary is not None:
+            query = query | boundary.query_params()
+        where = query.get("where") or "1=1"
+        delta_where = f"{date_field} >= {_timestamp_literal(since)}"
+        if where.strip() != "1=1":
+            delta_where = f"({where}) AND {delta_where}"
+        delta_path = dest.with_name(dest.name + ".delta")
+        delta = await download_layer(
+            query_url,
+            delta_path,
+            params=query | {"where": delta_where},
+            client=client,
+            spool_root=spool_root,
+            cache=cache,
+            keep_empty=True,
+            profile=profile,
+            boundary=boundary,
+        )
+        ids = await fetch_object_ids(client, query_url, query) if delta is not None else None
+        if ids is None:
+            print(f"[warn] {dest.name}: consulta incremental falhou; baixando tudo")
+            delta_path.unlink(missing_ok=True)
+        else:
+            counts = _merge_by_oid(dest, delta_path, oid_field, set(ids[1]))
+            delta_path.unlink(missing_ok=True)
+            if kmz_path is not None:
+                write_kmz_features(iter_geojson_features(dest), kmz_path)
+            stats = {
+                "geojson": str(dest),
+                "features": counts["features"],
+                "bytes": dest.stat().st_size,
+            }
+            if kmz_path is not None:
+                stats["kmz"] = str(kmz_path)
+            state.update(
+                key,
+                last_sync=started,
+                last_edit_date=edited,
+                profile=profile,
+                boundary=area,
+                stats=stats,
+            )
+            print(
+                f"[ok] {dest.name}: incremental (+{counts['added']} ~{counts['updated']}"
+                f" -{counts['deleted']})"
+            )
+            return stats | {"sync": "incremental"}
+
+    stats = await download_layer(
+        query_url,
+        dest,
+        params=params,
+        client=client,
+        spool_root=spool_root,
+        kmz_path=kmz_path,
+        cache=cache,
+        profile=profile,
+        boundary=boundary,
+    )
+    if stats is None:
+        return None
+    summary = {k: v for k, v in stats.items() if k != "chunks"}
+    state.update(
+        key,
+        last_sync=started,
+        last_edit_date=edited,
+        profile=profile,
+        boundary=area,
+        stats=summary,
+    )
+    return stats | {"sync": "full"}
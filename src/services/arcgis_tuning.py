@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+import httpx
+
+from utils.cache import DiskCache
+from utils.ratelimit import TokenBucket
+
+MIN_PAGE_SIZE = 100
+GROW_FACTOR = 1.5
+# respostas abaixo disso contam como "servidor folgado": pagina e taxa podem crescer
+FAST_LATENCY_SECONDS = 2.0
+DEFAULT_RATE = 5.0
+MIN_RATE = 0.5
+MAX_RATE = 50.0
+RATE_STEP = 0.5
+MAX_DECISIONS = 50
+# varias janelas em voo falham juntas; so cortamos a taxa uma vez por intervalo
+RATE_CUT_COOLDOWN_SECONDS = 1.0
+
+_tuners: Dict[str, "HostTuner"] = {}
+
+
+def _store() -> DiskCache:
+    return DiskCache("arcgis_tuning")
+
+
+def is_overload(exc: Exception) -> bool:
+    if isinstance(exc, httpx.TimeoutException):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+
+class HostTuner:
+    """Page-size controller plus token bucket for one ArcGIS host.
+
+    The page size starts from the layer's ``maxRecordCount`` (capped by what worked last time),
+    halves on timeouts/5xx and, once capped, grows one step per run while full pages at the cap
+    stay fast (not at all in a run in which the host already pushed back). Only overload lowers
+    it. The request rate follows AIMD: it creeps up on fast responses and halves on overload.
+    The state and the latest decisions are persisted per host so the next run starts from them.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        saved = _store().get(host) or {}
+        self.page_size: int | None = saved.get("page_size")
+        self.latency = float(saved.get("latency") or 0.0)
+        self.bucket = TokenBucket(float(saved.get("rate") or DEFAULT_RATE), burst=4)
+        self.decisions: List[Dict[str, Any]] = list(saved.get("decisions") or [])
+        # decisoes desta execucao: no maximo um passo de crescimento, nenhum apos sobrecarga
+        self.overloaded = False
+        self.grown = False
+        self._last_cut = 0.0
+
+    def _record(self, action: str, **detail: Any) -> None:
+        self.decisions.append({"at": int(time.time()), "action": action, **detail})
+        del self.decisions[:-MAX_DECISIONS]
+
+    def initial_page_size(self, advertised: int) -> int:
+        if self.page_size is None:
+            return advertised
+        return max(MIN_PAGE_SIZE, min(advertised, self.page_size))
+
+    def on_success(self, latency: float, requested: int, advertised: int) -> None:
+        self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+        if latency >= FAST_LATENCY_SECONDS:
+            return
+        self.bucket.set_rate(min(MAX_RATE, self.bucket.rate + RATE_STEP))
+        # sem teto o host ja usa maxRecordCount; pedidos menores (cauda, pedacos) nao dizem nada
+        current = self.page_size
+        if current is None or requested < current or current >= advertised:
+            return
+        if not (self.overloaded or self.grown):
+            self.grown = True
+            self.page_size = min(advertised, int(current * GROW_FACTOR))
+            self._record("grow", page_size=self.page_size, latency=round(latency, 3))
+
+    def on_overload(self, size: int, reason: str) -> int:
+        self.overloaded = True
+        previous = self.page_size
+        self.page_size = max(MIN_PAGE_SIZE, min(self.page_size or size, size // 2))
+        now = time.monotonic()
+        cut = now - self._last_cut >= RATE_CUT_COOLDOWN_SECONDS
+        if cut:
+            self._last_cut = now
+            self.bucket.set_rate(max(MIN_RATE, self.bucket.rate / 2))
+        if cut or self.page_size != previous:
+            self._record(
+                "shrink", page_size=self.page_size, rate=round(self.bucket.rate, 2), reason=reason
+            )
+        return self.page_size
+
+    def save(self) -> None:
+        _store().set(
+            self.host,
+            {
+                "page_size": self.page_size,
+                "latency": round(self.latency, 3),
+                "rate": round(self.bucket.rate, 2),
+                "decisions": self.decisions,
+            },
+        )
+
+
+def tuner_for(url: str) -> HostTuner:
+    host = urlsplit(url).netloc.lower()
+    tuner = _tuners.get(host)
+    if tuner is None:
+        tuner = _tuners[host] = HostTuner(host)
+    return tuner
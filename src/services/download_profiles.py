@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+# tolerancias em graus: todas as consultas pedem outSR=4326 (1e-5 grau ~ 1 m)
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # tudo como o servidor guarda
+    "full": {"fields": "*", "precision": None, "tolerance": None},
+    # todos os atributos, geometria com ~1 cm e sem Z/M
+    "analysis": {"fields": "*", "precision": 7, "tolerance": None},
+    # so id + campo de exibicao, geometria generalizada em ~1 m para mapa
+    "display": {"fields": "display", "precision": 5, "tolerance": 1e-5},
+}
+DEFAULT_PROFILE = "full"
+# extent da quantizacao no outSR: sem ele cada servidor ancora a grade onde quiser (extent da
+# camada, do servico...) e os vertices mudam de servidor para servidor. Fixo no mundo, a grade
+# de ``tolerance`` graus e a mesma em toda camada e em toda execucao
+QUANTIZATION_EXTENT = {
+    "xmin": -180.0,
+    "ymin": -90.0,
+    "xmax": 180.0,
+    "ymax": 90.0,
+    "spatialReference": {"wkid": 4326},
+}
+
+_NAME_HINTS = ("nome", "name", "descricao", "denominacao", "titulo", "label")
+
+
+def profile_names() -> List[str]:
+    return list(PROFILES)
+
+
+def _display_fields(info: Dict) -> str:
+    fields = [field.get("name") for field in info.get("fields") or [] if field.get("name")]
+    if not fields:
+        return "*"
+    chosen = [
+        field.get("name")
+        for field in info.get("fields") or []
+        if field.get("type") == "esriFieldTypeOID"
+    ]
+    display = info.get("displayField")
+    if display in fields:
+        chosen.append(display)
+    else:
+        chosen.extend(name for name in fields if name.lower().startswith(_NAME_HINTS))
+    return ",".join(dict.fromkeys(chosen)) or "*"
+
+
+def _offset(tolerance: float) -> str:
+    return f"{tolerance:.10f}".rstrip("0")
+
+
+def profile_params(name: str | None, info: Dict, fmt: str | None = None) -> Dict[str, Any]:
+    """Query parameters that apply download profile ``name`` to a layer described by ``info``.
+
+    Unknown or empty names mean ``full`` (no changes). ``fmt`` is the ``f`` being requested:
+    pbf generalizes through ``quantizationParameters`` (``view`` mode, on the fixed
+    :data:`QUANTIZATION_EXTENT` grid) instead of ``maxAllowableOffset``.
+    """
+    profile = PROFILES.get(name or DEFAULT_PROFILE) or PROFILES[DEFAULT_PROFILE]
+    params: Dict[str, Any] = {}
+    if profile["fields"] == "display":
+        params["outFields"] = _display_fields(info)
+    if profile["precision"] is not None:
+        params["geometryPrecision"] = profile["precision"]
+        params["returnZ"] = "false"
+        params["returnM"] = "false"
+    if profile["tolerance"] is None:
+        return params
+    if fmt == "pbf":
+        # "view" quantiza e generaliza na mesma tolerancia; "edit" so quantiza
+        quantization = {
+            "mode": "view",
+            "originPosition": "upperLeft",
+            "tolerance": profile["tolerance"],
+            "extent": QUANTIZATION_EXTENT,
+        }
+        params["quantizationParameters"] = json.dumps(quantization)
+    else:
+        params["maxAllowableOffset"] = _offset(profile["tolerance"])
+    return params
+
+
+def geojson_params(query: Dict[str, Any]) -> Dict[str, Any]:
+    """``query`` built for ``f=pbf`` rewritten for ``f=geojson``, keeping its generalization.
+
+    ``quantizationParameters`` is always dropped (geojson servers reject or ignore it); a
+    ``view`` tolerance becomes ``maxAllowableOffset``.
+    """
+    query = dict(query)
+    quantization = json.loads(query.pop("quantizationParameters", None) or "{}")
+    if quantization.get("mode") == "view" and quantization.get("tolerance"):
+        query["maxAllowableOffset"] = _offset(float(quantization["tolerance"]))
+    return query | {"f": "geojson"}
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+import unicodedata
+import weakref
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+import shapely
+from shapely.geometry import mapping, shape
+
+from services.transport import async_client
+from utils.cache import cache_root
+from utils.ratelimit import TokenBucket
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+# politica de uso do nominatim.openstreetmap.org: no maximo 1 requisicao por segundo
+NOMINATIM_RATE = 1.0
+# limites municipais quase nunca mudam; "nao encontrado" e revisto antes
+BOUNDARY_TTL_SECONDS = float(os.getenv("FLOWS_BOUNDARY_TTL", 180 * 86400))
+MISSING_TTL_SECONDS = 86400.0
+
+_bucket = TokenBucket(NOMINATIM_RATE, burst=1)
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]"
+_inflight = weakref.WeakKeyDictionary()
+
+
+def place_key(city: str, state: str) -> str:
+    """``("São José dos Pinhais", "pr")`` -> ``"sao jose dos pinhais|pr"``."""
+
+    def fold(text: str) -> str:
+        ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+        return " ".join(ascii_text.casefold().split())
+
+    return f"{fold(city)}|{fold(state)}"
+
+
+@dataclass(frozen=True)
+class BoundaryRecord:
+    """A geocoded municipality: polygon as WKB, its bbox and Nominatim's center point."""
+
+    key: str
+    display_name: str | None
+    bbox: Tuple[float, float, float, float]
+    center: Tuple[float, float] | None
+    wkb: bytes
+
+    @classmethod
+    def from_nominatim(cls, key: str, entry: Dict[str, Any]) -> "BoundaryRecord" | None:
+        geometry = entry.get("geojson")
+        if not geometry or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+            return None
+        geom = shape(geometry)
+        center = None
+        if entry.get("lon") is not None and entry.get("lat") is not None:
+            center = (float(entry["lon"]), float(entry["lat"]))
+        return cls(key, entry.get("display_name"), geom.bounds, center, shapely.to_wkb(geom))
+
+    def geometry(self):
+        return shapely.from_wkb(self.wkb)
+
+    def to_geojson(self) -> Dict[str, Any]:
+        """FeatureCollection as ``get_city_boundary`` returns it, with a GeoJSON ``bbox``."""
+        return {
+            "type": "FeatureCollection",
+            "bbox": list(self.bbox),
+            "features": [
+                {
+                    "type": "Feature",
+                    "properties": {"display_name": self.display_name},
+                    "geometry": mapping(self.geometry()),
+                }
+            ],
+        }
+
+
+class BoundaryCache:
+    """Persistent boundary store keyed by :func:`place_key` (``<cache>/boundaries``).
+
+    One small binary file per place: a JSON header line (name, bbox, center, timestamp) and
+    the polygon as zlib-compressed WKB, so loading never parses coordinates as text. Places
+    Nominatim did not find are remembered too, for :data:`MISSING_TTL_SECONDS`.
+    """
+
+    def __init__(self, root: Path | None = None):
+        self.path = root or cache_root() / "boundaries"
+
+    def _file(self, key: str) -> Path:
+        return self.path / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.bin"
+
+    def load(self, key: str) -> Tuple[Dict[str, Any], BoundaryRecord | None] | None:
+        """``(header, record)``; ``record`` is None for a remembered miss."""
+        try:
+            raw = self._file(key).read_bytes()
+            head, _sep, body = raw.partition(b"\n")
+            header = json.loads(head)
+            if header.get("key") != key:
+                return None
+            if header.get("missing"):
+                return header, None
+            record = BoundaryRecord(
+                key,
+                header.get("display_name"),
+                tuple(header["bbox"]),
+                tuple(header["center"]) if header.get("center") else None,
+                zlib.decompress(body),
+            )
+        except (OSError, ValueError, KeyError, TypeError, zlib.error):
+            return None
+        return header, record
+
+    def get(self, key: str) -> BoundaryRecord | None | bool:
+        """Fresh record, ``None`` for a fresh miss, ``False`` when absent or stale."""
+        entry = self.load(key)
+        if entry is None:
+            return False
+        header, record = entry
+        ttl = BOUNDARY_TTL_SECONDS if record is not None else MISSING_TTL_SECONDS
+        if time.time() - float(header.get("stored_at") or 0) > ttl:
+            return False
+        return record
+
+    def put(self, key: str, record: BoundaryRecord | None) -> None:
+        header: Dict[str, Any] = {"key": key, "stored_at": time.time()}
+        body = b""
+        if record is None:
+            header["missing"] = True
+        else:
+            header.update(
+                display_name=record.display_name,
+                bbox=list(record.bbox),
+                center=list(record.center) if record.center else None,
+            )
+            body = zlib.compress(record.wkb, 9)
+        path = self._file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        tmp.write_bytes(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n" + body)
+        os.replace(tmp, path)
+
+
+async def _nominatim(key: str, city: str, state: str) -> BoundaryRecord | None:
+    params = {
+        "q": f"{city}, {state}, Brazil",
+        "format": "jsonv2",
+        "polygon_geojson": 1,
+        "addressdetails": 1,
+    }
+    await _bucket.acquire()
+    response = await async_client().get(NOMINATIM_URL, params=params)
+    response.raise_for_status()
+    for entry in response.json():
+        record = BoundaryRecord.from_nominatim(key, entry)
+        if record is not None:
+            return record
+    return None
+
+
+async def lookup_boundary(
+    city: str, state: str, cache: BoundaryCache | None = None
+) -> BoundaryRecord | None:
+    """Boundary of ``city``/``state``: from the cache, else one rate-limited Nominatim query.
+
+    Concurrent lookups of the same place share a single request. If Nominatim fails, a stale
+    cached boundary is returned instead of the error.
+    """
+    cache = cache or BoundaryCache()
+    key = place_key(city, state)
+    cached = cache.get(key)
+    if cached is not False:
+        return cached
+
+    loop = asyncio.get_running_loop()
+    pending = _inflight.setdefault(loop, {})
+    task = pending.get(key)
+    if task is None:
+
+        async def fetch() -> BoundaryRecord | None:
+            try:
+                record = await _nominatim(key, city, state)
+                cache.put(key, record)
+                return record
+            finally:
+                pending.pop(key, None)
+
+        task = pending[key] = asyncio.ensure_future(fetch())
+    try:
+        # shield: uma cidade cancelada nao derruba a consulta que as outras esperam
+        return await asyncio.shield(task)
+    except Exception as exc:
+        stale = cache.load(key)
+        if stale is not None and stale[1] is not None:
+            print(f"[warn] nominatim falhou ({exc}); usando limite em cache de {city}/{state}")
+            return stale[1]
+        raise
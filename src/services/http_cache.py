@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from utils.cache import DiskCache, is_fresh
+
+# metadados de catalogo mudam pouco; dentro do TTL nem revalidamos
+METADATA_TTL_SECONDS = float(os.getenv("FLOWS_HTTP_CACHE_TTL", 6 * 3600))
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+class HttpMetadataCache:
+    """On-disk cache for JSON metadata GETs, revalidated with ETag/Last-Modified.
+
+    Fresh entries (younger than ``ttl``) are served without touching the network. Stale
+    entries are revalidated with a conditional request when the server sent validators, and
+    fetched again otherwise.
+    """
+
+    def __init__(self, ttl: float = METADATA_TTL_SECONDS, store: DiskCache | None = None):
+        self.ttl = ttl
+        self.store = store or DiskCache("http")
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    async def get_json(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        params: Dict[str, Any] | None = None,
+    ) -> Dict | None:
+        """Cached ``client.get(url, params).json()``; raises like the uncached call on misses."""
+        request = client.build_request("GET", url, params=params)
+        key = normalize_url(str(request.url))
+        entry = self.store.load(key)
+        if entry is not None and is_fresh(entry, self.ttl):
+            self.hits += 1
+            return entry["value"]
+
+        if entry is not None:
+            if entry.get("etag"):
+                request.headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request.headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = await client.send(request)
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            self.store.touch(entry)
+            return entry["value"]
+        response.raise_for_status()
+        payload = response.json()
+        self.misses += 1
+        # erros do ArcGIS vem com HTTP 200; nao guardamos para nao fixar uma falha
+        if isinstance(payload, dict) and "error" not in payload:
+            self.store.set(
+                key,
+                payload,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        return payload
+
+    def summary(self) -> str:
+        return (
+            f"cache http: {self.hits} hits, {self.revalidated} revalidados, {self.misses} baixados"
+        )
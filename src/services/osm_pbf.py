@@ -0,0 +1,522 @@
+from __future__ import annotations
+
+import lzma
+import os
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, Iterator, List, Mapping, Tuple
+
+import numpy as np
+
+from services.overpass import POI_TAGS
+from utils.protobuf import (
+    LENGTH_DELIMITED,
+    iter_fields,
+    packed_varints,
+    signed,
+    varint_array,
+    zigzag,
+    zigzag_array,
+)
+
+Bbox = Tuple[float, float, float, float]
+# chave -> valores aceitos (None = qualquer valor)
+TagFilter = Mapping[str, Collection[str] | None]
+
+# extrato local (.osm.pbf) que substitui o Overpass nos POIs da ingestao
+OSM_PBF_PATH = os.getenv("FLOWS_OSM_PBF")
+MAX_WORKERS = 4
+# recursos de cabecalho que este leitor entende
+SUPPORTED_FEATURES = {"OsmSchema-V0.6", "DenseNodes", "Sort.Type_then_ID"}
+# tags que tornam um caminho fechado uma area (o resto vira LineString)
+AREA_KEYS = ("building", "amenity", "landuse", "leisure", "natural", "place", "boundary")
+NODE, WAY, RELATION = "node", "way", "relation"
+_MEMBER_TYPES = {0: NODE, 1: WAY, 2: RELATION}
+
+
+def default_workers() -> int:
+    return min(MAX_WORKERS, os.cpu_count() or 1)
+
+
+# ---------------------------------------------------------------------------- blocos
+
+
+def scan_blocks(path: str | Path) -> List[Tuple[str, int, int]]:
+    """``(type, offset, size)`` of every blob in the file, read from the headers only."""
+    blocks = []
+    with open(path, "rb") as handle:
+        while True:
+            prefix = handle.read(4)
+            if len(prefix) < 4:
+                break
+            (header_size,) = struct.unpack(">I", prefix)
+            kind, data_size = "", 0
+            for number, _wire, value in iter_fields(handle.read(header_size)):
+                if number == 1:
+                    kind = bytes(value).decode("utf-8")
+                elif number == 3:
+                    data_size = value
+            offset = handle.tell()
+            blocks.append((kind, offset, data_size))
+            handle.seek(data_size, os.SEEK_CUR)
+    return blocks
+
+
+def read_blob(path: str | Path, offset: int, size: int) -> bytes:
+    """Decompressed payload of the blob at ``offset`` (raw, zlib or lzma)."""
+    with open(path, "rb") as handle:
+        handle.seek(offset)
+        raw = handle.read(size)
+    for number, _wire, value in iter_fields(raw):
+        if number == 1:
+            return bytes(value)
+        if number == 3:
+            return zlib.decompress(value)
+        if number == 4:
+            return lzma.decompress(value)
+        if number in (5, 6, 7):
+            raise ValueError("compressao de bloco PBF nao suportada (bzip2/lz4/zstd)")
+    return b""
+
+
+def check_header(path: str | Path, blocks: List[Tuple[str, int, int]]) -> None:
+    for kind, offset, size in blocks:
+        if kind != "OSMHeader":
+            continue
+        for number, _wire, value in iter_fields(read_blob(path, offset, size)):
+            feature = bytes(value).decode("utf-8") if number == 4 else None
+            if feature and feature not in SUPPORTED_FEATURES:
+                raise ValueError(f"recurso PBF nao suportado: {feature}")
+        return
+
+
+class _Block:
+    """One decoded PrimitiveBlock: string table, coordinate scaling and primitive groups."""
+
+    def __init__(self, payload: bytes):
+        self.strings: List[bytes] = []
+        self.groups: List[memoryview] = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        view = memoryview(payload)
+        for number, _wire, value in iter_fields(view):
+            if number == 1:
+                self.strings = [bytes(s) for n, _w, s in iter_fields(value) if n == 1]
+            elif number == 2:
+                self.groups.append(value)
+            elif number == 17:
+                self.granularity = value
+            elif number == 19:
+                self.lat_offset = signed(value)
+            elif number == 20:
+                self.lon_offset = signed(value)
+
+    def degrees(self, raw: np.ndarray, offset: int) -> np.ndarray:
+        return np.round((offset + self.granularity * raw) * 1e-9, 7)
+
+    def text(self, index: int) -> str:
+        return self.strings[index].decode("utf-8", "replace")
+
+    def tag_ids(self, tags: TagFilter) -> Dict[int, set | None]:
+        """String-table ids of the filter keys -> ids of their accepted values (None = any)."""
+        lookup = {s: i for i, s in enumerate(self.strings)}
+        result: Dict[int, set | None] = {}
+        for key, values in tags.items():
+            key_id = lookup.get(key.encode("utf-8"))
+            if key_id is None:
+                continue
+            if values is None:
+                result[key_id] = None
+                continue
+            encoded = (value.encode("utf-8") for value in values)
+            result[key_id] = {lookup[value] for value in encoded if value in lookup}
+        return result
+
+    def tags(self, keys: List[int], values: List[int]) -> Dict[str, str]:
+        return {self.text(k): self.text(v) for k, v in zip(keys, values)}
+
+
+def _matches(keys: List[int], values: List[int], wanted: Dict[int, set | None]) -> bool:
+    for key, value in zip(keys, values):
+        if key in wanted and (wanted[key] is None or value in wanted[key]):
+            return True
+    return False
+
+
+def _in_bbox(lons: np.ndarray, lats: np.ndarray, bbox: Bbox | None) -> np.ndarray:
+    if bbox is None:
+        return np.ones(len(lons), dtype=bool)
+    xmin, ymin, xmax, ymax = bbox
+    return (lons >= xmin) & (lons <= xmax) & (lats >= ymin) & (lats <= ymax)
+
+
+# abaixo disso (refs de um predio, membros de uma relacao) o numpy custa mais que o laco
+SHORT_PACKED = 64
+
+
+def _delta(buf: bytes) -> np.ndarray:
+    if len(buf) < SHORT_PACKED:
+        return np.fromiter(accumulate(map(zigzag, packed_varints(buf))), dtype=np.int64)
+    values, _ends = varint_array(buf)
+    return np.cumsum(zigzag_array(values))
+
+
+def _dense_nodes(block: _Block, dense: memoryview) -> Tuple[np.ndarray, ...]:
+    ids = lats = lons = np.empty(0, dtype=np.int64)
+    keys_vals = np.empty(0, dtype=np.int64)
+    for number, _wire, value in iter_fields(dense):
+        if number == 1:
+            ids = _delta(value)
+        elif number == 8:
+            lats = _delta(value)
+        elif number == 9:
+            lons = _delta(value)
+        elif number == 10:
+            keys_vals = varint_array(value)[0].astype(np.int64)
+    return (
+        ids,
+        block.degrees(lons, block.lon_offset),
+        block.degrees(lats, block.lat_offset),
+        keys_vals,
+    )
+
+
+def _dense_tagged(
+    block: _Block, keys_vals: np.ndarray, count: int, wanted: Dict[int, set | None]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Nodes with a matching tag, plus every (node, key, value) triple, all vectorized."""
+    empty = np.empty(0, dtype=np.int64)
+    if not len(keys_vals) or not wanted:
+        return empty, empty, empty, empty
+    # keys_vals: k1 v1 k2 v2 0 | 0 | k1 v1 0 ...  (0 fecha cada no)
+    zeros = keys_vals == 0
+    node_of = np.cumsum(zeros) - zeros
+    nonzero = np.flatnonzero(~zeros)
+    pair_node = node_of[nonzero]
+    rank = np.arange(len(nonzero)) - np.searchsorted(pair_node, pair_node)
+    key_pos = nonzero[rank % 2 == 0]
+    pair_node = pair_node[rank % 2 == 0]
+    keys, values = keys_vals[key_pos], keys_vals[key_pos + 1]
+    hit = np.zeros(len(keys), dtype=bool)
+    for key_id, allowed in wanted.items():
+        same = keys == key_id
+        if allowed is not None:
+            same &= np.isin(values, list(allowed))
+        hit |= same
+    nodes = np.unique(pair_node[hit])
+    return nodes[nodes < count], pair_node, keys, values
+
+
+# ---------------------------------------------------------------------------- passes
+
+
+def scan_block(
+    path: str, offset: int, size: int, tags: TagFilter, bbox: Bbox | None
+) -> Dict[str, Any]:
+    """First pass over one block: matching nodes (filtered by bbox), ways and relations."""
+    block = _Block(read_blob(path, offset, size))
+    wanted = block.tag_ids(tags)
+    result: Dict[str, Any] = {"kinds": set(), "nodes": [], "ways": [], "relations": []}
+    for group in block.groups:
+        for number, _wire, value in iter_fields(group):
+            if number == 2:
+                result["kinds"].add(NODE)
+                ids, lons, lats, keys_vals = _dense_nodes(block, value)
+                nodes, pair_node, keys, values = _dense_tagged(block, keys_vals, len(ids), wanted)
+                if not len(nodes):
+                    continue
+                nodes = nodes[_in_bbox(lons[nodes], lats[nodes], bbox)]
+                starts = np.searchsorted(pair_node, nodes)
+                ends = np.searchsorted(pair_node, nodes, side="right")
+                for node, start, end in zip(nodes.tolist(), starts.tolist(), ends.tolist()):
+                    node_tags = block.tags(keys[start:end].tolist(), values[start:end].tolist())
+                    result["nodes"].append(
+                        (int(ids[node]), node_tags, float(lons[node]), float(lats[node]))
+                    )
+            elif number == 1:
+                result["kinds"].add(NODE)
+                node = _plain_node(block, value, wanted)
+                if node is not None and _in_bbox(np.array([node[2]]), np.array([node[3]]), bbox)[0]:
+                    result["nodes"].append(node)
+            elif number == 3:
+                result["kinds"].add(WAY)
+                way = _way(block, value, wanted)
+                if way is not None:
+                    result["ways"].append(way)
+            elif number == 4:
+                result["kinds"].add(RELATION)
+                relation = _relation(block, value, wanted)
+                if relation is not None:
+                    result["relations"].append(relation)
+    return result
+
+
+def _plain_node(block: _Block, buf: memoryview, wanted) -> Tuple | None:
+    node_id, keys, values, lat, lon = 0, [], [], 0, 0
+    for number, _wire, value in iter_fields(buf):
+        if number == 1:
+            node_id = zigzag(value)
+        elif number == 2:
+            keys = packed_varints(value)
+        elif number == 3:
+            values = packed_varints(value)
+        elif number == 8:
+            lat = zigzag(value)
+        elif number == 9:
+            lon = zigzag(value)
+    if not _matches(keys, values, wanted):
+        return None
+    lon_deg = float(block.degrees(np.array([lon]), block.lon_offset)[0])
+    lat_deg = float(block.degrees(np.array([lat]), block.lat_offset)[0])
+    return node_id, block.tags(keys, values), lon_deg, lat_deg
+
+
+def _way(block: _Block, buf: memoryview, wanted) -> Tuple | None:
+    fields = {number: value for number, _wire, value in iter_fields(buf)}
+    keys = packed_varints(fields[2]) if 2 in fields else []
+    values = packed_varints(fields[3]) if 3 in fields else []
+    # so decodifica as referencias de quem passou no filtro de tags
+    if not _matches(keys, values, wanted) or 8 not in fields:
+        return None
+    return signed(fields.get(1, 0)), block.tags(keys, values), _delta(fields[8])
+
+
+def _relation(block: _Block, buf: memoryview, wanted) -> Tuple | None:
+    fields: Dict[int, Any] = {}
+    for number, wire, value in iter_fields(buf):
+        fields[number] = value
+    keys = packed_varints(fields[2]) if 2 in fields else []
+    values = packed_varints(fields[3]) if 3 in fields else []
+    if not _matches(keys, values, wanted):
+        return None
+    member_ids = _delta(fields[9]).tolist() if 9 in fields else []
+    types = packed_varints(fields[10]) if 10 in fields else []
+    members = [(_MEMBER_TYPES.get(t, NODE), m) for t, m in zip(types, member_ids)]
+    return signed(fields.get(1, 0)), block.tags(keys, values), members
+
+
+def way_refs(path: str, offset: int, size: int, ids_file: str) -> List[Tuple[int, np.ndarray]]:
+    """Node references of the ways listed (sorted) in ``ids_file``."""
+    wanted = np.load(ids_file, mmap_mode="r")
+    block = _Block(read_blob(path, offset, size))
+    found = []
+    for group in block.groups:
+        for number, wire, value in iter_fields(group):
+            if number != 3 or wire != LENGTH_DELIMITED:
+                continue
+            fields = iter_fields(value)
+            # o id vem primeiro: os caminhos que nao interessam param aqui
+            _n, _w, way_id = next(fields)
+            way_id = signed(way_id)
+            index = np.searchsorted(wanted, way_id)
+            if index == len(wanted) or wanted[index] != way_id:
+                continue
+            refs = [v for n, _w, v in fields if n == 8]
+            if refs:
+                found.append((way_id, _delta(refs[0])))
+    return found
+
+
+def node_coordinates(
+    path: str, offset: int, size: int, ids_file: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """``(ids, lons, lats)`` of the nodes of this block listed (sorted) in ``ids_file``."""
+    wanted = np.load(ids_file, mmap_mode="r")
+    block = _Block(read_blob(path, offset, size))
+    parts = []
+    for group in block.groups:
+        for number, _wire, value in iter_fields(group):
+            if number == 2:
+                ids, lons, lats, _kv = _dense_nodes(block, value)
+            elif number == 1:
+                fields = {n: v for n, _w, v in iter_fields(value)}
+                ids = np.array([zigzag(fields.get(1, 0))])
+                lats = block.degrees(np.array([zigzag(fields.get(8, 0))]), block.lat_offset)
+                lons = block.degrees(np.array([zigzag(fields.get(9, 0))]), block.lon_offset)
+            else:
+                continue
+            index = np.minimum(np.searchsorted(wanted, ids), max(len(wanted) - 1, 0))
+            hit = wanted[index] == ids if len(wanted) else np.zeros(len(ids), dtype=bool)
+            parts.append((ids[hit], lons[hit], lats[hit]))
+    if not parts:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty, empty
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+# ---------------------------------------------------------------------------- leitor
+
+
+class OsmPbfReader:
+    """Offline reader for ``.osm.pbf`` extracts (e.g. Geofabrik's ``parana-latest.osm.pbf``).
+
+    Blocks are decoded in a process pool, each worker reading its own blobs from the file.
+    :meth:`elements` makes up to three passes: tagged nodes, ways and relations are filtered by
+    ``tags`` (and nodes by ``bbox``) while decoding; then the ways that matching relations
+    reference are read; finally the coordinates of every node those ways use are looked up, so
+    only the nodes that matter are ever held in memory.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        workers: int | None = None,
+        pool: ProcessPoolExecutor | None = None,
+    ):
+        self.path = str(path)
+        self.workers = max(1, workers or default_workers())
+        self._pool = pool
+        self.blocks = scan_blocks(self.path)
+        check_header(self.path, self.blocks)
+        self._data = [(offset, size) for kind, offset, size in self.blocks if kind == "OSMData"]
+
+    def _map(
+        self, pool: ProcessPoolExecutor | None, func: Callable, jobs: List[Tuple], *extra: Any
+    ) -> Iterator[Any]:
+        if pool is None or len(jobs) <= 1:
+            return (func(self.path, *job, *extra) for job in jobs)
+        # cada worker le os proprios blocos do arquivo: so (offset, tamanho) atravessa o pool
+        futures = [pool.submit(func, self.path, *job, *extra) for job in jobs]
+        return (future.result() for future in futures)
+
+    def elements(self, tags: TagFilter, bbox: Bbox | None = None) -> Dict[str, List]:
+        """Matching ``nodes`` (id, tags, lon, lat), ``ways`` (id, tags, coords array) and
+        ``relations`` (id, tags, coords of their node and way members)."""
+        pool = self._pool
+        if pool is None and self.workers > 1 and len(self._data) > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            return self._elements(pool, tags, bbox)
+        finally:
+            if pool is not None and pool is not self._pool:
+                pool.shutdown()
+
+    def _elements(
+        self, pool: ProcessPoolExecutor | None, tags: TagFilter, bbox: Bbox | None
+    ) -> Dict[str, List]:
+        nodes: List[Tuple] = []
+        ways: List[Tuple] = []
+        relations: List[Tuple] = []
+        kinds: Dict[str, List[Tuple[int, int]]] = {NODE: [], WAY: [], RELATION: []}
+        for job, scan in zip(self._data, self._map(pool, scan_block, self._data, dict(tags), bbox)):
+            nodes.extend(scan["nodes"])
+            ways.extend(scan["ways"])
+            relations.extend(scan["relations"])
+            for kind in scan["kinds"]:
+                kinds[kind].append(job)
+
+        refs: Dict[int, np.ndarray] = {way_id: way_refs for way_id, _tags, way_refs in ways}
+        member_ways = sorted(
+            {m for _id, _tags, members in relations for t, m in members if t == WAY} - set(refs)
+        )
+        member_nodes = [m for _id, _tags, members in relations for t, m in members if t == NODE]
+        with tempfile.TemporaryDirectory(prefix="flows_pbf_") as scratch:
+            if member_ways:
+                ids_file = os.path.join(scratch, "ways.npy")
+                np.save(ids_file, np.asarray(member_ways, dtype=np.int64))
+                for found in self._map(pool, way_refs, kinds[WAY], ids_file):
+                    refs.update(found)
+            needed = [np.asarray(member_nodes, dtype=np.int64), *refs.values()]
+            needed_ids = np.unique(np.concatenate(needed)) if needed else np.empty(0, np.int64)
+            ids, lons, lats = np.empty(0, np.int64), np.empty(0), np.empty(0)
+            if len(needed_ids):
+                ids_file = os.path.join(scratch, "nodes.npy")
+                np.save(ids_file, needed_ids)
+                columns = list(self._map(pool, node_coordinates, kinds[NODE], ids_file))
+                if columns:
+                    ids, lons, lats = (np.concatenate(c) for c in zip(*columns))
+        order = np.argsort(ids)
+        ids, coords = ids[order], np.column_stack((lons[order], lats[order]))
+
+        def locate(node_ids: np.ndarray) -> np.ndarray:
+            if not len(ids) or not len(node_ids):
+                return np.empty((0, 2))
+            index = np.minimum(np.searchsorted(ids, node_ids), len(ids) - 1)
+            # referencias para fora do recorte do extrato ficam de fora
+            return coords[index[ids[index] == node_ids]]
+
+        located_ways = []
+        for way_id, way_tags, way_nodes in ways:
+            points = locate(way_nodes)
+            if len(points) >= 2 and (
+                bbox is None or _in_bbox(points[:, 0], points[:, 1], bbox).any()
+            ):
+                located_ways.append((way_id, way_tags, points))
+        located_relations = []
+        for relation_id, relation_tags, members in relations:
+            parts = [
+                locate(refs[m]) if t == WAY else locate(np.array([m]))
+                for t, m in members
+                if t == NODE or (t == WAY and m in refs)
+            ]
+            points = np.concatenate(parts) if parts else np.empty((0, 2))
+            if len(points) and (bbox is None or _in_bbox(points[:, 0], points[:, 1], bbox).any()):
+                located_relations.append((relation_id, relation_tags, points))
+        return {"nodes": nodes, "ways": located_ways, "relations": located_relations}
+
+    def features(
+        self, tags: TagFilter, bbox: Bbox | None = None, centers: bool = False
+    ) -> Iterator[Dict[str, Any]]:
+        """GeoJSON features: nodes as points, ways as lines/polygons, relations at their center.
+
+        ``centers=True`` turns ways into points too (like Overpass ``out center``).
+        """
+        found = self.elements(tags, bbox)
+        for node_id, node_tags, lon, lat in found["nodes"]:
+            yield _feature(NODE, node_id, node_tags, {"type": "Point", "coordinates": [lon, lat]})
+        for way_id, way_tags, points in found["ways"]:
+            geometry = _center(points) if centers else _way_geometry(way_tags, points)
+            yield _feature(WAY, way_id, way_tags, geometry)
+        for relation_id, relation_tags, points in found["relations"]:
+            yield _feature(RELATION, relation_id, relation_tags, _center(points))
+
+
+def _feature(kind: str, osm_id: int, tags: Dict[str, str], geometry: Dict) -> Dict[str, Any]:
+    properties = dict(tags)
+    properties["id"] = osm_id
+    properties["osm_type"] = kind
+    return {"type": "Feature", "properties": properties, "geometry": geometry}
+
+
+def _center(points: np.ndarray) -> Dict[str, Any]:
+    # centro do retangulo envolvente, como o "out center" do Overpass
+    (xmin, ymin), (xmax, ymax) = points.min(axis=0), points.max(axis=0)
+    return {
+        "type": "Point",
+        "coordinates": [round(float(xmin + xmax) / 2, 7), round(float(ymin + ymax) / 2, 7)],
+    }
+
+
+def _way_geometry(tags: Dict[str, str], points: np.ndarray) -> Dict[str, Any]:
+    coords = points.tolist()
+    closed = len(coords) >= 4 and coords[0] == coords[-1]
+    is_area = tags.get("area") == "yes" or any(key in tags for key in AREA_KEYS)
+    if closed and is_area and tags.get("area") != "no":
+        return {"type": "Polygon", "coordinates": [coords]}
+    return {"type": "LineString", "coordinates": coords}
+
+
+def pbf_pois(
+    path: str | Path, bbox: Bbox, kinds: List[str], workers: int | None = None
+) -> Dict | None:
+    """Offline counterpart of :func:`services.overpass.overpass_pois` for a local extract."""
+    tags: Dict[str, set] = {}
+    for kind in kinds:
+        if kind in POI_TAGS:
+            key, value = POI_TAGS[kind]
+            tags.setdefault(key, set()).add(value)
+    if not tags:
+        return None
+    xmin, ymin, xmax, ymax = bbox
+    features = [
+        feature
+        for feature in OsmPbfReader(path, workers=workers).features(tags, bbox, centers=True)
+        if xmin <= feature["geometry"]["coordinates"][0] <= xmax
+        and ymin <= feature["geometry"]["coordinates"][1] <= ymax
+    ]
+    return {"type": "FeatureCollection", "features": features} if features else None
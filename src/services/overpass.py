@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import weakref
+from typing import Any, Dict, Iterable, List, Tuple
+
+from services.transport import async_client
+from utils.cache import DiskCache
+from utils.ratelimit import TokenBucket
+
+Bbox = Tuple[float, float, float, float]
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+OVERPASS_TTL_SECONDS = float(os.getenv("FLOWS_OVERPASS_TTL", 7 * 86400))
+# grade fixa em graus (~28 km): os mesmos tiles se repetem entre execucoes e cidades vizinhas
+TILE_DEGREES = 0.25
+# tile que estoura o timeout do Overpass e dividido em 4 ate este tamanho; e tambem o passo
+# (~3.5 km) em que a parte consultada de um tile e arredondada
+MIN_TILE_DEGREES = 0.25 / 8
+# overpass-api.de libera 2 consultas simultaneas por IP
+OVERPASS_SLOTS = 2
+OVERPASS_RATE = 1.0
+QUERY_TIMEOUT = 60
+
+# tipo de POI -> (chave, valor) da tag do OSM; tambem usado na leitura offline (osm_pbf)
+POI_TAGS: Dict[str, Tuple[str, str]] = {
+    "hospital": ("amenity", "hospital"),
+    "clinic": ("amenity", "clinic"),
+    "school": ("amenity", "school"),
+    "kindergarten": ("amenity", "kindergarten"),
+    "bus_stop": ("highway", "bus_stop"),
+}
+
+_bucket = TokenBucket(OVERPASS_RATE, burst=OVERPASS_SLOTS)
+_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]"
+_slots = weakref.WeakKeyDictionary()
+
+
+def _loop_slots() -> asyncio.Semaphore:
+    # um limite por loop, compartilhado por todas as cidades de um lote
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        slots = _slots[loop] = asyncio.Semaphore(OVERPASS_SLOTS)
+    return slots
+
+
+def tile_grid(bbox: Bbox, size: float = TILE_DEGREES) -> List[Bbox]:
+    """Tiles of a fixed ``size``-degree grid covering ``bbox`` (snapped, so keys are stable)."""
+    xmin, ymin, xmax, ymax = bbox
+    tiles = []
+    for i in range(math.floor(xmin / size), math.floor(xmax / size) + 1):
+        for j in range(math.floor(ymin / size), math.floor(ymax / size) + 1):
+            tiles.append((i * size, j * size, (i + 1) * size, (j + 1) * size))
+    return tiles
+
+
+def clip_tile(tile: Bbox, bbox: Bbox, step: float = MIN_TILE_DEGREES) -> Bbox:
+    """Part of ``tile`` covering ``bbox``, widened to the ``step`` grid.
+
+    A city much smaller than a tile then queries a few km around itself instead of the whole
+    tile, while snapping keeps the query (and so the cache key) the same from run to run.
+    """
+    return (
+        max(tile[0], math.floor(bbox[0] / step) * step),
+        max(tile[1], math.floor(bbox[1] / step) * step),
+        min(tile[2], math.ceil(bbox[2] / step) * step),
+        min(tile[3], math.ceil(bbox[3] / step) * step),
+    )
+
+
+def _quadrants(tile: Bbox) -> List[Bbox]:
+    xmin, ymin, xmax, ymax = tile
+    xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+    return [
+        (xmin, ymin, xmid, ymid),
+        (xmid, ymin, xmax, ymid),
+        (xmin, ymid, xmid, ymax),
+        (xmid, ymid, xmax, ymax),
+    ]
+
+
+def build_query(tile: Bbox, kinds: Iterable[str]) -> str | None:
+    """Overpass QL for nodes, ways and relations of ``kinds`` in ``tile``, with centers."""
+    xmin, ymin, xmax, ymax = tile
+    area = f"({ymin:.6f},{xmin:.6f},{ymax:.6f},{xmax:.6f})"
+    tags = [POI_TAGS[kind] for kind in dict.fromkeys(kinds) if kind in POI_TAGS]
+    if not tags:
+        return None
+    body = "".join(f'nwr["{key}"="{value}"]{area};' for key, value in tags)
+    return f"[out:json][timeout:{QUERY_TIMEOUT}];({body});out center tags;"
+
+
+def element_feature(element: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Point feature of a node, or of a way/relation at its ``center``."""
+    if "lon" in element and "lat" in element:
+        lon, lat = element["lon"], element["lat"]
+    elif element.get("center"):
+        lon, lat = element["center"].get("lon"), element["center"].get("lat")
+    else:
+        return None
+    if lon is None or lat is None:
+        return None
+    properties = dict(element.get("tags") or {})
+    properties["id"] = element.get("id")
+    properties["osm_type"] = element.get("type")
+    return {
+        "type": "Feature",
+        "properties": properties,
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+    }
+
+
+def _inside(feature: Dict[str, Any], bbox: Bbox) -> bool:
+    x, y = feature["geometry"]["coordinates"]
+    return bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]
+
+
+class OverpassClient:
+    """Tiled Overpass retrieval with an on-disk response cache.
+
+    A bbox is split into fixed grid tiles fetched concurrently, at most :data:`OVERPASS_SLOTS`
+    at a time and :data:`OVERPASS_RATE` new queries per second. Each tile only queries its part
+    covering the bbox (see :func:`clip_tile`). Responses are cached by endpoint + query for
+    ``ttl`` seconds, and a cached whole tile also serves any part of it. A query that times out
+    on the server is split in four. Elements seen in several tiles (ways crossing a border) are
+    kept once, by OSM type + id.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        cache: DiskCache | None = None,
+        ttl: float = OVERPASS_TTL_SECONDS,
+        tile_size: float = TILE_DEGREES,
+    ):
+        self.url = url or OVERPASS_URL
+        self.cache = cache if cache is not None else DiskCache("overpass", compress=True)
+        self.ttl = ttl
+        self.tile_size = tile_size
+        self.hits = 0
+        self.misses = 0
+        self.splits = 0
+
+    async def _query(self, query: str) -> Dict[str, Any]:
+        async with _loop_slots():
+            await _bucket.acquire()
+            response = await async_client().get(self.url, params={"data": query})
+        response.raise_for_status()
+        return response.json()
+
+    async def fetch_tile(
+        self, tile: Bbox, kinds: Iterable[str], bbox: Bbox | None = None
+    ) -> List[Dict[str, Any]]:
+        """Elements of one tile (only its part covering ``bbox``), from the cache when fresh."""
+        kinds = list(kinds)
+        area = tile if bbox is None else clip_tile(tile, bbox)
+        if area != tile:
+            whole = self.cache.get(f"{self.url}\n{build_query(tile, kinds)}", ttl=self.ttl)
+            if isinstance(whole, list):
+                self.hits += 1
+                return whole
+            tile = area
+        query = build_query(tile, kinds)
+        if query is None:
+            return []
+        key = f"{self.url}\n{query}"
+        cached = self.cache.get(key, ttl=self.ttl)
+        if isinstance(cached, list):
+            self.hits += 1
+            return cached
+        if cached is None:
+            self.misses += 1
+            data = await self._query(query)
+            elements = data.get("elements") or []
+            remark = str(data.get("remark") or "")
+            if "runtime error" not in remark:
+                self.cache.set(key, elements)
+                return elements
+            # timeout/memoria no servidor: a resposta veio parcial
+            if max(tile[2] - tile[0], tile[3] - tile[1]) <= MIN_TILE_DEGREES * 1.5:
+                print(f"[warn] overpass: resposta parcial no tile {tile}: {remark}")
+                return elements
+            # lembra que este tile e grande demais: a proxima execucao vai direto aos quadrantes
+            self.cache.set(key, {"split": True})
+        self.splits += 1
+        parts = await asyncio.gather(*(self.fetch_tile(q, kinds) for q in _quadrants(tile)))
+        return [element for part in parts for element in part]
+
+    async def elements(self, bbox: Bbox, kinds: Iterable[str]) -> List[Dict[str, Any]]:
+        """Every element of ``kinds`` touching ``bbox`` (snapped), deduplicated by OSM id."""
+        kinds = list(kinds)
+        if not all(math.isfinite(value) for value in bbox):
+            return []
+        tiles = tile_grid(bbox, self.tile_size)
+        parts = await asyncio.gather(*(self.fetch_tile(tile, kinds, bbox) for tile in tiles))
+        unique: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for part in parts:
+            for element in part:
+                unique.setdefault((element.get("type"), element.get("id")), element)
+        return list(unique.values())
+
+    async def pois(self, bbox: Bbox, kinds: Iterable[str]) -> Dict | None:
+        """FeatureCollection of the POIs inside ``bbox`` (ways/relations at their center)."""
+        features = [
+            feature
+            for feature in map(element_feature, await self.elements(bbox, kinds))
+            if feature is not None and _inside(feature, bbox)
+        ]
+        return {"type": "FeatureCollection", "features": features} if features else None
+
+
+async def overpass_pois(bbox: Bbox, kinds: List[str]) -> Dict | None:
+    return await OverpassClient().pois(bbox, kinds)
@@ -1,6 +1,18 @@
-import os, json, asyncio, requests
+import os, json, asyncio, hashlib, weakref
+
+from services.transport import async_client, run
+from utils.cache import DiskCache, is_fresh
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# compativel com a API da OpenAI; aponte para devtools/fake_openai.py nos testes
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# as sugestoes quase nao mudam; resposta vazia/invalida e refeita antes
+AI_CACHE_TTL = float(os.getenv("FLOWS_AI_CACHE_TTL", 30 * 86400))
+AI_EMPTY_TTL = 86400.0
+
+_inflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]"
+_inflight = weakref.WeakKeyDictionary()
 
 PROMPT_SOURCES = """
 Você é um assistente que sugere endpoints públicos de camadas geoespaciais (ArcGIS REST /query)
@@ -27,13 +39,13 @@ Responda APENAS em JSON válido:
 Município: {city} - {state}. Traga 1–5 candidatos plausíveis.
 """
 
-def _post_openai(payload: dict) -> dict:
+async def _post_openai(payload: dict) -> dict:
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json",
     }
-    r = requests.post("https://api.openai.com/v1/chat/completions",
-                      headers=headers, json=payload, timeout=60)
+    r = await async_client("api").post(f"{OPENAI_BASE_URL}/chat/completions",
+                                       headers=headers, json=payload)
     r.raise_for_status()
     return r.json()
 
@@ -50,22 +62,64 @@ def _safe_parse_json_block(content: str):
     except Exception:
         return None
 
-async def ai_discover_sources(city: str, state: str, what: str = "core") -> list[dict]:
-    if not OPENAI_API_KEY:
-        return []
-    prompt = PROMPT_SOURCES.format(city=city, state=state, what=what)
+def _empty(answer: dict | None) -> bool:
+    # {"sources": []} conta como vazio
+    return not answer or not any(answer.values())
+
+def _cache_key(payload: dict) -> str:
+    # modelo + hash do payload (prompt, temperatura) + endpoint: o stub nao contamina o cache real
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return f"{OPENAI_BASE_URL}|{payload['model']}|{digest.hexdigest()}"
+
+async def ask_json(prompt: str, cache: DiskCache | None = None) -> dict | None:
+    """JSON answer of the chat model to ``prompt``, cached on disk by model + prompt hash.
+
+    Empty or unparseable answers are cached too, for :data:`AI_EMPTY_TTL`. Concurrent calls
+    with the same prompt share one request. Errors propagate and are never cached.
+    """
     payload = {
-        "model": "gpt-4o-mini",
+        "model": OPENAI_MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": 0.2,
     }
+    cache = cache if cache is not None else DiskCache("openai")
+    key = _cache_key(payload)
+    entry = cache.load(key)
+    if entry is not None:
+        answer = (entry.get("value") or {}).get("json")
+        ttl = AI_EMPTY_TTL if _empty(answer) else AI_CACHE_TTL
+        if is_fresh(entry, ttl):
+            return answer
+
+    loop = asyncio.get_running_loop()
+    pending = _inflight.setdefault(loop, {})
+    task = pending.get(key)
+    if task is None:
+
+        async def fetch() -> dict | None:
+            try:
+                data = await _post_openai(payload)
+                content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+                answer = _safe_parse_json_block(content)
+                answer = answer if isinstance(answer, dict) else None
+                cache.set(key, {"json": answer}, model=payload["model"])
+                return answer
+            finally:
+                pending.pop(key, None)
+
+        task = pending[key] = asyncio.ensure_future(fetch())
+    # shield: uma ingestao cancelada nao derruba a chamada que as outras esperam
+    return await asyncio.shield(task)
+
+async def ai_discover_sources(city: str, state: str, what: str = "core") -> list[dict]:
+    if not OPENAI_API_KEY:
+        return []
+    prompt = PROMPT_SOURCES.format(city=city, state=state, what=what)
     try:
-        data = await asyncio.to_thread(_post_openai, payload)
+        js = await ask_json(prompt) or {}
     except Exception as e:
         print(f"[warn] ai_discover_sources: {e}")
         return []
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    js = _safe_parse_json_block(content) or {}
     raw = js.get("sources") or []
     out = []
     for s in raw:
@@ -89,18 +143,11 @@ async def ai_discover_arcgis_roots(city: str, state: str) -> list[str]:
     if not OPENAI_API_KEY:
         return []
     prompt = PROMPT_ROOTS.format(city=city, state=state)
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.2,
-    }
     try:
-        data = await asyncio.to_thread(_post_openai, payload)
+        js = await ask_json(prompt) or {}
     except Exception as e:
         print(f"[warn] ai_discover_arcgis_roots: {e}")
         return []
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    js = _safe_parse_json_block(content) or {}
     roots = js.get("roots") or []
     return [r for r in roots if isinstance(r, str) and r.strip()]
 
@@ -108,13 +155,13 @@ async def ai_discover_arcgis_roots(city: str, state: str) -> list[str]:
 
 def ai_discover_sources_sync(city: str, state: str, what: str = "core") -> list[dict]:
     try:
-        return asyncio.run(ai_discover_sources(city, state, what))
+        return run(ai_discover_sources(city, state, what))
     except RuntimeError:
         # já existe loop; roda em thread
         return asyncio.get_event_loop().run_until_complete(ai_discover_sources(city, state, what))
 
 def ai_discover_arcgis_roots_sync(city: str, state: str) -> list[str]:
     try:
-        return asyncio.run(ai_discover_arcgis_roots(city, state))
+        return run(ai_discover_arcgis_roots(city, state))
     except RuntimeError:
         return asyncio.get_event_loop().run_until_complete(ai_discover_arcgis_roots(city, state))
@@ -1,15 +1,23 @@
 ﻿from __future__ import annotations
 
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 import httpx
 
+from services.arcgis_download import fetch_layer_info, fetch_pbf_features, layer_url_from_query
+from services.arcgis_pbf import supports_pbf
+from services.download_profiles import profile_params
+from services.spatial_filter import BoundaryFilter
+from services.transport import async_client
+
 
 async def try_arcgis_geojson(
     url: str,
     params: Dict[str, Any] | None,
     soft: bool = False,
     client: httpx.AsyncClient | None = None,
+    profile: str | None = None,
+    boundary: BoundaryFilter | None = None,
 ) -> Dict | None:
     query = {
         "f": "geojson",
@@ -18,12 +26,19 @@ async def try_arcgis_geojson(
     }
     if params:
         query.update(params)
+    if boundary is not None:
+        query.update(boundary.query_params())
 
-    owns_client = client is None
-    if owns_client:
-        client = httpx.AsyncClient(timeout=httpx.Timeout(90.0))
+    if client is None:
+        client = async_client()
 
     try:
+        if query.get("f") == "geojson":
+            info = await fetch_layer_info(client, layer_url_from_query(url))
+            features = await _try_pbf(client, url, query, info, profile)
+            if features is not None:
+                return {"type": "FeatureCollection", "features": _clip(features, boundary)}
+            query.update(profile_params(profile, info, "geojson"))
         response = await client.get(url, params=query)
         if soft and response.status_code != 200:
             return None
@@ -33,10 +48,34 @@ async def try_arcgis_geojson(
         if soft:
             return None
         raise
-    finally:
-        if owns_client and client is not None:
-            await client.aclose()
 
-    if isinstance(payload, dict) and payload.get("type") == "FeatureCollection" and "features" in payload:
+    if (
+        isinstance(payload, dict)
+        and payload.get("type") == "FeatureCollection"
+        and "features" in payload
+    ):
+        payload["features"] = _clip(payload["features"], boundary)
         return payload
     return None
+
+
+def _clip(features: List[Dict], boundary: BoundaryFilter | None) -> List[Dict]:
+    return boundary.clip(features) if boundary is not None else features
+
+
+async def _try_pbf(
+    client: httpx.AsyncClient,
+    url: str,
+    query: Dict[str, Any],
+    info: Dict,
+    profile: str | None,
+) -> List[Dict] | None:
+    # so vale a pena se a camada anuncia pbf; qualquer falha cai no geojson de sempre
+    if not supports_pbf(info):
+        return None
+    pbf_query = query | {"f": "pbf"} | profile_params(profile, info, "pbf")
+    try:
+        return await fetch_pbf_features(client, url, pbf_query)
+    except (httpx.HTTPError, ValueError) as exc:
+        print(f"[warn] pbf falhou em {url} ({exc}); usando geojson")
+        return None
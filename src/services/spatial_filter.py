@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import shapely
+from shapely.errors import GEOSException
+from shapely.geometry import shape
+from shapely.ops import unary_union
+
+# parametros de consulta que restringem o espaco; count/ids precisam repetir os mesmos
+SPATIAL_PARAMS = ("geometry", "geometryType", "inSR", "spatialRel")
+
+
+class BoundaryFilter:
+    """Municipality boundary pushed down into ArcGIS queries.
+
+    The server only gets the boundary's envelope (cheap to evaluate, short URL); features that
+    fall in the envelope but outside the boundary itself are dropped locally against a prepared
+    geometry before anything is written.
+    """
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        shapely.prepare(self.geometry)
+        self.bbox = self.geometry.bounds
+
+    @classmethod
+    def from_geojson(cls, boundary: Dict | None) -> "BoundaryFilter" | None:
+        geometries = [
+            shape(feature["geometry"])
+            for feature in (boundary or {}).get("features", [])
+            if feature.get("geometry")
+        ]
+        polygons = [g for g in geometries if g.geom_type in ("Polygon", "MultiPolygon")]
+        if not polygons:
+            return None
+        return cls(unary_union(polygons))
+
+    def query_params(self) -> Dict[str, Any]:
+        xmin, ymin, xmax, ymax = self.bbox
+        return {
+            "geometry": f"{xmin},{ymin},{xmax},{ymax}",
+            "geometryType": "esriGeometryEnvelope",
+            "inSR": "4326",
+            "spatialRel": "esriSpatialRelIntersects",
+        }
+
+    def keeps(self, feature: Dict) -> bool:
+        geometry = feature.get("geometry")
+        if not geometry:
+            return False
+        try:
+            return self.geometry.intersects(shape(geometry))
+        except (GEOSException, ValueError, TypeError, AttributeError):
+            # geometria que o shapely nao entende: o servidor ja filtrou pelo envelope
+            return True
+
+    def clip(self, features: List[Dict]) -> List[Dict]:
+        return [feature for feature in features if self.keeps(feature)]
@@ -0,0 +1,470 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import importlib.util
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+USER_AGENT = "flows-ia/1.0"
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+DEFAULT_CONCURRENCY = 16
+PER_HOST_CONCURRENCY = 4
+# conexoes abertas por host no pool compartilhado (os limitadores dos crawls ficam abaixo disso)
+POOL_PER_HOST = 8
+POOL_MAX_CONNECTIONS = 64
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# POST (cobrado) so e repetido quando o servidor certamente nao executou o pedido: 429 ou
+# falha antes de conectar; um 5xx pode vir depois de a completion ja ter rodado
+UNSENT_STATUSES = frozenset({429})
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+@dataclass(frozen=True)
+class ClientProfile:
+    """Timeout and retry policy of a pooled client."""
+
+    timeout: float
+    connect_timeout: float = 10.0
+    retries: int = 2
+    backoff: float = 0.5
+    max_backoff: float = 8.0
+    # status que valem nova tentativa; vazio deixa 429/5xx para o chamador
+    retry_statuses: frozenset = RETRY_STATUSES
+    retry_methods: frozenset = frozenset({"GET", "HEAD"})
+
+
+PROFILES: Dict[str, ClientProfile] = {
+    # pjson de catalogo/servico/camada
+    "metadata": ClientProfile(timeout=40.0),
+    # sondagem de raizes candidatas: host que nao conecta logo e descartado, sem nova tentativa
+    "probe": ClientProfile(timeout=8.0, connect_timeout=3.0, retries=0),
+    # paginas de query: uma nova tentativa para falha passageira; se persistir, o HostTuner
+    # trata como sobrecarga e reparte o bloco
+    "download": ClientProfile(timeout=120.0, retries=1),
+    # Nominatim/Overpass/consultas soltas
+    "default": ClientProfile(timeout=90.0),
+    # APIs pagas (OpenAI, Google): POST so repete 429 e falhas de conexao (ver UNSENT_*)
+    "api": ClientProfile(timeout=60.0, retry_methods=frozenset({"GET", "POST"})),
+}
+
+
+def _host(url: httpx.URL | str) -> str:
+    return (url.netloc.decode() if isinstance(url, httpx.URL) else urlsplit(url).netloc).lower()
+
+
+# ---------------------------------------------------------------------------- metricas
+
+
+@dataclass
+class HostMetrics:
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    statuses: Dict[int, int] = field(default_factory=dict)
+
+
+class TransportMetrics:
+    """Per-host request counters shared by every pooled client."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, HostMetrics] = {}
+
+    def _entry(self, host: str) -> HostMetrics:
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = HostMetrics()
+        return entry
+
+    def record(self, host: str, status: int | None, seconds: float, retry: bool) -> None:
+        with self._lock:
+            entry = self._entry(host)
+            entry.requests += 1
+            entry.retries += int(retry)
+            entry.seconds += seconds
+            if status is None:
+                entry.errors += 1
+            else:
+                entry.statuses[status] = entry.statuses.get(status, 0) + 1
+
+    def add_bytes(self, host: str, size: int) -> None:
+        with self._lock:
+            self._entry(host).bytes += size
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out = {
+                host: {
+                    "requests": m.requests,
+                    "retries": m.retries,
+                    "errors": m.errors,
+                    "bytes": m.bytes,
+                    "avg_ms": round(1000 * m.seconds / m.requests, 1) if m.requests else 0.0,
+                    "statuses": dict(m.statuses),
+                }
+                for host, m in self._hosts.items()
+            }
+            if reset:
+                self._hosts.clear()
+            return out
+
+
+metrics = TransportMetrics()
+
+
+# ---------------------------------------------------------------------------- retentativas
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _delay(profile: ClientProfile, attempt: int, response: httpx.Response | None) -> float:
+    hinted = _retry_after(response) if response is not None else None
+    if hinted is not None:
+        return min(hinted, profile.max_backoff)
+    # backoff exponencial com jitter total
+    return random.uniform(0, min(profile.max_backoff, profile.backoff * 2**attempt))
+
+
+def _retryable(
+    profile: ClientProfile,
+    request: httpx.Request,
+    attempt: int,
+    response: httpx.Response | None = None,
+    error: Exception | None = None,
+) -> bool:
+    if attempt >= profile.retries or request.method not in profile.retry_methods:
+        return False
+    if request.method in IDEMPOTENT_METHODS:
+        return True
+    if response is not None:
+        return response.status_code in UNSENT_STATUSES
+    return isinstance(error, UNSENT_ERRORS)
+
+
+class _AsyncCountingStream(httpx.AsyncByteStream):
+    # conta os bytes do corpo e so libera a vaga do host quando a resposta fecha
+    def __init__(self, stream: httpx.AsyncByteStream, host: str, release: Callable[[], None]):
+        self._stream = stream
+        self._host = host
+        self._release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            metrics.add_bytes(self._host, len(chunk))
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class _SyncCountingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, host: str, release: Callable[[], None]):
+        self._stream = stream
+        self._host = host
+        self._release = release
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._stream:
+            metrics.add_bytes(self._host, len(chunk))
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+def _once(release: Callable[[], None]) -> Callable[[], None]:
+    done = []
+
+    def wrapper() -> None:
+        if not done:
+            done.append(True)
+            release()
+
+    return wrapper
+
+
+class RequestGates:
+    """Global and per-host caps on in-flight requests, shared by every pooled client of a loop."""
+
+    def __init__(self, total: int = POOL_MAX_CONNECTIONS, per_host: int = POOL_PER_HOST):
+        self._total = asyncio.Semaphore(max(1, total))
+        self._per_host = max(1, per_host)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+
+    async def acquire(self, host: str) -> Callable[[], None]:
+        """Wait for a slot on ``host``; returns the (idempotent) release callback."""
+        gate = self._hosts.get(host)
+        if gate is None:
+            gate = self._hosts[host] = asyncio.Semaphore(self._per_host)
+        await gate.acquire()
+        try:
+            await self._total.acquire()
+        except BaseException:
+            gate.release()
+            raise
+
+        def release() -> None:
+            self._total.release()
+            gate.release()
+
+        return _once(release)
+
+
+_limits = {"total": POOL_MAX_CONNECTIONS, "per_host": POOL_PER_HOST}
+_async_gates: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, RequestGates]"
+_async_gates = weakref.WeakKeyDictionary()
+
+
+def configure_limits(total: int | None = None, per_host: int | None = None) -> None:
+    """Change the global/per-host request caps; call it before the loop's first request."""
+    if total:
+        _limits["total"] = total
+    if per_host:
+        _limits["per_host"] = per_host
+    _async_gates.clear()
+
+
+def _gates() -> RequestGates:
+    loop = asyncio.get_running_loop()
+    gates = _async_gates.get(loop)
+    if gates is None:
+        gates = _async_gates[loop] = RequestGates(**_limits)
+    return gates
+
+
+class RetryingAsyncTransport(httpx.AsyncBaseTransport):
+    """Pooled transport with shared request caps, retries with backoff and metrics."""
+
+    def __init__(self, profile: ClientProfile):
+        self.profile = profile
+        self._inner = httpx.AsyncHTTPTransport(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAX_CONNECTIONS
+            ),
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = _host(request.url)
+        gates = _gates()
+        attempt = 0
+        while True:
+            release = await gates.acquire(host)
+            started = time.perf_counter()
+            try:
+                response = await self._inner.handle_async_request(request)
+            except RETRY_ERRORS as exc:
+                release()
+                metrics.record(host, None, time.perf_counter() - started, attempt > 0)
+                if not _retryable(self.profile, request, attempt, error=exc):
+                    raise
+                await asyncio.sleep(_delay(self.profile, attempt, None))
+                attempt += 1
+                continue
+            except BaseException:
+                release()
+                metrics.record(host, None, time.perf_counter() - started, attempt > 0)
+                raise
+            metrics.record(host, response.status_code, time.perf_counter() - started, attempt > 0)
+            if response.status_code in self.profile.retry_statuses and _retryable(
+                self.profile, request, attempt, response=response
+            ):
+                # le o corpo (pagina de erro curta) para a conexao voltar ao pool
+                await response.aread()
+                await response.aclose()
+                release()
+                await asyncio.sleep(_delay(self.profile, attempt, response))
+                attempt += 1
+                continue
+            response.stream = _AsyncCountingStream(response.stream, host, release)
+            return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class RetryingSyncTransport(httpx.BaseTransport):
+    """Blocking counterpart of :class:`RetryingAsyncTransport` (safe to share across threads)."""
+
+    def __init__(self, profile: ClientProfile, per_host: int = POOL_PER_HOST):
+        self.profile = profile
+        self._per_host = max(1, per_host)
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._inner = httpx.HTTPTransport(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAX_CONNECTIONS
+            ),
+        )
+
+    def _gate(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            gate = self._hosts.get(host)
+            if gate is None:
+                gate = self._hosts[host] = threading.BoundedSemaphore(self._per_host)
+            return gate
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        host = _host(request.url)
+        gate = self._gate(host)
+        attempt = 0
+        while True:
+            gate.acquire()
+            release = _once(gate.release)
+            started = time.perf_counter()
+            try:
+                response = self._inner.handle_request(request)
+            except RETRY_ERRORS as exc:
+                release()
+                metrics.record(host, None, time.perf_counter() - started, attempt > 0)
+                if not _retryable(self.profile, request, attempt, error=exc):
+                    raise
+                time.sleep(_delay(self.profile, attempt, None))
+                attempt += 1
+                continue
+            except BaseException:
+                release()
+                metrics.record(host, None, time.perf_counter() - started, attempt > 0)
+                raise
+            metrics.record(host, response.status_code, time.perf_counter() - started, attempt > 0)
+            if response.status_code in self.profile.retry_statuses and _retryable(
+                self.profile, request, attempt, response=response
+            ):
+                response.read()
+                response.close()
+                release()
+                time.sleep(_delay(self.profile, attempt, response))
+                attempt += 1
+                continue
+            response.stream = _SyncCountingStream(response.stream, host, release)
+            return response
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+# ---------------------------------------------------------------------------- clientes
+
+
+def _client_options(name: str) -> Tuple[ClientProfile, Dict[str, Any]]:
+    profile = PROFILES.get(name) or PROFILES["default"]
+    return profile, {
+        "timeout": httpx.Timeout(profile.timeout, connect=profile.connect_timeout),
+        "headers": {"User-Agent": USER_AGENT},
+        "follow_redirects": True,
+    }
+
+
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]"
+_async_clients = weakref.WeakKeyDictionary()
+_sync_clients: Dict[str, httpx.Client] = {}
+_clients_lock = threading.Lock()
+
+
+def async_client(name: str = "default") -> httpx.AsyncClient:
+    """Long-lived pooled client for the running event loop (one per loop and profile).
+
+    Connections are reused across calls; callers must not close it (see :func:`aclose_clients`).
+    """
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is None or client.is_closed:
+            profile, options = _client_options(name)
+            client = clients[name] = httpx.AsyncClient(
+                transport=RetryingAsyncTransport(profile), **options
+            )
+        return client
+
+
+def sync_client(name: str = "default") -> httpx.Client:
+    """Process-wide pooled blocking client for ``name``; closed at interpreter exit."""
+    with _clients_lock:
+        client = _sync_clients.get(name)
+        if client is None or client.is_closed:
+            profile, options = _client_options(name)
+            client = _sync_clients[name] = httpx.Client(
+                transport=RetryingSyncTransport(profile), **options
+            )
+        return client
+
+
+async def aclose_clients() -> None:
+    """Close the pooled async clients of the running loop (call before the loop ends)."""
+    with _clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+
+def run(coro):
+    """``asyncio.run`` that closes the loop's pooled clients before the loop goes away."""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose_clients()
+
+    return asyncio.run(main())
+
+
+@atexit.register
+def _close_sync_clients() -> None:
+    with _clients_lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        client.close()
+
+
+class HostLimiter:
+    """Global + per-host concurrency caps shared by every request of a crawl."""
+
+    def __init__(self, total: int = DEFAULT_CONCURRENCY, per_host: int = PER_HOST_CONCURRENCY):
+        self._total = asyncio.Semaphore(max(1, total))
+        self._per_host_limit = max(1, per_host)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        host = _host(url)
+        host_sem = self._hosts.get(host)
+        if host_sem is None:
+            host_sem = self._hosts[host] = asyncio.Semaphore(self._per_host_limit)
+        async with host_sem:
+            async with self._total:
+                yield
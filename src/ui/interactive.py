@@ -1,6 +1,7 @@
 # src/ui/interactive.py
 from rich.table import Table
 from rich.console import Console
+from rich.markup import escape
 
 console = Console()
 
@@ -18,6 +19,15 @@ def print_layers(layers):
         table.add_row(str(i), disp, ly.get("geometryType") or "-", service_name)
     console.print(table)
 
+def print_found_layer(item):
+    # chamado a cada camada que chega do crawler, antes do fim do crawl; sem indice, porque a
+    # tabela final (print_layers) reordena e numera as camadas
+    svc = item["service"]
+    ly = item["layer"]
+    detail = f"({ly.get('geometryType') or '-'} | {svc.get('name')} [{svc.get('type')}])"
+    console.print(f"[cyan]   +[/cyan] {escape(ly['name'])} [dim]{escape(detail)}[/dim]",
+                  highlight=False)
+
 def parse_exclusions(s:str, n:int):
     # ex.: "1,5-9,12"
     s = s.strip()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from .cache import DiskCache, cache_root
+
+BLOB_NAMESPACE = "blobs"
+INDEX_NAME = "index.jsonl"
+CHUNK_SIZE = 1 << 20
+
+
+# mesma estrutura -> mesmos bytes -> mesmo hash, independente da ordem das chaves
+_CANONICAL = json.JSONEncoder(ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def canonical_json(value: Any) -> bytes:
+    return _CANONICAL.encode(value).encode("utf-8")
+
+
+def json_digest(value: Any) -> str:
+    """Hash :meth:`BlobStore.put_json` files ``value`` under."""
+    return hashlib.sha256(canonical_json(value)).hexdigest()
+
+
+def _link_or_copy(source: Path, dest: Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + f".{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        # outro disco ou sistema sem hardlink: copia
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, dest)
+
+
+class BlobWriter:
+    """Hash a payload while it is written to a temporary file; :meth:`commit` files it by hash."""
+
+    def __init__(self, store: "BlobStore"):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        tmp_dir = store.path / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+        self._tmp = Path(name)
+        self._handle = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self._handle.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> Tuple[str, bool]:
+        """Returns ``(sha256, new)``; ``new`` is False when the blob was already stored."""
+        self._handle.close()
+        digest = self._hash.hexdigest()
+        target = self.store.blob_path(digest)
+        if target.exists():
+            self._tmp.unlink(missing_ok=True)
+            return digest, False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self._tmp, target)
+        return digest, True
+
+    def abort(self) -> None:
+        self._handle.close()
+        self._tmp.unlink(missing_ok=True)
+
+    def __enter__(self) -> "BlobWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+
+
+class BlobStore:
+    """Content-addressed store for raw payloads and outputs (``<cache>/blobs`` by default).
+
+    Every unique payload is kept once under ``objects/<sha256[:2]>/<sha256>``. ``index.jsonl``
+    records which source (URL + parameters) produced which hash and when, and :meth:`mark` /
+    :meth:`processed` let later stages skip inputs they already handled. Files handed out by
+    :meth:`put_file` and :meth:`materialize` are hardlinks into the store whenever the
+    filesystem allows it, so identical layers across runs and cities take the space of one.
+    Writers must replace those files (write to a temp file + rename), never rewrite in place.
+    """
+
+    def __init__(self, root: str | Path | None = None):
+        self.path = Path(root) if root else cache_root() / BLOB_NAMESPACE
+        self.index_path = self.path / INDEX_NAME
+        self._markers = DiskCache("processed", root=self.path)
+
+    def blob_path(self, digest: str) -> Path:
+        return self.path / "objects" / digest[:2] / digest
+
+    def has(self, digest: str | None) -> bool:
+        return bool(digest) and self.blob_path(digest).exists()
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    def put_bytes(self, data: bytes) -> Tuple[str, bool]:
+        with self.writer() as writer:
+            writer.write(data)
+            return writer.commit()
+
+    def put_json(self, value: Any) -> Tuple[str, bool]:
+        # encode de uma vez (C); o iterencode em pedacos e ~3x mais lento
+        return self.put_bytes(canonical_json(value))
+
+    def put_file(self, path: Path) -> Tuple[str, bool]:
+        """Store ``path`` by content; ``path`` becomes a link to the stored blob."""
+        path = Path(path)
+        digest = hashlib.sha256()
+        with path.open("rb") as handle:
+            for chunk in iter(lambda: handle.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        target = self.blob_path(key)
+        if target.exists():
+            # ja existe: troca a copia nova pelo blob guardado
+            _link_or_copy(target, path)
+            return key, False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except FileExistsError:
+            return key, False
+        except OSError:
+            _link_or_copy(path, target)
+        return key, True
+
+    def materialize(self, digest: str, dest: Path) -> Path:
+        """Place blob ``digest`` at ``dest`` (hardlink, or a copy across filesystems)."""
+        _link_or_copy(self.blob_path(digest), Path(dest))
+        return Path(dest)
+
+    def record(self, url: str, params: Dict[str, Any] | None, digest: str, **meta: Any) -> None:
+        """Append ``url`` + ``params`` -> ``digest`` (with a timestamp) to the source index."""
+        entry = {"url": url, "params": params or {}, "sha256": digest, "at": time.time(), **meta}
+        self.path.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(entry, ensure_ascii=False, sort_keys=True, default=str) + "\n"
+        # uma linha por write com O_APPEND: varios processos podem registrar ao mesmo tempo
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def lookup(self, url: str, params: Dict[str, Any] | None = None) -> Dict[str, Any] | None:
+        """Latest index entry for ``url`` + ``params``."""
+        wanted = json.loads(json.dumps(params or {}, default=str))
+        latest = None
+        try:
+            with self.index_path.open("r", encoding="utf-8") as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("url") == url and entry.get("params") == wanted:
+                        latest = entry
+        except OSError:
+            return None
+        return latest
+
+    def content_key(self, digest: str, kind: str | None = None) -> str:
+        """Key stages mark blob ``digest`` under (see :meth:`mark`).
+
+        JSON payloads are keyed by their canonical form, the same hash :meth:`put_json` gives
+        the parsed data, so a raw download and the layer built from it meet on one key. Other
+        payloads are keyed by their raw bytes.
+        """
+        if kind not in ("json", "geojson"):
+            return digest
+        known = self._markers.get(f"canonical:{digest}")
+        if known:
+            return known["key"]
+        try:
+            with self.blob_path(digest).open("rb") as handle:
+                key = json_digest(json.load(handle))
+        except (OSError, ValueError):
+            return digest
+        self._markers.set(f"canonical:{digest}", {"key": key})
+        return key
+
+    def processed(self, stage: str, key: str) -> Dict[str, Any] | None:
+        """Result recorded by :meth:`mark` for ``key`` (an input hash) at ``stage``."""
+        return self._markers.get(f"{stage}:{key}")
+
+    def mark(self, stage: str, key: str, result: Dict[str, Any]) -> None:
+        self._markers.set(f"{stage}:{key}", result)
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+DEFAULT_CACHE_DIR = "out/.cache"
+
+
+def cache_root() -> Path:
+    return Path(os.getenv("FLOWS_CACHE_DIR") or DEFAULT_CACHE_DIR)
+
+
+class DiskCache:
+    """Small JSON key/value store on disk: one (optionally gzipped) file per key.
+
+    Entries carry ``stored_at`` so each caller decides its own freshness policy.
+    """
+
+    def __init__(self, namespace: str, root: Path | None = None, compress: bool = False):
+        self.path = (root or cache_root()) / namespace
+        self.compress = compress
+
+    def _file(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        suffix = ".json.gz" if self.compress else ".json"
+        return self.path / digest[:2] / f"{digest}{suffix}"
+
+    def load(self, key: str) -> Dict[str, Any] | None:
+        path = self._file(key)
+        try:
+            raw = path.read_bytes()
+            if self.compress:
+                raw = gzip.decompress(raw)
+            entry = json.loads(raw.decode("utf-8"))
+        except (OSError, ValueError, EOFError):
+            return None
+        return entry if isinstance(entry, dict) and entry.get("key") == key else None
+
+    def get(self, key: str, ttl: float | None = None) -> Any | None:
+        entry = self.load(key)
+        if entry is None or not is_fresh(entry, ttl):
+            return None
+        return entry.get("value")
+
+    def set(self, key: str, value: Any, **meta: Any) -> Dict[str, Any]:
+        entry = {"key": key, "stored_at": time.time(), "value": value, **meta}
+        path = self._file(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        raw = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        if self.compress:
+            raw = gzip.compress(raw)
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        tmp.write_bytes(raw)
+        os.replace(tmp, path)
+        return entry
+
+    def touch(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        meta = {k: v for k, v in entry.items() if k not in {"key", "stored_at", "value"}}
+        return self.set(entry["key"], entry.get("value"), **meta)
+
+    def delete(self, key: str) -> None:
+        self._file(key).unlink(missing_ok=True)
+
+
+def is_fresh(entry: Dict[str, Any], ttl: float | None) -> bool:
+    if ttl is None:
+        return True
+    return time.time() - float(entry.get("stored_at") or 0) <= ttl
@@ -1,10 +1,13 @@
 ﻿from __future__ import annotations
 
 import copy
+import io
 import json
+import os
 import zipfile
 from pathlib import Path
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
+from xml.sax.saxutils import escape as xml_escape
 
 try:
     from pyproj import Transformer  # type: ignore
@@ -18,7 +21,43 @@ def ensure_dir(path: Path) -> None:
 
 def save_geojson(geojson: dict[str, Any], path: Path) -> None:
     ensure_dir(path.parent)
-    path.write_text(json.dumps(geojson, ensure_ascii=False), encoding="utf-8")
+    # grava ao lado e troca: o destino pode ser um hardlink do blob store
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as handle:
+        json.dump(geojson, handle, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+FEATURE_COLLECTION_HEADER = '{"type": "FeatureCollection", "features": ['
+
+
+def write_feature_collection(features: Iterable[dict[str, Any]], path: Path) -> int:
+    """Stream features into a GeoJSON file, one feature per line; returns how many were written."""
+    ensure_dir(path.parent)
+    written = 0
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as handle:
+        handle.write(FEATURE_COLLECTION_HEADER)
+        for feature in features:
+            handle.write(",\n" if written else "\n")
+            handle.write(json.dumps(feature, ensure_ascii=False))
+            written += 1
+        handle.write("\n]}\n")
+    os.replace(tmp, path)
+    return written
+
+
+def iter_geojson_features(path: Path) -> Iterator[dict[str, Any]]:
+    # arquivos gravados por write_feature_collection/LayerSpool sao lidos linha a linha
+    with path.open("r", encoding="utf-8") as handle:
+        if handle.readline().strip() == FEATURE_COLLECTION_HEADER:
+            for line in handle:
+                line = line.strip().rstrip(",")
+                if line and line != "]}":
+                    yield json.loads(line)
+            return
+    with path.open("r", encoding="utf-8") as handle:
+        yield from json.load(handle).get("features") or []
 
 
 def _detect_epsg(geojson: dict[str, Any]) -> int | None:
@@ -119,53 +158,113 @@ def reproj_to_4326(geojson: dict[str, Any]) -> dict[str, Any]:
     return converted
 
 
-def to_kml_kmz(geojson: dict[str, Any], kmz_path: Path) -> None:
-    def coord_str(coords: Iterable[Iterable[float]]) -> str:
-        return " ".join(f"{x},{y},0" for x, y, *_ in coords)
+def _kml_coord_text(coords: Iterable[Iterable[float]]) -> str:
+    return " ".join(f"{x},{y},0" for x, y, *_ in coords)
+
+
+def _kml_point(coords: Any) -> str:
+    x, y, *_ = coords
+    return f"<Point><coordinates>{x},{y},0</coordinates></Point>"
+
+
+def _kml_line(coords: Any) -> str:
+    return f"<LineString><coordinates>{_kml_coord_text(coords)}</coordinates></LineString>"
+
 
-    kml = [
-        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>",
-        "<kml xmlns=\"http://www.opengis.net/kml/2.2\"><Document>",
+def _kml_polygon(rings: Any) -> str:
+    outer, *inner = rings
+    parts = [
+        "<Polygon><outerBoundaryIs><LinearRing><coordinates>",
+        _kml_coord_text(outer),
+        "</coordinates></LinearRing></outerBoundaryIs>",
     ]
-    for feature in geojson.get("features", []):
-        geometry = (feature or {}).get("geometry") or {}
-        props = (feature or {}).get("properties") or {}
-        name = props.get("name") or props.get("NOME") or ""
-        gtype = geometry.get("type")
-        coords = geometry.get("coordinates")
-        if gtype == "Point" and isinstance(coords, (list, tuple)):
-            x, y, *_ = coords
-            kml.extend([
-                "<Placemark>",
-                f"<name>{name}</name>" if name else "",
-                f"<Point><coordinates>{x},{y},0</coordinates></Point>",
-                "</Placemark>",
-            ])
-        elif gtype == "Polygon" and isinstance(coords, list) and coords:
-            outer = coords[0]
-            kml.extend([
-                "<Placemark>",
-                f"<name>{name}</name>" if name else "",
-                "<Polygon><outerBoundaryIs><LinearRing><coordinates>",
-                coord_str(outer),
-                "</coordinates></LinearRing></outerBoundaryIs></Polygon>",
-                "</Placemark>",
-            ])
-        elif gtype == "MultiPolygon" and isinstance(coords, list):
-            for poly in coords:
-                if not poly:
-                    continue
-                outer = poly[0]
-                kml.extend([
-                    "<Placemark>",
-                    f"<name>{name}</name>" if name else "",
-                    "<Polygon><outerBoundaryIs><LinearRing><coordinates>",
-                    coord_str(outer),
-                    "</coordinates></LinearRing></outerBoundaryIs></Polygon>",
-                    "</Placemark>",
-                ])
-    kml.append("</Document></kml>")
-    xml = "\n".join(line for line in kml if line).encode("utf-8")
+    for ring in inner:
+        if ring:
+            parts.extend(
+                [
+                    "<innerBoundaryIs><LinearRing><coordinates>",
+                    _kml_coord_text(ring),
+                    "</coordinates></LinearRing></innerBoundaryIs>",
+                ]
+            )
+    parts.append("</Polygon>")
+    return "".join(parts)
+
+
+def _kml_geometry(geometry: dict[str, Any]) -> str:
+    gtype = geometry.get("type")
+    if gtype == "GeometryCollection":
+        members = [
+            _kml_geometry(g) for g in geometry.get("geometries") or [] if isinstance(g, dict)
+        ]
+        members = [m for m in members if m]
+        return f"<MultiGeometry>{''.join(members)}</MultiGeometry>" if members else ""
+    coords = geometry.get("coordinates")
+    if not isinstance(coords, (list, tuple)) or not coords:
+        return ""
+    if gtype == "Point":
+        return _kml_point(coords)
+    if gtype == "LineString":
+        return _kml_line(coords) if len(coords) >= 2 else ""
+    if gtype == "Polygon":
+        return _kml_polygon(coords) if coords[0] else ""
+    if gtype == "MultiPoint":
+        members = [_kml_point(c) for c in coords if c]
+    elif gtype == "MultiLineString":
+        members = [_kml_line(c) for c in coords if len(c) >= 2]
+    elif gtype == "MultiPolygon":
+        members = [_kml_polygon(c) for c in coords if c and c[0]]
+    else:
+        return ""
+    if len(members) == 1:
+        return members[0]
+    return f"<MultiGeometry>{''.join(members)}</MultiGeometry>" if members else ""
+
+
+def write_kmz_features(features: Iterable[dict[str, Any]], kmz_path: Path) -> int:
+    """Stream Placemarks straight into ``doc.kml`` inside the KMZ; returns how many were written."""
     ensure_dir(kmz_path.parent)
-    with zipfile.ZipFile(kmz_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
-        archive.writestr("doc.kml", xml)
+    written = 0
+    tmp = kmz_path.with_name(kmz_path.name + ".tmp")
+    # data fixa: mesmo conteudo -> mesmos bytes (e o mesmo blob no blob store)
+    entry = zipfile.ZipInfo("doc.kml", date_time=(1980, 1, 1, 0, 0, 0))
+    entry.compress_type = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with io.TextIOWrapper(
+            archive.open(entry, "w", force_zip64=True), encoding="utf-8"
+        ) as handle:
+            handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            handle.write('<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n')
+            for feature in features:
+                geometry = (feature or {}).get("geometry") or {}
+                body = _kml_geometry(geometry) if isinstance(geometry, dict) else ""
+                if not body:
+                    continue
+                props = (feature or {}).get("properties") or {}
+                name = props.get("name") or props.get("NOME") or ""
+                handle.write("<Placemark>")
+                if name:
+                    handle.write(f"<name>{xml_escape(str(name))}</name>")
+                handle.write(body)
+                handle.write("</Placemark>\n")
+                written += 1
+            handle.write("</Document></kml>\n")
+    os.replace(tmp, kmz_path)
+    return written
+
+
+def to_kml_kmz(geojson: dict[str, Any], kmz_path: Path) -> None:
+    write_kmz_features(geojson.get("features") or [], kmz_path)
+
+
+def export_layer(
+    geojson: dict[str, Any], geojson_path: Path | None, kmz_path: Path | None
+) -> dict[str, Any]:
+    result: dict[str, Any] = {}
+    if geojson_path is not None:
+        save_geojson(geojson, geojson_path)
+        result["geojson"] = str(geojson_path)
+    if kmz_path is not None:
+        to_kml_kmz(geojson, kmz_path)
+        result["kmz"] = str(kmz_path)
+    return result
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import struct
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+# tipos de fio do protobuf
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+
+def read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("varint truncado")
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("varint longo demais")
+
+
+def encode_varint(value: int) -> bytes:
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value: int) -> int:
+    # int32/int64 negativos chegam como complemento de dois em 64 bits
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def iter_fields(buf: bytes) -> Iterator[Tuple[int, int, int | bytes]]:
+    """Yield ``(field_number, wire_type, value)`` for each field of a protobuf message.
+
+    Varints come back as (unsigned) ints, everything else as the raw bytes.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        number, wire = key >> 3, key & 0x07
+        if wire == VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire == LENGTH_DELIMITED:
+            size, pos = read_varint(buf, pos)
+            value = buf[pos : pos + size]
+            pos += size
+        elif wire == FIXED64:
+            value = buf[pos : pos + 8]
+            pos += 8
+        elif wire == FIXED32:
+            value = buf[pos : pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"tipo de fio nao suportado: {wire}")
+        if pos > end:
+            raise ValueError("mensagem truncada")
+        yield number, wire, value
+
+
+def packed_varints(buf: bytes) -> List[int]:
+    values = []
+    pos = 0
+    while pos < len(buf):
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def packed_sint(buf: bytes) -> List[int]:
+    return [zigzag(value) for value in packed_varints(buf)]
+
+
+def varint_array(buf: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode a run of varints at once: returns the values (uint64) and each one's last byte.
+
+    Vectorized counterpart of :func:`packed_varints` for large packed fields; concatenated
+    packed fields decode in one call and the byte positions tell where each one ended.
+    """
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    if not len(raw):
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    last = raw < 0x80
+    if not last[-1]:
+        raise ValueError("varint truncado")
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    group = np.concatenate(([0], np.cumsum(last[:-1])))
+    shift = (np.arange(len(raw)) - starts[group]) * 7
+    if shift.max() > 63:
+        raise ValueError("varint longo demais")
+    payload = (raw & 0x7F).astype(np.uint64) << shift.astype(np.uint64)
+    return np.add.reduceat(payload, starts), ends
+
+
+def zigzag_array(values: np.ndarray) -> np.ndarray:
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def as_double(raw: bytes) -> float:
+    return struct.unpack("<d", raw)[0]
+
+
+def as_float(raw: bytes) -> float:
+    return struct.unpack("<f", raw)[0]
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List
+
+from utils.io import FEATURE_COLLECTION_HEADER, ensure_dir, write_kmz_features
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class LayerSpool:
+    """Per-layer checkpoint directory: a manifest with the download plan plus one file per chunk.
+
+    A chunk file only appears (atomic rename) once its features are complete, so the set of
+    chunk files on disk is the resume state. Chunks are GeoJSONSeq and are streamed into the
+    final GeoJSON, so nothing bigger than one page is ever held in memory.
+    """
+
+    def __init__(self, root: Path, identity: Dict[str, Any]):
+        self.identity = identity
+        digest = hashlib.sha1(
+            json.dumps(identity, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()[:16]
+        self.path = Path(root) / digest
+        ensure_dir(self.path)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.path / MANIFEST_NAME
+
+    def load_manifest(self) -> Dict[str, Any] | None:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if manifest.get("identity") != json.loads(json.dumps(self.identity, default=str)):
+            return None
+        return manifest
+
+    def save_manifest(self, manifest: Dict[str, Any]) -> None:
+        manifest = manifest | {"identity": self.identity, "updated_at": int(time.time())}
+        _write_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False, default=str))
+
+    def chunk_path(self, index: int) -> Path:
+        return self.path / f"chunk_{index:05d}.geojsonl"
+
+    def has_chunk(self, index: int) -> bool:
+        return self.chunk_path(index).exists()
+
+    def write_chunk(self, index: int, features: Iterable[Dict]) -> None:
+        # GeoJSONSeq: uma feicao por linha, para poder reler o bloco sem carregá-lo inteiro
+        path = self.chunk_path(index)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as handle:
+            for feature in features:
+                handle.write(json.dumps(feature, ensure_ascii=False))
+                handle.write("\n")
+        os.replace(tmp, path)
+
+    def iter_chunk_lines(self, index: int) -> Iterator[str]:
+        with self.chunk_path(index).open("r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if line:
+                    yield line
+
+    def iter_features(self, total: int) -> Iterator[Dict]:
+        for index in range(total):
+            for line in self.iter_chunk_lines(index):
+                yield json.loads(line)
+
+    def completed(self) -> set[int]:
+        return {
+            int(path.name[len("chunk_") : -len(".geojsonl")])
+            for path in self.path.glob("chunk_*.geojsonl")
+        }
+
+    def finalize(self, total: int, dest: Path, kmz_path: Path | None = None) -> Dict[str, Any]:
+        """Stream every chunk, in order, into ``dest`` (and optionally a KMZ); returns stats."""
+        ensure_dir(dest.parent)
+        chunks: List[Dict[str, int]] = []
+        written = 0
+        tmp = dest.with_name(dest.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as handle:
+            handle.write(FEATURE_COLLECTION_HEADER)
+            for index in range(total):
+                count = 0
+                for line in self.iter_chunk_lines(index):
+                    handle.write(",\n" if written else "\n")
+                    handle.write(line)
+                    written += 1
+                    count += 1
+                chunks.append(
+                    {
+                        "index": index,
+                        "features": count,
+                        "bytes": self.chunk_path(index).stat().st_size,
+                    }
+                )
+            handle.write("\n]}\n")
+        os.replace(tmp, dest)
+        stats: Dict[str, Any] = {
+            "geojson": str(dest),
+            "features": written,
+            "bytes": dest.stat().st_size,
+            "chunks": chunks,
+        }
+        if kmz_path is not None:
+            write_kmz_features(self.iter_features(total), kmz_path)
+            stats["kmz"] = str(kmz_path)
+        return stats
+
+    def reset(self) -> None:
+        for path in self.path.glob("chunk_*"):
+            path.unlink(missing_ok=True)
+        self.manifest_path.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from devtools.fake_arcgis import FakeArcGIS
+from services.arcgis_download import download_layer
+
+FEATURES = 2500
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("FLOWS_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def _download(fake: FakeArcGIS, dest):
+    return asyncio.run(download_layer(fake.layer_query_urls()[0], dest))
+
+
+def _oids(dest) -> list:
+    with dest.open(encoding="utf-8") as handle:
+        features = json.load(handle)["features"]
+    return sorted(feature["properties"]["OBJECTID"] for feature in features)
+
+
+@pytest.mark.parametrize("pagination", [True, False], ids=["offset", "oid"])
+@pytest.mark.parametrize("pbf", [True, False], ids=["pbf", "geojson"])
+def test_download_is_complete(tmp_path, pagination, pbf):
+    dest = tmp_path / "camada.geojson"
+    with FakeArcGIS(1, 1, 1, features=FEATURES, supports_pagination=pagination, pbf=pbf) as fake:
+        stats = _download(fake, dest)
+    assert stats["features"] == FEATURES
+    assert _oids(dest) == list(range(1, FEATURES + 1))
+
+
+@pytest.mark.parametrize("pagination", [True, False], ids=["offset", "oid"])
+def test_server_capped_below_max_record_count(tmp_path, pagination):
+    # anuncia 1000 por pagina mas so entrega 300: as janelas curtas sao completadas
+    dest = tmp_path / "camada.geojson"
+    fake = FakeArcGIS(
+        1, 1, 1, features=FEATURES, supports_pagination=pagination, transfer_limit=300
+    )
+    with fake:
+        stats = _download(fake, dest)
+    assert stats["features"] == FEATURES
+    assert _oids(dest) == list(range(1, FEATURES + 1))
+
+
+def test_transient_failures_are_retried(tmp_path):
+    dest = tmp_path / "camada.geojson"
+    with FakeArcGIS(1, 1, 1, features=FEATURES, failure_rate=0.3, seed=3) as fake:
+        stats = _download(fake, dest)
+        failures = fake.stats["failures"]
+    assert failures > 0
+    assert stats["features"] == FEATURES
+    assert _oids(dest) == list(range(1, FEATURES + 1))
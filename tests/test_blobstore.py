@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+from devtools.fake_arcgis import FakeArcGIS
+from pipelines.postprocess import finish_layer
+from src.common.tools import Tools
+from utils.blobstore import BlobStore, json_digest
+
+QUERY = {"where": "1=1", "outFields": "*", "f": "geojson", "resultRecordCount": 50}
+
+
+def test_content_key_matches_put_json(tmp_path):
+    store = BlobStore(tmp_path)
+    value = {"type": "FeatureCollection", "features": [{"b": 1, "a": 2}]}
+    raw, _new = store.put_bytes(json.dumps(value, indent=2).encode("utf-8"))
+    assert store.content_key(raw, "geojson") == store.put_json(value)[0] == json_digest(value)
+    assert store.content_key(raw, "pdf") == raw
+
+
+def test_second_ingest_reports_processed_stages(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    with FakeArcGIS(folders=1, services=1, layers=1, features=50) as fake:
+        catalog = {
+            "camadas": [{"name": "camada", "url": fake.layer_query_urls()[0], "params": QUERY}]
+        }
+        first = asyncio.run(Tools(store).ingest(catalog))["sources"][0]
+        assert first["changed"] and first["processed"] == []
+
+        geojson = json.loads(store.blob_path(first["sha256"]).read_bytes())
+        finish_layer(geojson, tmp_path / "camada.geojson", None, store, origin=first)
+
+        second = asyncio.run(Tools(store).ingest(catalog))["sources"][0]
+    assert second["sha256"] == first["sha256"]
+    assert not second["changed"]
+    assert second["processed"] == ["export"]
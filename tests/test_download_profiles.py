@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import json
+
+from services.download_profiles import QUANTIZATION_EXTENT, geojson_params, profile_params
+
+INFO = {
+    "displayField": "NOME",
+    "fields": [
+        {"name": "OBJECTID", "type": "esriFieldTypeOID"},
+        {"name": "NOME", "type": "esriFieldTypeString"},
+        {"name": "AREA", "type": "esriFieldTypeDouble"},
+    ],
+}
+
+
+def test_pbf_quantization_has_fixed_extent():
+    params = profile_params("display", INFO, "pbf")
+    quantization = json.loads(params["quantizationParameters"])
+    assert quantization["mode"] == "view"
+    assert quantization["extent"] == QUANTIZATION_EXTENT
+    assert "maxAllowableOffset" not in params
+
+
+def test_geojson_fallback_drops_quantization():
+    query = {"where": "1=1", "f": "pbf"} | profile_params("display", INFO, "pbf")
+    fallback = geojson_params(query)
+    assert "quantizationParameters" not in fallback
+    assert fallback["f"] == "geojson"
+    assert fallback == {"where": "1=1", "f": "geojson"} | profile_params("display", INFO, "geojson")
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+
+from devtools.fake_overpass import FakeOverpass
+from services.overpass import OverpassClient, clip_tile, tile_grid
+from services.transport import PROFILES
+from utils.cache import DiskCache
+
+KINDS = ["hospital", "clinic", "school", "kindergarten", "bus_stop"]
+# municipio pequeno dentro de um unico tile de 0.25 grau
+SMALL = (-51.20, -23.35, -51.15, -23.30)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache("overpass", root=tmp_path, compress=True)
+
+
+def _expected(fake: FakeOverpass, bbox) -> set:
+    return {
+        element["id"]
+        for element in fake.elements
+        if bbox[0] <= element["lon"] <= bbox[2] and bbox[1] <= element["lat"] <= bbox[3]
+    }
+
+
+def _pois(client: OverpassClient, bbox) -> set:
+    collection = asyncio.run(client.pois(bbox, KINDS)) or {"features": []}
+    return {feature["properties"]["id"] for feature in collection["features"]}
+
+
+def test_small_bbox_queries_only_its_part_of_the_tile():
+    (tile,) = tile_grid(SMALL)
+    area = clip_tile(tile, SMALL)
+    assert (area[2] - area[0]) * (area[3] - area[1]) < (tile[2] - tile[0]) * (tile[3] - tile[1]) / 4
+    assert (
+        area[0] <= SMALL[0] and area[1] <= SMALL[1] and area[2] >= SMALL[2] and area[3] >= SMALL[3]
+    )
+
+
+def test_pois_complete_and_second_run_from_cache(cache):
+    with FakeOverpass(pois=3000, way_fraction=0.0, relation_fraction=0.0) as fake:
+        client = OverpassClient(url=fake.url, cache=cache)
+        assert _pois(client, SMALL) == _expected(fake, SMALL)
+        first = dict(fake.stats)
+        # so a parte do tile perto do bbox: bem menos elementos que o tile inteiro
+        assert first["elements"] < len(fake.elements) / 4
+
+        again = OverpassClient(url=fake.url, cache=cache)
+        assert _pois(again, SMALL) == _expected(fake, SMALL)
+        assert fake.stats["requests"] == first["requests"]
+        assert again.misses == 0 and again.hits > 0
+
+
+def test_timed_out_query_is_split(cache):
+    with FakeOverpass(pois=500, max_area=0.003) as fake:
+        client = OverpassClient(url=fake.url, cache=cache)
+        assert _pois(client, SMALL) == _expected(fake, SMALL)
+        assert client.splits > 0
+
+
+def test_rate_limited_query_retried_per_profile(cache):
+    with FakeOverpass(pois=100, slots=0) as fake:
+        client = OverpassClient(url=fake.url, cache=cache)
+        with pytest.raises(httpx.HTTPStatusError):
+            _pois(client, SMALL)
+        assert fake.stats["rate_limited"] == PROFILES["default"].retries + 1
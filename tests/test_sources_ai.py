@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from devtools.fake_openai import FakeOpenAI
+from services import sources_ai
+from utils.cache import DiskCache
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    monkeypatch.setenv("FLOWS_CACHE_DIR", str(tmp_path / "cache"))
+    with FakeOpenAI(latency=0.2) as server:
+        monkeypatch.setattr(sources_ai, "OPENAI_BASE_URL", server.url)
+        monkeypatch.setattr(sources_ai, "OPENAI_API_KEY", "sk-test")
+        yield server
+
+
+def test_roots_second_run_from_cache(fake):
+    first = asyncio.run(sources_ai.ai_discover_arcgis_roots("Londrina", "PR"))
+    assert first and all("londrina" in root for root in first)
+    assert fake.stats["requests"] == 1
+
+    assert asyncio.run(sources_ai.ai_discover_arcgis_roots("Londrina", "PR")) == first
+    assert fake.stats["requests"] == 1
+
+
+def test_concurrent_prompts_share_one_request(fake, tmp_path):
+    cache = DiskCache("openai", root=tmp_path)
+
+    async def ask_many():
+        return await asyncio.gather(
+            *(sources_ai.ask_json("Município: Maringá - PR.", cache) for _ in range(5))
+        )
+
+    answers = asyncio.run(ask_many())
+    assert all(answer == answers[0] for answer in answers)
+    assert fake.stats["requests"] == 1
+
+
+def test_invalid_answer_is_cached_as_empty(tmp_path, monkeypatch):
+    monkeypatch.setenv("FLOWS_CACHE_DIR", str(tmp_path / "cache"))
+    with FakeOpenAI(invalid=True) as fake:
+        monkeypatch.setattr(sources_ai, "OPENAI_BASE_URL", fake.url)
+        monkeypatch.setattr(sources_ai, "OPENAI_API_KEY", "sk-test")
+        for _ in range(2):
+            assert asyncio.run(sources_ai.ai_discover_sources("Cambé", "PR")) == []
+        assert fake.stats["requests"] == 1
+
+
+def test_no_api_key_makes_no_request(fake, monkeypatch):
+    monkeypatch.setattr(sources_ai, "OPENAI_API_KEY", None)
+    assert asyncio.run(sources_ai.ai_discover_sources("Londrina", "PR")) == []
+    assert fake.stats["requests"] == 0
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from devtools.fake_directions import FakeDirections
+from src.pipelines import traffic_metrics
+from src.pipelines.traffic_scorecard import run_scorecard_async
+
+CANDIDATES = [
+    {
+        "name": f"trecho {index}",
+        "origin": {"latitude": -23.31 + index * 0.01, "longitude": -51.16},
+        "destination": {"latitude": -23.31 + index * 0.01, "longitude": -51.14},
+    }
+    for index in range(4)
+]
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("FLOWS_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def _scorecard(outdir, qps: float = 2.0) -> dict:
+    return asyncio.run(run_scorecard_async("test-key", CANDIDATES, outdir, qps=qps, bucket="15"))
+
+
+def test_scorecard_paced_then_served_from_cache(tmp_path, monkeypatch):
+    # folga sobre a cota: jitter de rede pode juntar 3 requisicoes espacadas a 2/s em 1 s
+    with FakeDirections(qps=3) as fake:
+        monkeypatch.setattr(traffic_metrics, "GOOGLE_DIRECTIONS_URL", fake.url)
+        first = _scorecard(tmp_path / "out")
+        assert not first["errors"]
+        assert fake.stats["requests"] == len(CANDIDATES)
+        assert fake.stats["over_query_limit"] == 0 and fake.stats["peak_qps"] <= 3
+
+        again = _scorecard(tmp_path / "out")
+        assert not again["errors"]
+        assert again["cache"]["hits"] == len(CANDIDATES)
+        assert fake.stats["requests"] == len(CANDIDATES)
+
+
+def test_over_query_limit_retried_then_raised(monkeypatch):
+    monkeypatch.setattr(traffic_metrics, "QUOTA_BACKOFF_SECONDS", 0.01)
+    with FakeDirections(qps=0) as fake:
+        monkeypatch.setattr(traffic_metrics, "GOOGLE_DIRECTIONS_URL", fake.url)
+        segment = CANDIDATES[0]
+        with pytest.raises(traffic_metrics.TrafficMetricsError, match="OVER_QUERY_LIMIT"):
+            asyncio.run(
+                traffic_metrics.run_segment_async(
+                    "test-key", segment["origin"], segment["destination"]
+                )
+            )
+        assert fake.stats["requests"] == traffic_metrics.QUOTA_RETRIES + 1
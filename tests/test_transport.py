@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+
+from services.transport import ClientProfile, RetryingAsyncTransport, RetryingSyncTransport
+
+RETRIES = 2
+PROFILE = ClientProfile(
+    timeout=5.0, retries=RETRIES, backoff=0.0, retry_methods=frozenset({"GET", "POST"})
+)
+
+
+def _calls(method: str, answer, sync: bool = False) -> int:
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        if isinstance(answer, type) and issubclass(answer, Exception):
+            raise answer("falha", request=request)
+        return httpx.Response(answer, headers={"Retry-After": "0"})
+
+    if sync:
+        transport = RetryingSyncTransport(PROFILE)
+        transport._inner = httpx.MockTransport(handler)
+        with httpx.Client(transport=transport) as client:
+            try:
+                client.request(method, "http://api.test/v1")
+            except httpx.HTTPError:
+                pass
+        return len(calls)
+
+    async def go() -> None:
+        transport = RetryingAsyncTransport(PROFILE)
+        transport._inner = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            try:
+                await client.request(method, "http://api.test/v1")
+            except httpx.HTTPError:
+                pass
+
+    asyncio.run(go())
+    return len(calls)
+
+
+@pytest.mark.parametrize("sync", [False, True], ids=["async", "sync"])
+@pytest.mark.parametrize(
+    "method, answer, expected",
+    [
+        ("GET", 503, RETRIES + 1),
+        ("GET", 429, RETRIES + 1),
+        ("GET", httpx.RemoteProtocolError, RETRIES + 1),
+        ("POST", 429, RETRIES + 1),
+        ("POST", httpx.ConnectError, RETRIES + 1),
+        # o servidor pode ter executado (e cobrado) o pedido: nao repete
+        ("POST", 502, 1),
+        ("POST", 503, 1),
+        ("POST", httpx.RemoteProtocolError, 1),
+        ("GET", 200, 1),
+    ],
+)
+def test_retries(method, answer, expected, sync):
+    assert _calls(method, answer, sync) == expected